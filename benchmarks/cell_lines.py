@@ -0,0 +1,67 @@
+"""Microbenchmarks of the per-cell post-processing of BlackFormatter.apply_format.
+
+Compares the current implementation with the previous one, which swapped every "\\n" for a uuid4 string character by
+character and copied the whole invalid report for every cell.
+
+    $ python benchmarks/cell_lines.py
+"""
+
+import timeit
+import uuid
+from functools import partial
+from typing import Any, Callable, Dict, List
+
+from jupyterblack.parser import _to_code, _to_lines  # pylint: disable=protected-access
+
+
+def previous_to_lines(code: str) -> List[str]:
+    newline_hash = str(uuid.uuid4())
+    blacked_cell = _to_code([newline_hash if char == "\n" else char for char in code])
+    blacked_cell_lines = blacked_cell.split(newline_hash)
+    if blacked_cell_lines[-1] != "":
+        blacked_cell_lines.append("")
+    return [line + "\n" for line in blacked_cell_lines[:-1]]
+
+
+def previous_merge(reports: List[Dict[str, str]]) -> Dict[str, str]:
+    invalid_report: Dict[str, str] = {}
+    for report in reports:
+        invalid_report = {**invalid_report, **report}
+    return invalid_report
+
+
+def merge(reports: List[Dict[str, str]]) -> Dict[str, str]:
+    invalid_report: Dict[str, str] = {}
+    for report in reports:
+        invalid_report.update(report)
+    return invalid_report
+
+
+def best_time(func: Callable[..., Any], *args: Any, number: int = 5) -> float:
+    return min(timeit.repeat(partial(func, *args), number=number, repeat=3)) / number
+
+
+def bench(name: str, previous: float, current: float) -> None:
+    print(
+        f"{name:<40} previous {previous * 1000:9.2f} ms   current {current * 1000:9.2f} ms   x{previous / current:.0f}"
+    )
+
+
+def main() -> None:
+    for n_lines in (100, 10_000):
+        code = "".join(f"value_{i} = compute({i}, key='abc', other=[1, 2, 3])\n" for i in range(n_lines))
+        assert previous_to_lines(code) == _to_lines(code)
+        bench(f"split cell of {n_lines} lines", best_time(previous_to_lines, code), best_time(_to_lines, code))
+
+    for n_cells in (100, 5_000):
+        reports = [{f"invalid cell {i} +": "Cannot parse"} for i in range(n_cells)]
+        assert previous_merge(reports) == merge(reports)
+        bench(
+            f"merge reports of {n_cells} invalid cells",
+            best_time(previous_merge, reports, number=1),
+            best_time(merge, reports, number=1),
+        )
+
+
+if __name__ == "__main__":
+    main()
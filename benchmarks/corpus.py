@@ -0,0 +1,142 @@
+"""Deterministic generator of synthetic notebook corpora for benchmarks.
+
+A corpus mixes the notebooks jblack meets in practice: many small notebooks, a few huge ones, notebooks whose size is
+mostly base64 images in outputs, notebooks full of IPython magics, and notebooks with invalid cells. The same scale
+and seed always write the same bytes, so that runs can be compared.
+
+Notebooks are written in the layout of Jupyter (nbformat) by default: sorted keys, non-ASCII characters as is and a
+final newline, with non-ASCII text in some notebooks. The jblack layout is the one jblack writes notebooks in, which
+only notebooks formatted by jblack before are in, and which is formatted without decoding notebooks in full.
+
+    $ python benchmarks/corpus.py DIRECTORY [SCALE [LAYOUT]]
+"""
+
+import base64
+import json
+import random
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple
+
+# Number of notebooks of each kind at scale 1, and code cells per notebook
+KINDS = {
+    "small": (200, 8),
+    "huge": (2, 1500),
+    "outputs": (20, 12),
+    "magics": (30, 10),
+    "invalid": (10, 10),
+}
+# Size of the fake PNG of each code cell of output-heavy notebooks
+IMAGE_BYTES = 48 * 1024
+
+_NAMES = ("data", "frame", "model", "result", "values", "config", "items", "total", "score", "index")
+
+
+# Layouts of the notebook files
+LAYOUTS: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    "jupyter": lambda notebook: json.dumps(notebook, indent=1, sort_keys=True, ensure_ascii=False) + "\n",
+    "jblack": lambda notebook: json.dumps(notebook, indent=1),
+}
+# One in that many notebooks has non-ASCII text
+NON_ASCII_EVERY = 3
+
+
+class CorpusInfo(NamedTuple):
+    n_notebooks: int
+    n_cells: int
+    n_bytes: int
+
+
+def _name(rng: random.Random) -> str:
+    return f"{rng.choice(_NAMES)}_{rng.randrange(100)}"
+
+
+def _code_cell(rng: random.Random) -> List[str]:
+    """Unformatted but valid Python, in the shapes notebooks are made of."""
+    kind = rng.randrange(5)
+    name, other = _name(rng), _name(rng)
+    if kind == 0:
+        lines = [f"def {name}( {other},x = 1 ,*args):\n", f"    y={other}+x\n", "    return {'a':y,'b' : [x,x ,x]}"]
+    elif kind == 1:
+        args = ", ".join(f"'{_name(rng)}'" for _ in range(rng.randrange(4, 12)))
+        lines = [f"{name} = pd.DataFrame( {{'col':[ {args} ]}} )\n", f"{name}.head( )"]
+    elif kind == 2:
+        lines = [
+            f"class {name.title().replace('_', '')}( object ):\n",
+            "    def __init__(self,a,b) :\n",
+            "        self.a=a; self.b = b\n",
+            "\n",
+            "    def total( self ): return self.a+self.b",
+        ]
+    elif kind == 3:
+        lines = [f"for i in range( {rng.randrange(10, 100)} ):\n", f"    {name}.append( i**2 if i%2 else -i )"]
+    else:
+        lines = [f"{name}=[ x for x in {other} if x>{rng.randrange(10)} ]\n", f"print( len({name}) ,'items' )"]
+    return lines
+
+
+def _magic_cell(rng: random.Random) -> List[str]:
+    kind = rng.randrange(4)
+    name = _name(rng)
+    if kind == 0:
+        return [f"%time {name} = compute( {rng.randrange(10)} )\n", f"!ls -la /tmp/{name}\n", f"print( {name} )"]
+    if kind == 1:
+        return ["%%bash\n", f"echo {name}  |  wc -c"]
+    if kind == 2:
+        return [f"files = !ls {name}\n", f"{name}?\n", "len( files )"]
+    return ["%matplotlib inline\n", f"{name} = [1,2 , 3]"]
+
+
+def _invalid_cell(rng: random.Random) -> List[str]:
+    return [f"def {_name(rng)}(:\n", "    return ("]
+
+
+def _image_output(rng: random.Random) -> Dict[str, Any]:
+    image = rng.getrandbits(IMAGE_BYTES * 8).to_bytes(IMAGE_BYTES, "little")
+    data = {"image/png": base64.b64encode(image).decode("ascii"), "text/plain": ["<Figure size 640x480 with 1 Axes>"]}
+    return {"data": data, "metadata": {}, "output_type": "display_data"}
+
+
+def _notebook(rng: random.Random, kind: str, n_cells: int, non_ascii: bool = False) -> Dict[str, Any]:
+    cell_sources: Dict[str, Callable[[random.Random], List[str]]] = {"magics": _magic_cell, "invalid": _invalid_cell}
+    title = f"# {kind} notebook" + (" — données réelles" if non_ascii else "")
+    cells: List[Dict[str, Any]] = [{"cell_type": "markdown", "metadata": {}, "source": [title]}]
+    for i in range(n_cells):
+        source = cell_sources[kind](rng) if kind in cell_sources and i % 2 == 0 else _code_cell(rng)
+        outputs = [_image_output(rng)] if kind == "outputs" else []
+        cells.append(
+            {"cell_type": "code", "execution_count": i + 1, "metadata": {}, "outputs": outputs, "source": source}
+        )
+    return {
+        "cells": cells,
+        "metadata": {"kernelspec": {"display_name": "Python 3", "language": "python", "name": "python3"}},
+        "nbformat": 4,
+        "nbformat_minor": 4,
+    }
+
+
+def write_corpus(directory: Path, scale: float = 1.0, seed: int = 0, layout: str = "jupyter") -> CorpusInfo:
+    """Write the notebooks of a corpus under directory, in a subdirectory per kind, in one of LAYOUTS."""
+    dumps = LAYOUTS[layout]
+    rng = random.Random(seed)
+    n_notebooks = n_cells = n_bytes = 0
+    for kind, (count, cells_per_notebook) in KINDS.items():
+        (directory / kind).mkdir(parents=True, exist_ok=True)
+        for i in range(max(1, round(count * scale))):
+            notebook = _notebook(rng, kind, cells_per_notebook, non_ascii=i % NON_ASCII_EVERY == 0)
+            data = dumps(notebook).encode("utf-8")
+            (directory / kind / f"{kind}_{i}.ipynb").write_bytes(data)
+            n_notebooks += 1
+            n_cells += cells_per_notebook
+            n_bytes += len(data)
+    return CorpusInfo(n_notebooks, n_cells, n_bytes)
+
+
+def main() -> None:
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    info = write_corpus(Path(sys.argv[1]), scale, layout=sys.argv[3] if len(sys.argv) > 3 else "jupyter")
+    print(f"{info.n_notebooks} notebooks, {info.n_cells} code cells, {info.n_bytes / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
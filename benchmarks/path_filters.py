@@ -0,0 +1,96 @@
+"""Benchmarks of notebook discovery and filtering on synthetic trees.
+
+Filtering compares filter_files with the previous implementation, which compiled every regex on each call and matched
+each path against every regex, over a synthetic list of 500k paths. Discovery compares Path.glob followed by filtering
+with the pruned walk of iter_dir_files on a tree created on disk, where a quarter of the notebooks are in excluded
+directories.
+
+    $ python benchmarks/path_filters.py [N_PATHS] [N_FILES_ON_DISK]
+"""
+
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Iterable, List, Sequence, Tuple, TypeVar
+
+from jupyterblack.util.files import compile_excludes, filter_files, iter_dir_files
+
+T = TypeVar("T")
+
+INCLUDE_REGEXES = ("/team_[0-7]/", "/shared/")
+EXCLUDE_REGEXES = (r"/\.ipynb_checkpoints/", "/node_modules/", "/scratch_")
+DIRECTORIES = ("analysis", "models", ".ipynb_checkpoints", "node_modules/pkg", "reports/2020")
+
+
+def previous_filter_files(
+    files: Iterable[str], include_regexes: Sequence[str] = (), exclude_regexes: Sequence[str] = ()
+) -> List[str]:
+    include = [re.compile(regex) for regex in (".*.ipynb", *include_regexes)]
+    exclude = [re.compile(regex) for regex in exclude_regexes]
+    return [
+        file
+        for file in files
+        if all(regex.match(file) for regex in include) and not any(regex.match(file) for regex in exclude)
+    ]
+
+
+def synthetic_paths(n_paths: int, root: str = "/repo") -> List[str]:
+    """Deterministic paths of notebooks and other files, spread over teams, projects and directories."""
+    paths = []
+    for i in range(n_paths):
+        directory = DIRECTORIES[i % len(DIRECTORIES)]
+        name = f"scratch_{i}" if i % 11 == 0 else f"notebook_{i}"
+        extension = ".py" if i % 7 == 0 else ".ipynb"
+        paths.append(f"{root}/team_{i % 10}/project_{i % 97}/{directory}/{name}{extension}")
+    return paths
+
+
+def timed(func: Callable[[], T]) -> Tuple[T, float]:
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def bench(name: str, previous: float, current: float) -> None:
+    print(
+        f"{name:<40} previous {previous * 1000:9.1f} ms   current {current * 1000:9.1f} ms   x{previous / current:.1f}"
+    )
+
+
+def bench_filters(n_paths: int) -> None:
+    paths = synthetic_paths(n_paths)
+    includes = [f"/repo{regex}" for regex in INCLUDE_REGEXES]
+    excludes = [f".*{regex}" for regex in EXCLUDE_REGEXES]
+    previous, previous_time = timed(lambda: previous_filter_files(paths, includes[:1], excludes))
+    current, current_time = timed(lambda: filter_files(paths, includes[:1], excludes))
+    assert previous == current
+    bench(f"filter {n_paths} paths", previous_time, current_time)
+
+
+def bench_walk(n_files: int) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        for path in synthetic_paths(n_files, root=temp_dir):
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            Path(path).touch()
+        excludes = [f".*{regex}" for regex in EXCLUDE_REGEXES]
+        previous, previous_time = timed(
+            lambda: previous_filter_files(map(str, root.glob("**/*.ipynb")), exclude_regexes=excludes)
+        )
+        exclude = compile_excludes("|".join(EXCLUDE_REGEXES))
+        current, current_time = timed(lambda: list(iter_dir_files(root, exclude=exclude, gitignore=False)))
+        assert sorted(previous) == sorted(current)
+        bench(f"discover {n_files} files on disk", previous_time, current_time)
+
+
+def main() -> None:
+    n_paths = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    n_files = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+    bench_filters(n_paths)
+    bench_walk(n_files)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""End-to-end benchmark of jblack on a synthetic corpus (see corpus.py), in check and format modes.
+
+Every run is a fresh `python -m jupyterblack --no-cache` process, timed from start to exit, with the peak RSS of the
+process and its workers. Format runs work on a fresh copy of the corpus. The corpus is written in each of the layouts
+of corpus.py, which are reported separately: notebooks saved by Jupyter take slower paths than notebooks that jblack
+formatted before. Results are written as JSON and can be
+compared with the results of a previous run, e.g. on the main branch:
+
+    $ python benchmarks/throughput.py --output baseline.json
+    $ python benchmarks/throughput.py --baseline baseline.json --output current.json
+"""
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from black import __version__ as black_version
+
+from benchmarks.corpus import LAYOUTS, CorpusInfo, write_corpus
+from jupyterblack import __version__
+
+MODES = ("check", "format")
+
+
+def run_jblack(args: Sequence[str]) -> Tuple[float, Optional[float]]:
+    """Wall time in seconds and peak RSS in MB (where the platform reports it) of a jblack run."""
+    env = {**os.environ, "PYTHONPATH": str(Path(__file__).parent.parent)}
+    command = [sys.executable, "-m", "jupyterblack", "--no-cache", *args]
+    start = time.perf_counter()
+    with subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env) as process:
+        if not hasattr(os, "wait4"):
+            process.wait()
+            return time.perf_counter() - start, None
+        # The usage of a process includes its waited-for children, i.e. the worker processes
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return wall_time, peak_rss
+
+
+def bench_run(corpus: Path, info: CorpusInfo, mode: str, n_workers: int, repeat: int) -> Dict[str, Any]:
+    """Best of repeat runs of a mode with a number of workers."""
+    timings: List[Tuple[float, Optional[float]]] = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            target = corpus
+            if mode == "format":  # Formatting changes the notebooks
+                target = Path(temp_dir) / "corpus"
+                shutil.copytree(corpus, target)
+            args = ["--check"] if mode == "check" else []
+            timings.append(run_jblack([*args, "-w", str(n_workers), str(target)]))
+    wall_time = min(timing[0] for timing in timings)
+    rss = [timing[1] for timing in timings if timing[1] is not None]
+    return {
+        "mode": mode,
+        "workers": n_workers,
+        "wall_time": wall_time,
+        "cells_per_s": info.n_cells / wall_time,
+        "mb_per_s": info.n_bytes / 1e6 / wall_time,
+        "peak_rss_mb": max(rss) if rss else None,
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any]) -> None:
+    # Results without a layout are from before the corpus was written in the layout of Jupyter
+    previous = {
+        (result.get("layout", "jblack"), result["mode"], result["workers"]): result for result in baseline["results"]
+    }
+    for result in results:
+        before = previous.get((result["layout"], result["mode"], result["workers"]))
+        if before is not None:
+            print(
+                f"{result['layout']:<7} {result['mode']:<7} -w {result['workers']:<3} "
+                f"wall time {before['wall_time']:8.3f}s -> "
+                f"{result['wall_time']:8.3f}s   x{before['wall_time'] / result['wall_time']:.2f}"
+            )
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", type=float, default=1.0, help="size of the corpus relative to the default one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-w", "--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--layouts", nargs="+", choices=list(LAYOUTS), default=list(LAYOUTS))
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each benchmark, of which the best")
+    parser.add_argument("--output", help="path of the JSON results")
+    parser.add_argument("--baseline", help="path of the JSON results of a previous run to compare with")
+    return parser.parse_args()
+
+
+def main() -> None:
+    namespace = parse_args()
+    infos: Dict[str, CorpusInfo] = {}
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for layout in namespace.layouts:
+            corpus = Path(temp_dir) / layout
+            info = infos[layout] = write_corpus(corpus, namespace.scale, namespace.seed, layout)
+            print(
+                f"Corpus ({layout} layout): {info.n_notebooks} notebooks, {info.n_cells} code cells, "
+                f"{info.n_bytes / 1e6:.1f} MB"
+            )
+            for mode in namespace.modes:
+                for n_workers in namespace.workers:
+                    result = {"layout": layout, **bench_run(corpus, info, mode, n_workers, namespace.repeat)}
+                    results.append(result)
+                    rss = f"{result['peak_rss_mb']:7.1f} MB" if result["peak_rss_mb"] is not None else "n/a"
+                    print(
+                        f"{layout:<7} {mode:<7} -w {n_workers:<3} {result['wall_time']:8.3f}s  "
+                        f"{result['cells_per_s']:9.0f} cells/s  {result['mb_per_s']:6.1f} MB/s  peak RSS {rss}"
+                    )
+    report = {
+        "jupyterblack": __version__,
+        "black": black_version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "corpus": {
+            "scale": namespace.scale,
+            "seed": namespace.seed,
+            "layouts": {layout: info._asdict() for layout, info in infos.items()},
+        },
+        "results": results,
+    }
+    if namespace.baseline:
+        with open(namespace.baseline, encoding="utf-8") as fobj:
+            compare(results, json.load(fobj))
+    if namespace.output:
+        with open(namespace.output, "w", encoding="utf-8") as fobj:
+            json.dump(report, fobj, indent=2)
+            fobj.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,25 @@
 import json
 import sys
-from functools import partial
-from multiprocessing import Pool
-from typing import List, Sequence, Union
+import time
+from argparse import Namespace
+from contextlib import nullcontext, redirect_stdout
+from itertools import chain
+from typing import TYPE_CHECKING, Callable, ContextManager, Generator, Iterable, List, Optional, Sequence, Union, cast
 
-from black import TargetVersion, WriteBack
+from jupyterblack.arguments import parse_args, parse_merge_args
+from jupyterblack.util.files import STDIN, STDIN_NAME, check_paths_exist
+from jupyterblack.util.git import changed_files
+from jupyterblack.util.targets import iter_target_files
+from jupyterblack.util.workers import AUTO_WORKERS
 
-from jupyterblack.arguments import parse_args
-from jupyterblack.parser import (
-    BlackFileModeKwargs,
-    BlackFormatRes,
-    BlackLintRes,
-    check_jupyter_file,
-    format_jupyter_file,
-)
-from jupyterblack.util.files import check_ipynb_extensions, check_paths_exist
-from jupyterblack.util.processing import init_worker
-from jupyterblack.util.targets import targets_to_files
+# black and the formatting machinery are only imported once there are files to format, so that --help, argument
+# errors and runs without files are fast
+if TYPE_CHECKING:
+    from jupyterblack.parser import BlackFileModeKwargs, BlackFormatRes, BlackLintRes
+    from jupyterblack.util.cache import Cache
+    from jupyterblack.util.client import DaemonClient
+    from jupyterblack.util.processing import FileReport
+    from jupyterblack.util.stats import Stats
 
 
 def main() -> None:
@@ -25,76 +28,428 @@ def main() -> None:
 
 
 def run(args: List[str]) -> None:
-    # pylint: disable=too-many-locals,too-many-branches
+    start = time.perf_counter()
     namespace = parse_args(*args)
+    with run_limits(namespace):
+        if namespace.stats or namespace.stats_json:
+            from jupyterblack.util import stats  # pylint: disable=import-outside-toplevel
 
+            stats.enable()
+            try:
+                _run(namespace)
+            finally:
+                # stdout only has the notebooks when they are read from stdin
+                is_stdin = STDIN in namespace.targets or namespace.ndjson
+                with redirect_stdout(sys.stderr) if is_stdin else nullcontext():
+                    report_stats(stats.disable(), time.perf_counter() - start, namespace.stats, namespace.stats_json)
+        else:
+            _run(namespace)
+
+
+def run_limits(namespace: Namespace) -> ContextManager[None]:
+    """Apply the time and memory budgets and the size policies of the command line during a run."""
+    values = [
+        namespace.cell_timeout,
+        namespace.file_timeout,
+        namespace.memory_limit,
+        namespace.max_file_size,
+        namespace.large_file_size,
+        namespace.max_in_flight,
+        namespace.max_cell_lines,
+    ]
+    if all(value is None for value in values):
+        return nullcontext()
+    from jupyterblack.util.limits import Limits, applied  # pylint: disable=import-outside-toplevel
+
+    return applied(Limits(*values))
+
+
+def merge_main() -> None:
+    """Merge the JSON reports of the shards of a run (jblack-merge), and pass or fail like the run."""
+    # pylint: disable=import-outside-toplevel
+    from jupyterblack.util.reports import merge_reports, read_report, report_file_reports, write_report
+
+    namespace = parse_merge_args(*sys.argv[1:])
+    report = merge_reports([read_report(path) for path in namespace.reports])
+    if namespace.output:
+        write_report(namespace.output, report)
+    if not report["complete"]:
+        print("Some shards stopped at the first notebook that would be reformatted (--fail-fast)")
+    report_results(
+        report_file_reports(report),
+        namespace.show_invalid_code,
+        is_check=report["mode"] == "check",
+        is_diff=report["mode"] == "diff",
+    )
+
+
+def _run(namespace: Namespace) -> None:
     targets: List[str] = namespace.targets
-    skip_string_normalization: bool = namespace.skip_string_normalization
     is_check: bool = namespace.check
-    is_diff: bool = False  # namespace.diff
-    line_length: int = namespace.line_length
-    is_pyi: bool = namespace.pyi
-    n_workers: int = namespace.workers
+    is_diff: bool = namespace.diff
     show_invalid_code: bool = namespace.show_invalid_code
 
+    is_stdin = STDIN in targets or namespace.ndjson
+    if not is_stdin:
+        check_paths_exist(targets)
+    if namespace.watch and (is_check or is_diff):
+        raise SystemExit("Error: --watch formats notebooks, it can't be combined with --check or --diff")
+    if namespace.clear_cache:
+        from jupyterblack.util.cache import clear_cache  # pylint: disable=import-outside-toplevel
+
+        clear_cache()
+    if is_stdin:
+        format_stdin(namespace)
+        return
+
+    # Transform supplied targets (directories or files) to files, lazily so that formatting starts during discovery
+    changed = None
+    if namespace.changed_since is not None or namespace.staged:
+        changed = changed_files(targets, since=namespace.changed_since, staged=namespace.staged)
+    target_files = iter_target_files(
+        targets, namespace.exclude, namespace.extend_exclude, namespace.include, changed=changed
+    )
+    if namespace.stats or namespace.stats_json:
+        from jupyterblack.util.stats import timed_iter  # pylint: disable=import-outside-toplevel
+
+        target_files = timed_iter("discover", target_files)
+    first_file = next(target_files, None)
+    if first_file is None:
+        save_report(namespace, [], n_files=0)
+        report_results([], show_invalid_code, is_check=is_check, is_diff=is_diff)
+    else:
+        format_targets(namespace, chain([first_file], target_files))
+    if namespace.watch:
+        watch_targets(namespace)
+
+
+def watch_targets(namespace: Namespace, stop: Optional[Callable[[], bool]] = None) -> None:
+    """Format the notebooks of the targets as they are saved, until interrupted (or stop() is true)."""
+    # pylint: disable=import-outside-toplevel,too-many-locals
+    from jupyterblack.util.cache import Cache
+    from jupyterblack.util.processing import format_files
+    from jupyterblack.util.targets import target_file_matcher, targets_to_files, watched_directories
+    from jupyterblack.util.watch import CACHE_WRITE_SECONDS, make_watcher, watch
+
+    targets: List[str] = namespace.targets
+    kwargs = mode_kwargs(namespace)
+    # Unchanged cells of saved notebooks are found in the cache, so that only the edited cells are formatted
+    cache = Cache.in_memory(kwargs) if namespace.no_cache else Cache.read(kwargs)
+    cache.write_interval = CACHE_WRITE_SECONDS
+
+    def discover() -> List[str]:
+        return targets_to_files(targets, namespace.exclude, namespace.extend_exclude, namespace.include)
+
+    known_files = set(discover())
+    is_target_file = target_file_matcher(targets, namespace.exclude, namespace.extend_exclude, namespace.include)
+
+    def known(path: str) -> bool:
+        if path not in known_files and is_target_file(path):  # New notebook
+            known_files.add(path)
+        return path in known_files
+
+    def handle(files: List[str]) -> List[str]:
+        reports = []
+        for file in files:  # A malformed or vanished notebook is reported, and the watch goes on
+            try:
+                reports.extend(format_files([file], kwargs, 1, cache))
+            except SystemExit as exc:
+                print(exc, file=sys.stderr, flush=True)
+            except OSError as exc:
+                print(f"Error: Cannot read {file}: {exc.strerror or exc}", file=sys.stderr, flush=True)
+        manage_invalid_code(namespace.show_invalid_code, reports)
+        sys.stdout.flush()
+        return [report.file for report in reports if report.is_changed]
+
+    directories, is_watched_dir = watched_directories(targets, namespace.exclude, namespace.extend_exclude)
+    watcher = make_watcher(directories, is_watched_dir, discover, polling=namespace.poll)
+    print(f"Watching {len(known_files)} notebooks for changes ({watcher.name}), press Ctrl+C to stop", flush=True)
+    try:
+        watch(watcher, handle, known, stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        cache.write(force=True)
+
+
+def format_stdin(namespace: Namespace) -> None:
+    """Format or check the notebooks read from stdin (the target -), and write them or their results to stdout."""
+    from jupyterblack.util.cache import Cache  # pylint: disable=import-outside-toplevel
+
+    if namespace.targets != [STDIN]:
+        raise SystemExit(f"Error: notebooks are read from stdin with the single target {STDIN}, not with other targets")
+    path_options = {
+        "--watch": namespace.watch,
+        "--shard": namespace.shard,
+        "--changed-since": namespace.changed_since,
+        "--staged": namespace.staged,
+        "--daemon": namespace.daemon,
+        "--report-json": namespace.report_json,
+    }
+    used = [option for option, value in path_options.items() if value not in (None, False)]
+    if used:
+        raise SystemExit(f"Error: {STDIN} reads notebooks from stdin, it can't be combined with {', '.join(used)}")
+
+    kwargs = mode_kwargs(namespace)
+    cache = None if namespace.no_cache else Cache.read(kwargs)
+    try:
+        if namespace.ndjson:
+            format_stream(namespace, kwargs, cache)
+        elif namespace.check or namespace.diff:
+            check_stdin_notebook(namespace, kwargs, cache)
+        else:
+            format_stdin_notebook(namespace, kwargs, cache)
+    finally:
+        if cache is not None:
+            cache.write()
+
+
+def format_stdin_notebook(namespace: Namespace, kwargs: "BlackFileModeKwargs", cache: Optional["Cache"]) -> None:
+    """Format the notebook read from stdin and write it to stdout, as it was read if it is already formatted."""
+    # pylint: disable=import-outside-toplevel
+    from jupyterblack.parser import format_notebook
+    from jupyterblack.util.error_messages import invalid_content
+
+    try:
+        format_res = format_notebook(sys.stdin.buffer.read(), kwargs, cache, name=STDIN_NAME)
+    except ValueError:
+        invalid_content(STDIN_NAME)
+    with redirect_stdout(sys.stderr):  # stdout only has the notebook
+        manage_invalid_code(namespace.show_invalid_code, [format_res])
+    sys.stdout.flush()
+    sys.stdout.buffer.write(cast(bytes, format_res.notebook))
+    sys.stdout.flush()
+
+
+def check_stdin_notebook(namespace: Namespace, kwargs: "BlackFileModeKwargs", cache: Optional["Cache"]) -> None:
+    """Check the notebook read from stdin, printing the diffs of its cells with --diff."""
+    # pylint: disable=import-outside-toplevel
+    from jupyterblack.parser import check_notebook
+    from jupyterblack.util.error_messages import invalid_content
+
+    all_cells: bool = namespace.all_cells
+    try:
+        lint_res = check_notebook(
+            sys.stdin.buffer.read(), kwargs, cache, name=STDIN_NAME, all_cells=all_cells, diff=namespace.diff
+        )
+    except ValueError:
+        invalid_content(STDIN_NAME)
+    with redirect_stdout(sys.stderr):
+        manage_invalid_code(namespace.show_invalid_code, [lint_res])
+    if namespace.diff:
+        print(lint_res.output, end="")
+    if namespace.check and not lint_res.is_okay:
+        raise SystemExit(f"Would reformat {STDIN_NAME}{format_cells(lint_res.failing_cells) if all_cells else ''}")
+
+
+def format_stream(namespace: Namespace, kwargs: "BlackFileModeKwargs", cache: Optional["Cache"]) -> None:
+    """Format or check the notebooks read from stdin, one per line, and write a line with the result of each to stdout
+    as soon as it is done (--ndjson).
+
+    Lines that are not notebooks get an error as their result, and fail the run once every notebook is done.
+    """
+    from jupyterblack.util.processing import iter_stream_results  # pylint: disable=import-outside-toplevel
+
+    # The amount of work of a stream is not known up front, so it is only spread over workers when asked to
+    n_workers = 1 if namespace.workers == AUTO_WORKERS else int(namespace.workers)
+    n_changed = n_malformed = 0
+    results = iter_stream_results(
+        sys.stdin.buffer,
+        kwargs,
+        n_workers,
+        cache,
+        is_check=namespace.check or namespace.diff,
+        all_cells=namespace.all_cells,
+        diff=namespace.diff,
+    )
+    for result in results:
+        print(result.text, flush=True)
+        n_changed += result.is_changed
+        n_malformed += result.is_malformed
+    if n_malformed:
+        raise SystemExit(f"Error: {n_malformed} line{'s' if n_malformed != 1 else ''} of stdin not read as notebooks")
+    if namespace.check and n_changed:
+        raise SystemExit(f"{n_changed} notebook{'s' if n_changed != 1 else ''} would be reformatted")
+
+
+def format_targets(namespace: Namespace, target_files: Iterable[str]) -> None:
+    """Format or check the files found in the targets."""
+    # pylint: disable=import-outside-toplevel,too-many-locals,too-many-branches
+    from black import WriteBack
+
+    from jupyterblack.util.cache import Cache
+    from jupyterblack.util.client import DaemonClient
+    from jupyterblack.util.processing import file_costs
+    from jupyterblack.util.shards import shard_files
+
+    is_check: bool = namespace.check
+    is_diff: bool = namespace.diff
+    all_cells: bool = namespace.all_cells
+    fail_fast: bool = namespace.fail_fast and (is_check or is_diff)
+    n_workers: Union[int, str] = namespace.workers
+    split_cells: bool = namespace.split_cells
+    show_invalid_code: bool = namespace.show_invalid_code
+    use_cache: bool = not namespace.no_cache
+
+    write_back = WriteBack.from_configuration(check=is_check, diff=is_diff)
+    black_file_mode_kwargs = mode_kwargs(namespace)
+
+    cache: Optional[Cache] = Cache.read(black_file_mode_kwargs) if use_cache else None
+    client = DaemonClient.connect() if namespace.daemon else None
+    n_files: Optional[int] = None
+    if namespace.shard is not None:  # Every notebook is weighed, so that all machines split them the same way
+        weights = file_costs(target_files, cache if namespace.shard_by == "cost" else None)
+        n_files = len(weights)
+        target_files = shard_files(weights, namespace.shard)
+
+    if write_back not in (WriteBack.YES, WriteBack.CHECK, WriteBack.DIFF):
+        raise SystemExit(f"WriteBack option: {write_back} not yet supported")
+    results = []
+    is_complete = True
+    reports = iter_reports(
+        target_files,
+        black_file_mode_kwargs,
+        n_workers,
+        cache,
+        split_cells=split_cells,
+        client=client,
+        is_check=is_check or is_diff,
+        all_cells=all_cells,
+        diff=is_diff,
+    )
+    try:
+        for report in reports:
+            results.append(report)
+            if report.is_okay:
+                continue
+            if is_diff:
+                print(report.diff, end="")
+            elif is_check:
+                print(f"Would reformat {report.file}{format_cells(report.failing_cells) if all_cells else ''}")
+            if fail_fast:
+                print("Stopped at the first notebook that would be reformatted (--fail-fast)")
+                is_complete = False
+                break
+    finally:  # Stops the pending work when failing fast
+        reports.close()
+    save_report(namespace, results, n_files=len(results) if n_files is None else n_files, is_complete=is_complete)
+    report_results(results, show_invalid_code, is_check=is_check, is_diff=is_diff)
+
+
+def mode_kwargs(namespace: Namespace) -> "BlackFileModeKwargs":
+    """Black mode options of the command line."""
+    # pylint: disable=import-outside-toplevel
+    from black import TargetVersion
+
+    from jupyterblack.parser import BlackFileModeKwargs
+
     if namespace.target_version is not None:
         target_versions = {TargetVersion[val.upper()] for val in namespace.target_version}
     else:
         target_versions = set()
 
-    check_paths_exist(targets)
-
-    write_back = WriteBack.from_configuration(check=is_check, diff=is_diff)
     black_file_mode_kwargs = BlackFileModeKwargs(
-        line_length=line_length, string_normalization=not skip_string_normalization
+        line_length=namespace.line_length, string_normalization=not namespace.skip_string_normalization
     )
-    if is_pyi:  # Not sure if older versions of black have "is_pyi"
+    if namespace.pyi:  # Not sure if older versions of black have "is_pyi"
         black_file_mode_kwargs = BlackFileModeKwargs(  # type: ignore[misc]
             **black_file_mode_kwargs,
-            is_pyi=is_pyi,
+            is_pyi=namespace.pyi,
         )
     if target_versions:
         black_file_mode_kwargs = BlackFileModeKwargs(  # type: ignore[misc]
             **black_file_mode_kwargs, target_versions=target_versions
         )
+    return black_file_mode_kwargs
 
-    # Transform supplied targets (directories or files) to files
-    target_files = targets_to_files(targets)
-    check_ipynb_extensions(target_files)
 
-    if write_back is WriteBack.YES:
-        if n_workers == 1:  # No need to set up a process Pool for a single worker (slow when run on a single file)
-            format_results = [format_jupyter_file(file, black_file_mode_kwargs) for file in target_files]
-        else:
-            with Pool(processes=n_workers, initializer=init_worker) as process_pool:
-                format_results = process_pool.map(
-                    partial(format_jupyter_file, kwargs=black_file_mode_kwargs), target_files
-                )
-        manage_invalid_code(show_invalid_code, format_results)
-        print("All done!")
-    elif write_back is WriteBack.CHECK:
-
-        if n_workers == 1:  # No need to set up a process Pool for a single worker
-            check_results = [check_jupyter_file(file, black_file_mode_kwargs) for file in target_files]
-        else:
-            with Pool(processes=n_workers, initializer=init_worker) as process_pool:
-                check_results = process_pool.map(
-                    partial(check_jupyter_file, kwargs=black_file_mode_kwargs),
-                    target_files,
-                )
-
-        manage_invalid_code(show_invalid_code, check_results)
-        files_not_formatted = [res.file for res in check_results if not res.is_okay]
+def report_results(
+    results: Sequence["FileReport"], show_invalid_code: bool, *, is_check: bool, is_diff: bool = False
+) -> None:
+    manage_invalid_code(show_invalid_code, results)
+    files_not_formatted = sorted(res.file for res in results if not res.is_okay)
+    if is_check:
         if not files_not_formatted:
             print("All good! Supplied targets are already formatted with black.")
         else:
             raise SystemExit("Files that need formatting:\n  - " + "\n  - ".join(files_not_formatted))
+    elif is_diff:
+        print("All done!")
+        print(format_summary(results, would=True))
     else:
-        raise SystemExit(f"WriteBack option: {write_back} not yet supported")
+        print("All done!")
+        print(format_summary(results))
+
+
+def iter_reports(
+    files: Iterable[str],
+    kwargs: "BlackFileModeKwargs",
+    n_workers: Union[int, str],
+    cache: Optional["Cache"],
+    *,
+    split_cells: bool,
+    client: Optional["DaemonClient"],
+    is_check: bool,
+    all_cells: bool = False,
+    diff: bool = False,
+) -> Generator["FileReport", None, None]:
+    """Reports of formatting or checking files, through jblackd if a client is given."""
+    # pylint: disable=too-many-arguments,import-outside-toplevel
+    from jupyterblack.util.processing import iter_check_files, iter_daemon_files, iter_format_files
+
+    if client is not None:
+        return iter_daemon_files(client, files, kwargs, is_check=is_check, cache=cache, all_cells=all_cells, diff=diff)
+    if is_check:
+        return iter_check_files(files, kwargs, n_workers, cache, split_cells, all_cells=all_cells, diff=diff)
+    return iter_format_files(files, kwargs, n_workers, cache, split_cells)
+
+
+def save_report(namespace: Namespace, results: Sequence["FileReport"], n_files: int, is_complete: bool = True) -> None:
+    """Write the results as JSON if --report-json is given, e.g. to merge the results of shards with jblack-merge."""
+    if not namespace.report_json:
+        return
+    from jupyterblack.util.reports import make_report, write_report  # pylint: disable=import-outside-toplevel
+
+    mode = "check" if namespace.check else "diff" if namespace.diff else "format"
+    report = make_report(results, mode=mode, shard=namespace.shard, n_files=n_files, complete=is_complete)
+    write_report(namespace.report_json, report)
+
+
+def format_cells(cells: Sequence[int]) -> str:
+    return f" (cell{'s' if len(cells) != 1 else ''} {', '.join(map(str, cells))})" if cells else ""
+
+
+def report_stats(collected: Optional["Stats"], wall_time: float, show: bool, json_path: Optional[str] = None) -> None:
+    if collected is None:
+        return
+    if show:
+        print(collected.summary(wall_time))
+    if json_path:
+        from jupyterblack.util.stats import write_json  # pylint: disable=import-outside-toplevel
+
+        write_json(json_path, collected, wall_time)
+
+
+def format_summary(results: Sequence["FileReport"], would: bool = False) -> str:
+    n_changed = sum(res.is_changed for res in results)
+    n_unchanged = len(results) - n_changed
+    summary = []
+    if n_changed:
+        verb = "would be reformatted" if would else "reformatted"
+        summary.append(f"{n_changed} file{'s' if n_changed != 1 else ''} {verb}")
+    if n_unchanged:
+        verb = "would be left unchanged" if would else "left unchanged"
+        summary.append(f"{n_unchanged} file{'s' if n_unchanged != 1 else ''} {verb}")
+    return ", ".join(summary) + "." if summary else "No files to format."
 
 
-def manage_invalid_code(show_invalid_code: bool, results: Sequence[Union[BlackLintRes, BlackFormatRes]]) -> None:
-    invalid_code = {res.file: res.invalid_report for res in results if res.invalid_report}
+def manage_invalid_code(
+    show_invalid_code: bool, results: Sequence[Union["BlackLintRes", "BlackFormatRes", "FileReport"]]
+) -> None:
+    invalid_code = {
+        res.file: res.invalid_report for res in sorted(results, key=lambda res: res.file) if res.invalid_report
+    }
     if show_invalid_code and invalid_code:
         print("WARN: Detected the following invalid code snippets:")
         print(json.dumps(invalid_code, indent=4))
@@ -0,0 +1,49 @@
+"""Format notebooks held in memory, e.g. by a Jupyter server extension, without writing them to files.
+
+Usage:
+------
+
+Format a notebook, given as text, UTF-8 bytes or a decoded notebook (e.g. from nbformat):
+
+    >>> from jupyterblack.api import format_notebook
+    >>> result = format_notebook(notebook, {"line_length": 100})
+    >>> result.notebook  # Formatted notebook, in the form it was given
+    >>> result.is_changed, result.invalid_report
+
+Format a batch of notebooks over 4 worker processes, reusing the cell cache of the command line:
+
+    >>> from jupyterblack.api import Cache, format_notebooks
+    >>> cache = Cache.read({})
+    >>> results = format_notebooks(notebooks, {}, n_workers=4, cache=cache)
+    >>> cache.write()
+
+Format notebooks from asyncio code (e.g. a Jupyter server extension) in 2 worker processes, with a timeout:
+
+    >>> from jupyterblack.api import AsyncFormatter
+    >>> async with AsyncFormatter({"line_length": 100}, n_workers=2, cell_timeout=5) as formatter:
+    ...     result = await formatter.format_notebook(notebook, timeout=10)
+"""
+
+from jupyterblack.parser import (
+    BlackFileModeKwargs,
+    BlackLintRes,
+    Notebook,
+    NotebookFormatRes,
+    check_notebook,
+    format_notebook,
+)
+from jupyterblack.util.aio import AsyncFormatter
+from jupyterblack.util.cache import Cache
+from jupyterblack.util.processing import format_notebooks
+
+__all__ = [
+    "AsyncFormatter",
+    "BlackFileModeKwargs",
+    "BlackLintRes",
+    "Cache",
+    "Notebook",
+    "NotebookFormatRes",
+    "check_notebook",
+    "format_notebook",
+    "format_notebooks",
+]
@@ -18,30 +18,233 @@ Format a directory:
 Format one Jupyter file with a line length of 70:
 
     $ jblack -l 70 notebook.ipynb
+
+Format a notebook read from stdin and write it to stdout:
+
+    $ jblack - < notebook.ipynb
 """
 
+import math
 import os
-from argparse import ArgumentParser, Namespace, RawTextHelpFormatter
+from argparse import ArgumentParser, ArgumentTypeError, Namespace, RawTextHelpFormatter
+from typing import Union
+
+from jupyterblack.util.files import DEFAULT_EXCLUDES
+from jupyterblack.util.shards import SHARD_WEIGHTS, Shard, parse_shard
+from jupyterblack.util.workers import AUTO_WORKERS
+
+MERGE_USAGE = """Merge the JSON reports of the shards of a run, which passes or fails like a single run would.
+
+    $ jblack --check --shard 1/2 --report-json shard-1.json notebooks/
+    $ jblack --check --shard 2/2 --report-json shard-2.json notebooks/
+    $ jblack-merge shard-1.json shard-2.json
+"""
+
+
+def target_version_type(value: str) -> str:
+    """Name of one of black's target versions; black is only imported when the option is used."""
+    from black import TargetVersion  # pylint: disable=import-outside-toplevel
+
+    names = [version.name.lower() for version in TargetVersion]
+    if value not in names:
+        raise ArgumentTypeError(f"invalid choice: {value!r} (choose from {', '.join(names)})")
+    return value
+
+
+def workers_type(value: str) -> Union[int, str]:
+    if value == AUTO_WORKERS:
+        return value
+    try:
+        n_workers = int(value)
+    except ValueError as exc:
+        raise ArgumentTypeError(f"invalid value: {value!r} (expected a positive integer or {AUTO_WORKERS!r})") from exc
+    if n_workers < 1:
+        raise ArgumentTypeError(f"invalid value: {value!r} (expected a positive integer or {AUTO_WORKERS!r})")
+    return n_workers
+
+
+def positive_float_type(value: str) -> float:
+    try:
+        number = float(value)
+    except ValueError as exc:
+        raise ArgumentTypeError(f"invalid value: {value!r} (expected a positive number)") from exc
+    if number <= 0 or not math.isfinite(number):
+        raise ArgumentTypeError(f"invalid value: {value!r} (expected a positive number)")
+    return number
+
+
+def positive_int_type(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError as exc:
+        raise ArgumentTypeError(f"invalid value: {value!r} (expected a positive integer)") from exc
+    if number < 1:
+        raise ArgumentTypeError(f"invalid value: {value!r} (expected a positive integer)")
+    return number
+
 
-from black import TargetVersion
+def shard_type(value: str) -> Shard:
+    try:
+        return parse_shard(value)
+    except ValueError as exc:
+        raise ArgumentTypeError(str(exc)) from exc
 
 
 def parse_args(*args: str) -> Namespace:
     parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
     parser.add_argument("--check", action="store_true")
-    # parser.add_argument("--diff", action="store_true")
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="don't write the notebooks back, print the diffs of the cells that would be reformatted instead",
+    )
+    parser.add_argument(
+        "--all-cells",
+        action="store_true",
+        help="with --check, report every cell that would be reformatted instead of stopping at the first one",
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="with --check or --diff, stop at the first notebook that would be reformatted",
+    )
     parser.add_argument("--pyi", action="store_true")
     parser.add_argument("-l", "--line-length", type=int, default=88)
     parser.add_argument("-s", "--skip-string-normalization", action="store_true")
-    parser.add_argument("-w", "--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=workers_type,
+        default=AUTO_WORKERS,
+        help="number of worker processes, or 'auto' to pick one based on the amount of work [default: auto]",
+    )
+    parser.add_argument(
+        "--split-cells",
+        action="store_true",
+        help="spread the code cells of notebooks over the workers instead of whole notebooks (for huge notebooks)",
+    )
+    parser.add_argument(
+        "--cell-timeout",
+        type=positive_float_type,
+        metavar="SECONDS",
+        help="leave cells that black takes longer than SECONDS on unchanged, and report them as invalid code",
+    )
+    parser.add_argument(
+        "--file-timeout",
+        type=positive_float_type,
+        metavar="SECONDS",
+        help="kill the worker of a notebook that takes longer than SECONDS, leave the notebook unchanged and report it "
+        "as invalid code",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=positive_float_type,
+        metavar="MB",
+        help="memory each worker process may use on top of its usage at start; cells and notebooks that need more are "
+        "left unchanged and reported as invalid code (on Linux)",
+    )
+    parser.add_argument(
+        "--max-file-size",
+        type=positive_float_type,
+        metavar="MB",
+        help="leave notebooks larger than MB unchanged without reading them, and report them as invalid code",
+    )
+    parser.add_argument(
+        "--large-file-size",
+        type=positive_float_type,
+        metavar="MB",
+        help="format notebooks larger than MB without decoding them in full where their layout allows it",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=positive_float_type,
+        metavar="MB",
+        help="only send notebooks to workers while the notebooks they hold add up to at most MB",
+    )
+    parser.add_argument(
+        "--max-cell-lines",
+        type=positive_int_type,
+        metavar="N",
+        help="leave cells longer than N lines unchanged, and report them as invalid code",
+    )
+    parser.add_argument(
+        "--include",
+        help="regex of notebooks to format in target directories, e.g. '/notebooks/' [default: every .ipynb file]",
+    )
+    parser.add_argument(
+        "--exclude",
+        help="regex of paths to skip in target directories, replacing the defaults (checkpoints, VCS and virtualenv "
+        f"directories, ...), on top of .gitignore files [default: {DEFAULT_EXCLUDES}]",
+    )
+    parser.add_argument("--extend-exclude", help="regex of paths to skip in target directories, on top of --exclude")
+    parser.add_argument(
+        "--changed-since",
+        metavar="REF",
+        help="only format notebooks that differ from the git commit REF, staged or not, and new untracked notebooks",
+    )
+    parser.add_argument("--staged", action="store_true", help="only format notebooks staged in the git index")
+    parser.add_argument(
+        "--shard",
+        type=shard_type,
+        metavar="INDEX/COUNT",
+        help="only format the notebooks of shard INDEX (from 1) out of COUNT, to split a run across machines",
+    )
+    parser.add_argument(
+        "--shard-by",
+        choices=SHARD_WEIGHTS,
+        default="size",
+        help="balance shards by file size, or by the cost of previous runs in the cache (only stable across machines "
+        "that share the cache) [default: size]",
+    )
+    parser.add_argument(
+        "--report-json",
+        metavar="PATH",
+        help="write the results as JSON to PATH, e.g. to merge the results of shards with jblack-merge",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and format notebooks of the targets as they are saved (with inotify on Linux)",
+    )
+    parser.add_argument("--poll", action="store_true", help="with --watch, poll modification times instead of inotify")
+    parser.add_argument(
+        "--ndjson",
+        action="store_true",
+        help="with the target -, read notebooks from stdin as JSON, one per line, and write a line of JSON with the "
+        "result of each notebook to stdout as soon as it is done",
+    )
     parser.add_argument("--show-invalid-code", action="store_true")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="format through jblackd when it is running (at $JBLACKD_ADDRESS or its default Unix socket)",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="print the time spent in each stage, cache hits and the slowest notebooks and cells (to stderr with -)",
+    )
+    parser.add_argument("--stats-json", metavar="PATH", help="write the stats of --stats as JSON to PATH")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the formatting cache")
+    parser.add_argument("--clear-cache", action="store_true", help="clear the formatting cache before running")
     parser.add_argument("targets", nargs="+", default=os.getcwd())
     parser.add_argument(
         "-t",
         "--target-version",
         nargs="+",
-        help="Python versions that should be supported by Black's output. [default: per-file auto-detection]",
-        choices=[version.name.lower() for version in TargetVersion],
+        metavar="VERSION",
+        help="Python versions that should be supported by Black's output, e.g. py38 (any of black's target versions)."
+        " [default: per-file auto-detection]",
+        type=target_version_type,
     )
 
     return parser.parse_args(args)
+
+
+def parse_merge_args(*args: str) -> Namespace:
+    """Arguments of jblack-merge, which merges the JSON reports of the shards of a run."""
+    parser = ArgumentParser(prog="jblack-merge", description=MERGE_USAGE, formatter_class=RawTextHelpFormatter)
+    parser.add_argument("reports", nargs="+", metavar="REPORT", help="JSON reports of every shard (--report-json)")
+    parser.add_argument("-o", "--output", metavar="PATH", help="write the merged report as JSON to PATH")
+    parser.add_argument("--show-invalid-code", action="store_true")
+    return parser.parse_args(args)
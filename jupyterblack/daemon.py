@@ -0,0 +1,294 @@
+"""jblackd: keep black imported and a pool of warm workers ready to format notebooks for editors and save hooks.
+
+Usage:
+------
+
+Serve on the default Unix socket (or the address in JBLACKD_ADDRESS):
+
+    $ jblackd
+
+Serve on a localhost port, with 4 workers:
+
+    $ jblackd --address localhost:45485 -w 4
+
+Format through the daemon when it is running:
+
+    $ jblack --daemon notebook.ipynb
+
+See jupyterblack.util.client for the protocol.
+"""
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from argparse import ArgumentParser, Namespace, RawTextHelpFormatter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+from multiprocessing.pool import Pool as PoolType
+from typing import Any, Dict, List, Optional, Tuple, Union, cast
+
+from black import FileMode, TargetVersion
+from black import __version__ as black_version
+
+from jupyterblack import __version__
+from jupyterblack.parser import BlackFileModeKwargs, BlackFormatter
+from jupyterblack.util import json_backend
+from jupyterblack.util.cache import Cache
+from jupyterblack.util.client import default_address, parse_address
+from jupyterblack.util.processing import init_worker
+from jupyterblack.util.workers import cpu_count
+
+# Largest request body accepted, in bytes
+MAX_REQUEST_SIZE = 256 * 1024 * 1024
+
+# Per process state: black mode and cell cache of every mode seen in requests
+_modes: Dict[str, Tuple[BlackFileModeKwargs, FileMode, Cache]] = {}
+
+
+def mode_from_json(mode: Any) -> BlackFileModeKwargs:
+    """Black mode kwargs from their JSON form, where target versions are given by name."""
+    if not isinstance(mode, dict):
+        raise ValueError("mode must be an object")
+    unknown = set(mode) - set(BlackFileModeKwargs.__annotations__)
+    if unknown:
+        raise ValueError(f"Unknown mode options: {sorted(unknown)}")
+    kwargs = BlackFileModeKwargs(**mode)  # type: ignore[misc]
+    if "target_versions" in mode:
+        try:
+            kwargs["target_versions"] = {TargetVersion[name.upper()] for name in mode["target_versions"]}
+        except (KeyError, AttributeError, TypeError) as exc:
+            raise ValueError(f"Invalid target versions: {mode['target_versions']}") from exc
+    return kwargs
+
+
+def _mode_state(mode: Any) -> Tuple[BlackFileModeKwargs, FileMode, Cache]:
+    key = json.dumps(mode, sort_keys=True)
+    if key not in _modes:
+        kwargs = mode_from_json(mode)
+        try:
+            file_mode = FileMode(**kwargs)
+        except TypeError as exc:
+            raise ValueError(f"Invalid mode: {exc}") from exc
+        _modes[key] = (kwargs, file_mode, Cache.in_memory(kwargs))
+    return _modes[key]
+
+
+def handle_request(payload: Any) -> Dict[str, Any]:
+    """Format or check the notebook or cells of a request, raising ValueError for invalid requests."""
+    if not isinstance(payload, dict):
+        raise ValueError("The request must be a JSON object")
+    kwargs, mode, cache = _mode_state(payload.get("mode", {}))
+    try:
+        if "cells" in payload:
+            return _format_cells(payload["cells"], kwargs, mode, cache)
+        if "notebook" in payload:
+            return _format_notebook(payload["notebook"], kwargs, mode, cache, payload)
+    finally:
+        cache.pop_new_cells()
+        cache.evict()
+    raise ValueError("The request has neither a notebook nor cells")
+
+
+def _format_cells(cells: Any, kwargs: BlackFileModeKwargs, mode: FileMode, cache: Cache) -> Dict[str, Any]:
+    if not isinstance(cells, list) or not all(isinstance(cell, str) for cell in cells):
+        raise ValueError("cells must be a list of strings")
+    formatter = BlackFormatter("<cells>", kwargs, cache, mode, file_contents="")
+    outputs: List[str] = []
+    invalid_report: Dict[str, str] = {}
+    for cell in cells:
+        format_res = formatter.format_black_cell([cell])
+        outputs.append(format_res.output)
+        invalid_report.update(format_res.invalid_report)
+    return {"cells": outputs, "is_changed": outputs != cells, "invalid_report": invalid_report}
+
+
+def _format_notebook(
+    notebook: Any, kwargs: BlackFileModeKwargs, mode: FileMode, cache: Cache, options: Dict[str, Any]
+) -> Dict[str, Any]:
+    # pylint: disable=too-many-arguments
+    if isinstance(notebook, dict):
+        contents = json_backend.dumps_notebook(notebook)
+    elif isinstance(notebook, str):
+        contents = notebook
+    else:
+        raise ValueError("notebook must be a string or an object")
+    formatter = BlackFormatter("<notebook>", kwargs, cache, mode, file_contents=contents)
+    try:
+        if options.get("check"):
+            lint_res = formatter.run_check(all_cells=bool(options.get("all_cells")), diff=bool(options.get("diff")))
+            return {
+                "is_changed": not lint_res.is_okay,
+                "invalid_report": lint_res.invalid_report,
+                "failing_cells": lint_res.failing_cells,
+                "diff": lint_res.output,
+            }
+        format_res = formatter.apply_format()
+    except (SystemExit, ValueError, KeyError, TypeError) as exc:
+        raise ValueError("The notebook is malformed") from exc
+    output: Union[str, Dict[str, Any]] = (
+        json.loads(format_res.output) if isinstance(notebook, dict) else format_res.output
+    )
+    return {"notebook": output, "is_changed": format_res.is_changed, "invalid_report": format_res.invalid_report}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server: "DaemonServer"
+
+    def _reply(self, status: int, content: Dict[str, Any]) -> None:
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        self._reply(
+            200, {"version": __version__, "black_version": black_version, "workers": self.server.daemon.n_workers}
+        )
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self._reply(411, {"error": "Content-Length is required"})
+            return
+        if length > MAX_REQUEST_SIZE:
+            self._reply(413, {"error": f"Requests are limited to {MAX_REQUEST_SIZE} bytes"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(length).decode("utf-8"))
+            content = self.server.daemon.handle(payload)
+        except ValueError as exc:  # Includes JSON and Unicode decoding errors
+            self._reply(400, {"error": str(exc)})
+            return
+        except Exception as exc:  # pylint: disable=broad-except
+            self._reply(500, {"error": f"{type(exc).__name__}: {exc}"})
+            return
+        self._reply(200, content)
+
+    def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+        if self.server.daemon.verbose:
+            super().log_message(format, *args)
+
+
+class Daemon:
+    """Dispatch requests to a pool of warm worker processes, or handle them in process with a single worker.
+
+    Requests handled in process are handled one at a time, as they share the black modes, the cell cache and the
+    budgets of the process.
+    """
+
+    def __init__(self, n_workers: int = 1, verbose: bool = False):
+        self.n_workers = n_workers
+        self.verbose = verbose
+        self.pool: Optional[PoolType] = None
+        self._lock = threading.Lock()
+        if n_workers > 1:  # Closed by close(), as the pool lives as long as the server
+            self.pool = Pool(n_workers, initializer=init_worker)  # pylint: disable=consider-using-with
+
+    def handle(self, payload: Any) -> Dict[str, Any]:
+        if self.pool is None:
+            with self._lock:
+                return handle_request(payload)
+        return self.pool.apply(handle_request, (payload,))
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+
+
+class DaemonServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], daemon: Daemon):
+        super().__init__(address, RequestHandler)
+        self.daemon = daemon
+
+
+class UnixDaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):  # pylint: disable=no-member
+    daemon_threads = True
+
+    def __init__(self, path: str, daemon: Daemon):
+        super().__init__(path, RequestHandler)
+        self.daemon = daemon
+
+    def server_close(self) -> None:
+        super().server_close()
+        try:
+            os.unlink(cast(str, self.server_address))
+        except OSError:
+            pass
+
+
+def _remove_stale_socket(path: str) -> None:
+    """Remove the socket file of a daemon that did not shut down cleanly, or exit if one is running."""
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:  # pylint: disable=no-member
+        try:
+            sock.connect(path)
+        except OSError:
+            os.unlink(path)
+            return
+    raise SystemExit(f"Error: jblackd is already running on unix:{path}")
+
+
+def make_server(
+    address: Optional[str] = None, n_workers: int = 1, verbose: bool = False
+) -> Union[DaemonServer, UnixDaemonServer]:
+    """Bind a daemon server to the address (a free port with port 0), ready to serve_forever."""
+    parsed_address = parse_address(address or default_address())
+    daemon = Daemon(n_workers, verbose)
+    try:
+        if isinstance(parsed_address, str):
+            _remove_stale_socket(parsed_address)
+            return UnixDaemonServer(parsed_address, daemon)
+        return DaemonServer(parsed_address, daemon)
+    except BaseException:
+        daemon.close()
+        raise
+
+
+def server_address(server: Union[DaemonServer, UnixDaemonServer]) -> str:
+    """Address of a bound server, in the form clients take."""
+    if isinstance(server, UnixDaemonServer):
+        return f"unix:{server.server_address}"
+    host, port = server.server_address[:2]
+    return f"{host if isinstance(host, str) else host.decode()}:{port}"
+
+
+def parse_args(*args: str) -> Namespace:
+    parser = ArgumentParser(prog="jblackd", description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument(
+        "--address",
+        default=None,
+        help="unix:PATH or HOST:PORT to listen on [default: $JBLACKD_ADDRESS, or a Unix socket in the cache directory]",
+    )
+    parser.add_argument("-w", "--workers", type=int, default=cpu_count(), help="number of worker processes")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    return parser.parse_args(args)
+
+
+def main() -> None:
+    namespace = parse_args(*sys.argv[1:])
+    server = make_server(namespace.address, max(1, namespace.workers), namespace.verbose)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"jblackd {__version__} (black {black_version}) listening on {server_address(server)}", flush=True)
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        server.daemon.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,23 @@
 """Open, parse, black format, and write .ipynb file(s)."""
 
+import difflib
 import json
-import uuid
+import time
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Dict, Generic, List, Set, TypeVar, Union
+from typing import Any, Dict, Generic, Iterable, List, Optional, Set, Tuple, TypeVar, Union, cast
 
 import safer
-from attr import attrs
-from black import FileContent, FileMode, InvalidInput, TargetVersion, format_str
+from attr import Factory, attrs
+from black import FileContent, FileMode, TargetVersion, format_str
 from typing_extensions import TypedDict
 
+from jupyterblack.util import json_backend, limits, stats
+from jupyterblack.util.cache import Cache
 from jupyterblack.util.error_messages import invalid_content
 from jupyterblack.util.files import read_file
+from jupyterblack.util.magics import is_cell_magic, mask_magics, restore_magics, unmask_magics
+from jupyterblack.util.sources import content_end, find_code_sources, iter_spliced, serialize_source, splice_sources
 
 
 class BlackFileModeKwargs(TypedDict, total=False):
@@ -26,6 +31,9 @@ L = TypeVar("L")  # Lint output type
 F = TypeVar("F")  # Format output type
 S = TypeVar("S")  # Invalid code reporting type
 
+# Notebook held in memory: its text, its UTF-8 bytes or the decoded notebook (e.g. from nbformat)
+Notebook = Union[str, bytes, Dict[str, Any]]
+
 
 @attrs(auto_attribs=True)
 class LintResult(Generic[L, S]):
@@ -43,15 +51,19 @@ class FormatResult(Generic[L, S]):
     file: str
     output: L
     invalid_report: S
+    is_changed: bool = False
 
 
 TFormatRes = TypeVar("TFormatRes", bound=FormatResult)
 
 
 class FileAnalyzer(Generic[TLintRes], ABC):
-    def __init__(self, file_path: Union[str, Path]):
+    def __init__(self, file_path: Union[str, Path], file_contents: Optional[str] = None):
         self.file_path = file_path
-        self.file_contents = read_file(file_path)
+        if file_contents is None:
+            with stats.timer("read"):
+                file_contents = read_file(file_path)
+        self.file_contents = file_contents
 
     @abstractmethod
     def run_check(self) -> TLintRes:
@@ -66,7 +78,9 @@ class FileFormatter(FileAnalyzer[TLintRes], Generic[TLintRes, TFormatRes], ABC):
 
 @attrs(auto_attribs=True)
 class BlackLintRes(LintResult[str, Dict[str, str]]):
-    pass
+    # Indices (in the cells of the notebook) of the cells that would be reformatted; only the first one, unless all
+    # cells were checked
+    failing_cells: List[int] = Factory(list)
 
 
 @attrs(auto_attribs=True)
@@ -74,17 +88,45 @@ class BlackFormatRes(FormatResult[str, Dict[str, str]]):
     pass
 
 
-MAGICS_MARKS = ("%", "$")
+@attrs(auto_attribs=True)
+class NotebookFormatRes(BlackFormatRes):
+    # Formatted notebook, in the form it was given (output is always its text)
+    notebook: Notebook = ""
 
 
 def _to_code(lines: List[str]) -> str:
     return "".join(lines)
 
 
+def cell_diff(before: str, after: str, name: str) -> str:
+    """Unified diff of the code of a cell."""
+    diff_lines = difflib.unified_diff(
+        before.splitlines(keepends=True), after.splitlines(keepends=True), fromfile=name, tofile=name
+    )
+    return "".join(line if line.endswith("\n") else line + "\n\\ No newline at end of file\n" for line in diff_lines)
+
+
+def _to_lines(code: str) -> List[str]:
+    """Split code into notebook source lines, each ending with a newline."""
+    lines = code.split("\n")
+    # Black formatter appends "" to end of a code block - mimic this if "" not present
+    if lines[-1] == "":
+        lines.pop()
+    return [line + "\n" for line in lines]
+
+
 class BlackFormatter(FileFormatter[BlackLintRes, BlackFormatRes]):
-    def __init__(self, file_path: Union[str, Path], black_mode_kwargs: BlackFileModeKwargs):
-        super().__init__(file_path)
-        self.mode = FileMode(**black_mode_kwargs)
+    def __init__(
+        self,
+        file_path: Union[str, Path],
+        black_mode_kwargs: BlackFileModeKwargs,
+        cache: Optional[Cache] = None,
+        mode: Optional[FileMode] = None,
+        file_contents: Optional[str] = None,
+    ):  # pylint: disable=too-many-arguments
+        super().__init__(file_path, file_contents)
+        self.mode = mode if mode is not None else FileMode(**black_mode_kwargs)
+        self.cache = cache
 
     def _format_black(self, lines: List[str]) -> FileContent:
         code = _to_code(lines)
@@ -94,102 +136,270 @@ class BlackFormatter(FileFormatter[BlackLintRes, BlackFormatRes]):
     def path(self) -> str:
         return str(self.file_path)
 
-    def run_check(self) -> BlackLintRes:
-        content_json = json.loads(self.file_contents)
-        is_formatted = True
+    def _code_sources(self, strict: bool) -> List[Tuple[int, List[str]]]:
+        """Index and source of the code cells, read without decoding outputs when possible."""
+        with stats.timer("parse"):
+            spans = find_code_sources(self.file_contents, strict=strict)
+            if spans is None:
+                content_json = json_backend.loads(self.file_contents, exact_numbers=False)
+        if spans is not None:
+            return [(span.cell_index, cast(List[str], span.source)) for span in spans]
+        return [(i, cell["source"]) for i, cell in enumerate(content_json["cells"]) if cell["cell_type"] == "code"]
+
+    def run_check(self, all_cells: bool = False, diff: bool = False) -> BlackLintRes:
+        """Check that the code cells are formatted, stopping at the first one that is not.
+
+        With all_cells, every cell is checked. With diff, every cell is checked too and the output has the unified
+        diffs of the cells that would be reformatted.
+        """
         invalid_report: Dict[str, str] = {}
-
-        for cell in content_json["cells"]:
-            if cell["cell_type"] == "code":
-                existing_code = _to_code(cell["source"])
-                format_res = self.format_black_cell(cell["source"])
-                invalid_report = {**invalid_report, **format_res.invalid_report}
-
-                if format_res.output != existing_code:
-                    is_formatted = False
+        failing_cells: List[int] = []
+        diffs: List[str] = []
+
+        for index, source in self._code_sources(strict=False):
+            existing_code = _to_code(source)
+            format_res = self.format_black_cell(source)
+            invalid_report.update(format_res.invalid_report)
+
+            if format_res.output != existing_code:
+                failing_cells.append(index)
+                if diff:
+                    diffs.append(cell_diff(existing_code, format_res.output, f"{self.path}:cell_{index}"))
+                elif not all_cells:
                     break
 
-        return BlackLintRes(self.path, is_okay=is_formatted, output="", invalid_report=invalid_report)
+        return BlackLintRes(
+            self.path,
+            is_okay=not failing_cells,
+            output="".join(diffs),
+            invalid_report=invalid_report,
+            failing_cells=failing_cells,
+        )
 
     def apply_format(self) -> BlackFormatRes:
-        """Parse and black format .ipynb content."""
+        """Parse and black format .ipynb content.
+
+        Only the sources of code cells are replaced in the file contents if they are laid out as this function writes
+        them, which avoids decoding and re-encoding outputs.
+        """
+        with stats.timer("parse"):
+            spans = find_code_sources(self.file_contents)
+        if spans is None:
+            return self._apply_format_json()
+        invalid_report: Dict[str, str] = {}
+        sources: List[List[str]] = []
+
+        for span in spans:
+            format_results = self.format_black_cell(cast(List[str], span.source))
+            sources.append(_to_lines(format_results.output))
+            invalid_report.update(format_results.invalid_report)
+
+        output = splice_sources(self.file_contents, spans, sources)
+        return BlackFormatRes(self.path, output, invalid_report, is_changed=output != self.file_contents)
+
+    def apply_format_low_memory(self) -> Tuple[BlackFormatRes, Iterable[str]]:
+        """Like apply_format, with the output as parts to write one after the other rather than joined in a string.
+
+        Notebooks that are not laid out as this function writes them are still decoded in full, so their memory is
+        only bounded by --max-file-size.
+        """
+        with stats.timer("parse"):
+            spans = find_code_sources(self.file_contents)
+        if spans is None:
+            format_res = self._apply_format_json()
+            return format_res, format_res.output
+        invalid_report: Dict[str, str] = {}
+        sources: List[List[str]] = []
+        # Whitespace after the notebook, e.g. the final newline of notebooks saved by Jupyter, is dropped
+        is_changed = content_end(self.file_contents) != len(self.file_contents)
+
+        for span in spans:
+            format_results = self.format_black_cell(cast(List[str], span.source))
+            sources.append(_to_lines(format_results.output))
+            invalid_report.update(format_results.invalid_report)
+            if not is_changed:
+                is_changed = serialize_source(sources[-1], span.depth) != self.file_contents[span.start : span.end]
+
+        res = BlackFormatRes(self.path, "", invalid_report, is_changed=is_changed)
+        return res, iter_spliced(self.file_contents, spans, sources)
+
+    def _apply_format_json(self) -> BlackFormatRes:
         try:
-            content_json: Dict = json.loads(self.file_contents)
+            with stats.timer("parse"):
+                content_json: Dict = json_backend.loads(self.file_contents)
         except json.decoder.JSONDecodeError:
             invalid_content(self.file_path)
-        newline_hash = str(uuid.uuid4())
         invalid_report: Dict[str, str] = {}
 
         for cell in content_json["cells"]:
             if cell["cell_type"] == "code":
                 format_results = self.format_black_cell(cell["source"])
-                # Replace '\n' with a unique hash
-                blacked_cell = _to_code([newline_hash if char == "\n" else char for char in format_results.output])
-                blacked_cell_lines = blacked_cell.split(newline_hash)
-                # Black formatter appends "" to end of a code block - mimic this if "" not present
-                if blacked_cell_lines[-1] != "":
-                    blacked_cell_lines.append("")
-                cell["source"] = [line + "\n" for line in blacked_cell_lines[:-1]]
+                cell["source"] = _to_lines(format_results.output)
+                invalid_report.update(format_results.invalid_report)
 
-                invalid_report = {**invalid_report, **format_results.invalid_report}
-
-        return BlackFormatRes(self.path, json.dumps(content_json, indent=1), invalid_report)
+        with stats.timer("parse"):
+            output = json_backend.dumps_notebook(content_json)
+        return BlackFormatRes(self.path, output, invalid_report, is_changed=output != self.file_contents)
 
     def format_black_cell(self, cell_lines: List[str]) -> BlackFormatRes:
-        """Black format cell content to defined line length."""
+        """Black format cell content to defined line length, reusing cached results of identical cells.
+
+        Cells over their time or memory budget, or too long to be formatted, are left unchanged and are not cached, as a
+        larger budget may do.
+        """
         code = _to_code(cell_lines)
-        try:  # Try to format all lines
-            return BlackFormatRes(self.path, output=self._format_black(cell_lines), invalid_report={})
-        except InvalidInput as exc:
-            # The cell may contain lines with magics like "%time"
-            if any(magic_mark in str(exc) for magic_mark in MAGICS_MARKS):
-                return self._format_black_with_magics(cell_lines)
-            return BlackFormatRes(self.path, code, {code: str(exc)})
-        except Exception as exc:  # pylint: disable=broad-except
+        if self.cache is not None:
+            cell_data = self.cache.get_cell(code)
+            if cell_data is not None:
+                stats.count("cell_cache_hits")
+                return BlackFormatRes(self.path, cell_data.output, dict(cell_data.invalid_report))
+        skip_reason = limits.current().cell_skip_reason(code)
+        if skip_reason is not None:
+            stats.count("cells_skipped")
+            return BlackFormatRes(self.path, code, {code: skip_reason})
+        try:
+            format_res = self._format_black_cell(code, cell_lines)
+        except limits.BudgetExceeded as exc:
+            stats.count("cells_over_budget")
             return BlackFormatRes(self.path, code, {code: str(exc)})
-
-    def _format_black_with_magics(self, cell_lines: List[str]) -> BlackFormatRes:
-        """Split a cell that contains magics (i.e. lines that start with % or %%) in segments (before and after magics)
-        and try to format each segment with black."""
-        code_segments: List[FileContent] = []
-        invalid_code: Dict[FileContent, str] = {}
-
-        # Find indexes of magic lines
-        magic_line_ix = [i for i, line in enumerate(cell_lines) if line.rstrip(" ").startswith(MAGICS_MARKS)]
-        magic_line_ix = [*magic_line_ix, len(cell_lines)]
-        prev_magic_ix = 0
-
-        # Black each segment
-        for magic_ix in magic_line_ix:
-            segment_lines = cell_lines[prev_magic_ix:magic_ix]
+        if self.cache is not None:
+            self.cache.set_cell(code, format_res.output, format_res.invalid_report)
+        return format_res
+
+    def _format_black_cell(self, code: str, cell_lines: List[str]) -> BlackFormatRes:
+        """Format a cell with a single black call, with IPython magics masked."""
+        if is_cell_magic(code):  # E.g. %%bash: the cell is not Python
+            return BlackFormatRes(self.path, code, {})
+        collector = stats.current()
+        start = time.perf_counter() if collector is not None else 0.0
+        masked_code, replacements = mask_magics(code)
+        with limits.cell_budget():
             try:
-                code_segments.append(self._format_black(segment_lines))
+                output = unmask_magics(format_str(src_contents=masked_code, mode=self.mode), replacements)
+                error = "Cannot restore IPython magics after formatting"
+            except MemoryError:
+                raise
             except Exception as exc:  # pylint: disable=broad-except
-                # Mark code as invalid syntax
-                code = _to_code(segment_lines)
-                code_segments.append(code)
-                invalid_code[code] = str(exc)
-            finally:
-                if magic_ix < len(cell_lines):
-                    code_segments.append(cell_lines[magic_ix])
-            prev_magic_ix = magic_ix + 1
-        return BlackFormatRes(self.path, _to_code(code_segments), invalid_code)
-
-
-def format_jupyter_file(file: str, kwargs: BlackFileModeKwargs) -> BlackFormatRes:
-    print(f"Reformatting {file}")
-    formatter = BlackFormatter(file, black_mode_kwargs=kwargs)
-    format_res = formatter.apply_format()
-    write_jupyter_file(format_res.output, file)
+                output, error = None, restore_magics(str(exc), replacements)
+
+            if output is None and replacements:
+                # Masking was wrong, e.g. for a line starting with "%" inside brackets, which is a modulo, not a magic
+                stats.count("magic_fallbacks")
+                try:
+                    output = self._format_black(cell_lines)
+                except MemoryError:
+                    raise
+                except Exception:  # pylint: disable=broad-except
+                    pass
+        if collector is not None:
+            collector.record_cell(self.path, code, time.perf_counter() - start)
+        if output is None:
+            return BlackFormatRes(self.path, code, {code: error})
+        return BlackFormatRes(self.path, output=output, invalid_report={})
+
+
+def format_jupyter_file(
+    file: str,
+    kwargs: BlackFileModeKwargs,
+    cache: Optional[Cache] = None,
+    mode: Optional[FileMode] = None,
+    *,
+    low_memory: bool = False,
+) -> BlackFormatRes:
+    """Format a notebook in place. With low_memory, the notebook is never decoded or serialized in full."""
+    # pylint: disable=too-many-arguments
+    if cache is not None and not cache.is_changed(file):
+        return BlackFormatRes(file, output="", invalid_report={})
+    formatter = BlackFormatter(file, black_mode_kwargs=kwargs, cache=cache, mode=mode)
+    parts: Union[str, Iterable[str]]
+    if low_memory:
+        format_res, parts = formatter.apply_format_low_memory()
+    else:
+        format_res = formatter.apply_format()
+        parts = format_res.output
+    if format_res.is_changed:  # Byte-identical output is not written, which keeps mtimes (and caches) intact
+        print(f"Reformatting {file}")
+        write_jupyter_file(parts, file)
     return format_res
 
 
-def check_jupyter_file(file: str, kwargs: BlackFileModeKwargs) -> BlackLintRes:
-    checker = BlackFormatter(file, black_mode_kwargs=kwargs)
-    return checker.run_check()
-
-
-def write_jupyter_file(content: str, filename: Union[Path, str]) -> None:
-    """Safely write to .ipynb file."""
-    with safer.open(filename, "w") as ipynb_outfile:
-        ipynb_outfile.write(content)
+def check_jupyter_file(
+    file: str,
+    kwargs: BlackFileModeKwargs,
+    cache: Optional[Cache] = None,
+    mode: Optional[FileMode] = None,
+    *,
+    all_cells: bool = False,
+    diff: bool = False,
+) -> BlackLintRes:
+    # pylint: disable=too-many-arguments
+    if cache is not None and not cache.is_changed(file):
+        return BlackLintRes(file, is_okay=True, output="", invalid_report={})
+    checker = BlackFormatter(file, black_mode_kwargs=kwargs, cache=cache, mode=mode)
+    return checker.run_check(all_cells=all_cells, diff=diff)
+
+
+def _notebook_text(notebook: Notebook) -> str:
+    if isinstance(notebook, dict):
+        return json_backend.dumps_notebook(notebook)
+    if isinstance(notebook, bytes):
+        return notebook.decode("utf-8")
+    if isinstance(notebook, str):
+        return notebook
+    raise TypeError(f"Expected a notebook as str, bytes or dict, got {type(notebook).__name__}")
+
+
+def format_notebook(
+    notebook: Notebook,
+    kwargs: Optional[BlackFileModeKwargs] = None,
+    cache: Optional[Cache] = None,
+    mode: Optional[FileMode] = None,
+    name: str = "<notebook>",
+) -> NotebookFormatRes:
+    """Black format a notebook held in memory, without reading or writing files.
+
+    Raises ValueError if the notebook is malformed.
+    """
+    # pylint: disable=too-many-arguments
+    formatter = BlackFormatter(name, kwargs or {}, cache, mode, file_contents=_notebook_text(notebook))
+    try:
+        format_res = formatter.apply_format()
+    except (SystemExit, KeyError, TypeError) as exc:
+        raise ValueError(f"Notebook {name} is malformed") from exc
+    formatted: Notebook = format_res.output
+    if isinstance(notebook, dict):
+        formatted = json.loads(format_res.output) if format_res.is_changed else notebook
+    elif isinstance(notebook, bytes):
+        formatted = format_res.output.encode("utf-8") if format_res.is_changed else notebook
+    return NotebookFormatRes(name, format_res.output, format_res.invalid_report, format_res.is_changed, formatted)
+
+
+def check_notebook(
+    notebook: Notebook,
+    kwargs: Optional[BlackFileModeKwargs] = None,
+    cache: Optional[Cache] = None,
+    mode: Optional[FileMode] = None,
+    name: str = "<notebook>",
+    *,
+    all_cells: bool = False,
+    diff: bool = False,
+) -> BlackLintRes:
+    """Check that a notebook held in memory is formatted (see BlackFormatter.run_check).
+
+    Raises ValueError if the notebook is malformed.
+    """
+    # pylint: disable=too-many-arguments
+    checker = BlackFormatter(name, kwargs or {}, cache, mode, file_contents=_notebook_text(notebook))
+    try:
+        return checker.run_check(all_cells=all_cells, diff=diff)
+    except (SystemExit, KeyError, TypeError) as exc:
+        raise ValueError(f"Notebook {name} is malformed") from exc
+
+
+def write_jupyter_file(content: Union[str, Iterable[str]], filename: Union[Path, str]) -> None:
+    """Safely write to .ipynb file, the content as a whole or in parts."""
+    with stats.timer("write"), safer.open(filename, "w") as ipynb_outfile:
+        if isinstance(content, str):
+            ipynb_outfile.write(content)
+        else:
+            ipynb_outfile.writelines(content)
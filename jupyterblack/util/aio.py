@@ -0,0 +1,120 @@
+"""Format notebooks from asyncio code, e.g. a Jupyter server extension, without blocking the event loop."""
+
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional, TypeVar
+
+from black import FileMode
+
+from jupyterblack.parser import (
+    BlackFileModeKwargs,
+    BlackLintRes,
+    Notebook,
+    NotebookFormatRes,
+    check_notebook,
+    format_notebook,
+)
+from jupyterblack.util.cache import Cache
+from jupyterblack.util.limits import Limits
+from jupyterblack.util.processing import check_notebook_in_server_worker, format_notebook_in_server_worker, init_worker
+
+T = TypeVar("T")
+
+
+class AsyncFormatter:
+    """Format and check notebooks held in memory in a pool of worker processes (or threads), from asyncio code.
+
+    At most max_concurrency notebooks are handed to the pool at once (by default, as many as there are workers), so
+    that a burst of requests waits in the event loop instead of piling up in the pool. Requests can be cancelled and
+    given a timeout, which includes the wait for the pool; a notebook already being formatted keeps its place until
+    black is done with it, which cell_timeout bounds in worker processes (see --cell-timeout). Worker processes keep the
+    cells they format in their own cache, so that formatting a notebook again after editing a cell is fast.
+
+    Use it as an async context manager, or call close() when done.
+    """
+
+    def __init__(
+        self,
+        kwargs: Optional[BlackFileModeKwargs] = None,
+        *,
+        n_workers: int = 1,
+        max_concurrency: Optional[int] = None,
+        use_threads: bool = False,
+        cell_timeout: Optional[float] = None,
+    ):
+        self.kwargs: BlackFileModeKwargs = kwargs or {}
+        self.max_concurrency = max_concurrency or n_workers
+        self.use_threads = use_threads
+        self.executor: Executor
+        if use_threads:  # Threads still share the GIL with the event loop, but avoid starting processes
+            self.executor = ThreadPoolExecutor(max_workers=n_workers)
+        else:
+            initargs = (Cache.in_memory(self.kwargs), self.kwargs, False, Limits(cell_timeout=cell_timeout))
+            self.executor = ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=initargs)
+        self._mode = FileMode(**self.kwargs)
+        # Created in the event loop of the first request, as asyncio primitives are bound to a loop before Python 3.10
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> "AsyncFormatter":
+        return self
+
+    async def __aexit__(self, *_: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Shut the pool down without waiting for the notebooks being formatted."""
+        self.executor.shutdown(wait=False)
+
+    async def format_notebook(
+        self, notebook: Notebook, name: str = "<notebook>", timeout: Optional[float] = None
+    ) -> NotebookFormatRes:
+        """Format a notebook, as parser.format_notebook, raising asyncio.TimeoutError after timeout seconds."""
+        if self.use_threads:
+            func = partial(format_notebook, notebook, self.kwargs, None, self._mode, name)
+        else:
+            func = partial(format_notebook_in_server_worker, notebook, self.kwargs, name)
+        return await self._run(func, timeout)
+
+    async def check_notebook(
+        self,
+        notebook: Notebook,
+        name: str = "<notebook>",
+        timeout: Optional[float] = None,
+        *,
+        all_cells: bool = False,
+        diff: bool = False,
+    ) -> BlackLintRes:
+        """Check a notebook, as parser.check_notebook, raising asyncio.TimeoutError after timeout seconds."""
+        # pylint: disable=too-many-arguments
+        func: Callable[[], BlackLintRes]
+        if self.use_threads:
+            func = partial(
+                check_notebook, notebook, self.kwargs, None, self._mode, name, all_cells=all_cells, diff=diff
+            )
+        else:
+            func = partial(check_notebook_in_server_worker, notebook, self.kwargs, name, all_cells, diff)
+        return await self._run(func, timeout)
+
+    async def _run(self, func: Callable[[], T], timeout: Optional[float]) -> T:
+        return await asyncio.wait_for(self._submit(func), timeout)
+
+    async def _submit(self, func: Callable[[], T]) -> T:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        semaphore = self._semaphore
+        await semaphore.acquire()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, func)
+        except BaseException:
+            semaphore.release()
+            raise
+
+        def release(done: "asyncio.Future[T]") -> None:
+            semaphore.release()
+            if not done.cancelled():
+                done.exception()  # Retrieved, as the request may have given up on it
+
+        # The place is only given back when the pool is done with the notebook, not when the request gives up on it
+        future.add_done_callback(release)
+        return await asyncio.shield(future)
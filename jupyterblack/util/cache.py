@@ -0,0 +1,226 @@
+"""On-disk cache of formatted notebooks and code cells.
+
+The cache has two levels, both keyed by the black mode in use:
+
+- files: path -> (mtime, size, content hash) of notebooks that are known to be formatted (LRU, size capped)
+- cells: hash of the cell source -> formatted source and invalid report (LRU, size capped)
+
+It also keeps the time it last took to process each file (size capped too), which is used to schedule expensive files
+first.
+"""
+
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Mapping, NamedTuple, Optional, Tuple, Union
+
+from jupyterblack import __version__
+
+DEFAULT_MAX_CELLS = 100_000
+DEFAULT_MAX_FILES = 100_000
+# Files are hashed in chunks of that many bytes, so that large notebooks are not read in memory at once
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class FileData(NamedTuple):
+    st_mtime: float
+    st_size: int
+    hash: str
+
+
+class CellData(NamedTuple):
+    output: str
+    invalid_report: Dict[str, str]
+
+
+def get_cache_dir() -> Path:
+    """Cache directory, overridable through the JUPYTERBLACK_CACHE_DIR environment variable."""
+    cache_dir = os.environ.get("JUPYTERBLACK_CACHE_DIR")
+    if cache_dir:
+        return Path(cache_dir)
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return Path(cache_home) / "jupyterblack" / __version__
+
+
+def clear_cache(cache_dir: Optional[Path] = None) -> None:
+    shutil.rmtree(cache_dir or get_cache_dir(), ignore_errors=True)
+
+
+def get_mode_key(mode_kwargs: Mapping[str, Any]) -> str:
+    """Stable key of the black version and the black mode, so that defaults and explicit values share a cache."""
+    # pylint: disable=import-outside-toplevel
+    from black import FileMode
+    from black import __version__ as black_version
+
+    key = f"{black_version}|{FileMode(**mode_kwargs).get_cache_key()}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def hash_digest(path: Union[str, Path]) -> str:
+    with open(path, "rb") as file:
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(file, "sha256").hexdigest()
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
+def hash_source(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+class Cache:  # pylint: disable=too-many-instance-attributes
+    """Formatting cache for a single black mode."""
+
+    def __init__(
+        self,
+        mode_key: str,
+        cache_file: Optional[Path],
+        files: Optional[Dict[str, FileData]] = None,
+        cells: Optional["OrderedDict[str, CellData]"] = None,
+        *,
+        costs: Optional[Dict[str, float]] = None,
+        max_cells: int = DEFAULT_MAX_CELLS,
+        max_files: int = DEFAULT_MAX_FILES,
+    ):  # pylint: disable=too-many-arguments
+        self.mode_key = mode_key
+        self.cache_file = cache_file
+        self.files: "OrderedDict[str, FileData]" = OrderedDict(files or {})
+        self.cells: "OrderedDict[str, CellData]" = cells if cells is not None else OrderedDict()
+        self.max_cells = max_cells
+        self.max_files = max_files
+        self.costs: Dict[str, float] = costs if costs is not None else {}
+        self.new_cells: Dict[str, CellData] = {}
+        # Minimum time between two writes, for long-running processes that update the cache often (e.g. --watch)
+        self.write_interval = 0.0
+        self.last_write: Optional[float] = None
+
+    @classmethod
+    def read(
+        cls,
+        mode_kwargs: Mapping[str, Any],
+        cache_dir: Optional[Path] = None,
+        max_cells: int = DEFAULT_MAX_CELLS,
+        max_files: int = DEFAULT_MAX_FILES,
+    ) -> "Cache":
+        """Read the cache for the given black mode, or start an empty one if it is missing or unreadable."""
+        mode_key = get_mode_key(mode_kwargs)
+        cache_file = (cache_dir or get_cache_dir()) / f"cache.{mode_key}.pickle"
+        try:
+            with open(cache_file, "rb") as fobj:
+                files, cells, costs = pickle.load(fobj)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError):
+            return cls(mode_key, cache_file, max_cells=max_cells, max_files=max_files)
+        return cls(
+            mode_key, cache_file, files, OrderedDict(cells), costs=costs, max_cells=max_cells, max_files=max_files
+        )
+
+    @classmethod
+    def in_memory(cls, mode_kwargs: Mapping[str, Any]) -> "Cache":
+        """Empty cache that is never written to disk."""
+        return cls(get_mode_key(mode_kwargs), None)
+
+    @staticmethod
+    def get_file_data(path: Union[str, Path]) -> FileData:
+        stat = os.stat(path)
+        return FileData(stat.st_mtime, stat.st_size, hash_digest(path))
+
+    def is_changed(self, path: Union[str, Path]) -> bool:
+        """Whether the file changed since it was last recorded as formatted."""
+        old = self.files.get(str(path))
+        if old is None:
+            return True
+        try:
+            stat = os.stat(path)
+        except OSError:
+            del self.files[str(path)]
+            return True
+        self.files.move_to_end(str(path))
+        if stat.st_size != old.st_size:
+            return True
+        if stat.st_mtime != old.st_mtime:
+            return hash_digest(path) != old.hash
+        return False
+
+    def mark_done(self, paths: Iterable[Union[str, Path]], file_data: Optional[Mapping[str, FileData]] = None) -> None:
+        """Record files as formatted, with their file data if it is known already (e.g. from a worker)."""
+        for path in paths:
+            known = file_data.get(str(path)) if file_data is not None else None
+            if known is None:
+                old = self.files.get(str(path))
+                stat = os.stat(path)
+                if old is not None and (stat.st_mtime, stat.st_size) == (old.st_mtime, old.st_size):
+                    self.files.move_to_end(str(path))
+                    continue
+                known = self.get_file_data(path)
+            self.files[str(path)] = known
+            self.files.move_to_end(str(path))
+
+    def set_cost(self, path: Union[str, Path], duration: float) -> None:
+        self.costs.pop(str(path), None)
+        self.costs[str(path)] = duration
+
+    def __contains__(self, source: str) -> bool:
+        return hash_source(source) in self.cells
+
+    def get_cell(self, source: str) -> Optional[CellData]:
+        key = hash_source(source)
+        cell_data = self.cells.get(key)
+        if cell_data is not None:
+            self.cells.move_to_end(key)
+        return cell_data
+
+    def set_cell(self, source: str, output: str, invalid_report: Dict[str, str]) -> None:
+        key = hash_source(source)
+        cell_data = CellData(output, invalid_report)
+        self.cells[key] = cell_data
+        self.cells.move_to_end(key)
+        self.new_cells[key] = cell_data
+
+    def pop_new_cells(self) -> Dict[str, CellData]:
+        """Cell entries added since the last call, used to ship worker cache updates back to the parent."""
+        new_cells, self.new_cells = self.new_cells, {}
+        return new_cells
+
+    def update_cells(self, cells: Dict[str, CellData]) -> None:
+        for key, cell_data in cells.items():
+            self.cells[key] = cell_data
+            self.cells.move_to_end(key)
+
+    def evict(self) -> None:
+        """Drop the least recently used cells and files above the size caps, and the oldest costs."""
+        while len(self.cells) > self.max_cells:
+            self.cells.popitem(last=False)
+        while len(self.files) > self.max_files:
+            self.files.popitem(last=False)
+        while len(self.costs) > self.max_files:
+            del self.costs[next(iter(self.costs))]
+
+    def write(self, force: bool = False) -> None:
+        """Atomically write the cache to disk, unless it is an in-memory cache or, unless forced, it was written less
+        than write_interval seconds ago."""
+        if self.cache_file is None:
+            return
+        now = time.monotonic()
+        if not force and self.last_write is not None and now - self.last_write < self.write_interval:
+            return
+        self.last_write = now
+        self.evict()
+        payload: Tuple[Dict[str, FileData], Dict[str, CellData], Dict[str, float]] = (
+            dict(self.files),
+            dict(self.cells),
+            self.costs,
+        )
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=str(self.cache_file.parent), delete=False) as fobj:
+                pickle.dump(payload, fobj, protocol=4)
+            os.replace(fobj.name, self.cache_file)
+        except OSError:
+            pass
@@ -0,0 +1,138 @@
+"""Client of jblackd, the formatting daemon, which speaks JSON over HTTP on a Unix socket or a localhost port.
+
+Requests are POSTed to "/" as a JSON object with:
+
+- "notebook": notebook text or decoded notebook, or "cells": list of cell sources
+- "mode": black mode, as BlackFileModeKwargs with target versions given by name (e.g. ["py38"])
+- "check": whether to only check the notebook, and with it "all_cells" and "diff" (see BlackFormatter.run_check)
+
+and answered with "is_changed", "invalid_report" and, unless checking, the formatted "notebook" (in the form it was
+sent) or "cells". Checks are answered with the "failing_cells" and their "diff" instead. A GET on "/" returns the
+versions and number of workers of the daemon. Errors are answered with an error status (400 for invalid requests)
+and an "error" message.
+"""
+
+import http.client
+import json
+import os
+import socket
+from typing import Any, Dict, List, Mapping, Optional, Tuple, Union
+
+from jupyterblack import __version__
+from jupyterblack.util.cache import get_cache_dir
+
+DEFAULT_PORT = 45485
+UNIX_PREFIX = "unix:"
+
+
+class DaemonError(Exception):
+    """Error reported by jblackd for a request, with the HTTP status of the answer (400 for invalid requests)."""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+def default_address() -> str:
+    """Address of jblackd, overridable through the JBLACKD_ADDRESS environment variable."""
+    address = os.environ.get("JBLACKD_ADDRESS")
+    if address:
+        return address
+    if hasattr(socket, "AF_UNIX"):
+        return f"{UNIX_PREFIX}{get_cache_dir() / 'jblackd.sock'}"
+    return f"localhost:{DEFAULT_PORT}"
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    """Path of a Unix socket ("unix:PATH") or (host, port) of a TCP address ("HOST:PORT" or "PORT")."""
+    if address.startswith(UNIX_PREFIX):
+        return address[len(UNIX_PREFIX) :]
+    host, _, port = address.rpartition(":")
+    try:
+        return host or "localhost", int(port)
+    except ValueError as exc:
+        raise ValueError(f"Invalid jblackd address {address!r}, expected unix:PATH or HOST:PORT") from exc
+
+
+def mode_to_json(kwargs: Mapping[str, Any]) -> Dict[str, Any]:
+    """Black mode as JSON, with target versions given by name."""
+    mode = dict(kwargs)
+    if "target_versions" in mode:
+        mode["target_versions"] = sorted(version.name.lower() for version in mode["target_versions"])
+    return mode
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)  # pylint: disable=no-member
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class DaemonClient:
+    """Connection details of a running jblackd; every request opens its own connection, so it's thread-safe."""
+
+    def __init__(self, address: Optional[str] = None, timeout: Optional[float] = None):
+        self.address = address or default_address()
+        self.timeout = timeout
+        self._parsed_address = parse_address(self.address)
+
+    @classmethod
+    def connect(cls, address: Optional[str] = None, timeout: Optional[float] = None) -> Optional["DaemonClient"]:
+        """Client of the daemon at the address, or None if it is not running (or runs another jupyterblack)."""
+        client = cls(address, timeout)
+        try:
+            info = client.ping()
+        except (OSError, http.client.HTTPException, DaemonError, ValueError):
+            return None
+        return client if info.get("version") == __version__ else None
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if isinstance(self._parsed_address, str):
+            return UnixHTTPConnection(self._parsed_address, timeout=self.timeout)
+        host, port = self._parsed_address
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _request(self, method: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        connection = self._connection()
+        try:
+            body = json.dumps(payload).encode("utf-8") if payload is not None else None
+            connection.request(method, "/", body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            content: Dict[str, Any] = json.loads(response.read().decode("utf-8"))
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise DaemonError(content.get("error", f"jblackd answered with status {response.status}"), response.status)
+        return content
+
+    def ping(self) -> Dict[str, Any]:
+        """Versions and number of workers of the daemon."""
+        return self._request("GET")
+
+    def format_notebook(
+        self,
+        notebook: Union[str, Dict[str, Any]],
+        kwargs: Mapping[str, Any],
+        check: bool = False,
+        *,
+        all_cells: bool = False,
+        diff: bool = False,
+    ) -> Dict[str, Any]:
+        # pylint: disable=too-many-arguments
+        payload = {"notebook": notebook, "mode": mode_to_json(kwargs), "check": check}
+        if check:
+            payload.update(all_cells=all_cells, diff=diff)
+        return self._request("POST", payload)
+
+    def format_cells(self, cells: List[str], kwargs: Mapping[str, Any]) -> Dict[str, Any]:
+        return self._request("POST", {"cells": cells, "mode": mode_to_json(kwargs)})
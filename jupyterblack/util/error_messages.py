@@ -1,6 +1,6 @@
 """Print error message to console."""
 from pathlib import Path
-from typing import List, Union
+from typing import List, NoReturn, Union
 
 
 def invalid_paths(files: List[Union[str, Path]]) -> None:
@@ -19,9 +19,17 @@ Try 'jblack [-h, --help]' for help."""
     )
 
 
-def invalid_content(file: Union[str, Path]) -> None:
+def invalid_content(file: Union[str, Path]) -> NoReturn:
     """Error message for file with malformed Jupyter content."""
     raise SystemExit(
         f"""Error: File {file} is malformed.\n
 Try 'jblack [-h, --help]' for help."""
     )
+
+
+def git_error(message: str) -> NoReturn:
+    """Error message for a git repository that can't be queried."""
+    raise SystemExit(
+        f"""Error: Could not list changed files with git: {message}.\n
+Try 'jblack [-h, --help]' for help."""
+    )
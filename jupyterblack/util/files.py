@@ -1,11 +1,15 @@
+import os
 import re
+from functools import lru_cache
 from pathlib import Path
-from typing import Iterable, List, Sequence, Union, cast
-
-import safer
+from typing import Any, Iterable, Iterator, List, Optional, Pattern, Sequence, Tuple, Union, cast
 
 from jupyterblack.util.error_messages import invalid_extensions, invalid_paths
 
+# Target that reads notebooks from stdin and writes them to stdout, and the name of such notebooks in messages
+STDIN = "-"
+STDIN_NAME = "<stdin>"
+
 
 def resolve(path: Union[str, Path]) -> Path:
     return path.resolve() if isinstance(path, Path) else Path(path).resolve()
@@ -13,6 +17,9 @@ def resolve(path: Union[str, Path]) -> Path:
 
 def read_file(path: Union[str, Path], encoding: str = "utf-8") -> str:
     """Safely open .ipynb file."""
+    # Imported on first use, so that the CLI starts quickly
+    import safer  # pylint: disable=import-outside-toplevel
+
     with safer.open(resolve(path), "r", encoding=encoding) as ipynb_infile:
         return cast(str, ipynb_infile.read())
 
@@ -24,29 +31,186 @@ def write_file(
         return file.read()
 
 
-def get_files(path: Union[str, Path]) -> List[str]:
+# Directories that never hold notebooks worth formatting, matched against "/"-separated paths relative to the target
+DEFAULT_EXCLUDES = (
+    r"/(\.direnv|\.eggs|\.git|\.hg|\.ipynb_checkpoints|\.mypy_cache|\.nox|\.pytest_cache|\.svn|\.tox|\.venv"
+    r"|__pycache__|__pypackages__|_build|buck-out|build|dist|node_modules|venv)/"
+)
+
+
+# Matches nothing, for an empty list of regexes
+NO_MATCH = re.compile("(?!)")
+
+
+@lru_cache(maxsize=None)
+def compile_regexes(regexes: Tuple[str, ...], kind: str = "paths") -> Optional[Pattern[str]]:
+    """Single alternation of the regexes, compiled once per set of regexes, or None if there are none."""
+    regexes = tuple(regex for regex in regexes if regex)
+    if not regexes:
+        return None
+    try:
+        return re.compile(regexes[0] if len(regexes) == 1 else "|".join(f"(?:{regex})" for regex in regexes))
+    except re.error as exc:
+        raise SystemExit(f"Error: Invalid regular expression for {kind}: {exc}") from exc
+
+
+def compile_excludes(exclude: Optional[str] = None, extend_exclude: Optional[str] = None) -> Pattern[str]:
+    """Regex of excluded paths: the default excludes (or the given exclude), and the extra excludes."""
+    regexes = (DEFAULT_EXCLUDES if exclude is None else exclude, extend_exclude or "")
+    return compile_regexes(regexes, "excluded paths") or NO_MATCH
+
+
+def compile_include(include: Optional[str] = None) -> Optional[Pattern[str]]:
+    """Regex of included files, or None to include every notebook."""
+    return compile_regexes((include or "",), "included paths")
+
+
+def _read_gitignore(directory: str) -> Optional[Any]:
+    """PathSpec of the .gitignore file of a directory, if there is one (pathspec comes with black)."""
+    try:
+        with open(os.path.join(directory, ".gitignore"), encoding="utf-8") as gitignore:
+            lines = gitignore.read().splitlines()
+    except (OSError, UnicodeDecodeError):
+        return None
+    try:
+        import pathspec  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    if hasattr(pathspec, "GitIgnoreSpec"):  # pathspec >= 0.10
+        return pathspec.GitIgnoreSpec.from_lines(lines)
+    return pathspec.PathSpec.from_lines("gitwildmatch", lines)
+
+
+def _sorted_entries(path: str) -> List["os.DirEntry[str]"]:
+    try:
+        with os.scandir(path) as scanner:
+            return sorted(scanner, key=lambda entry: entry.name)
+    except OSError:  # Unreadable or vanished directory
+        return []
+
+
+def _entry_kind(entry: "os.DirEntry[str]", suffix: str) -> Optional[bool]:
+    """True for directories, False for files with the suffix, None for anything else."""
+    try:
+        if entry.is_dir(follow_symlinks=False):
+            return True
+        if entry.name.endswith(suffix) and entry.is_file():
+            return False
+    except OSError:
+        pass
+    return None
+
+
+def _is_excluded(relative: str, exclude: Pattern[str], gitignores: List[Tuple[str, Any]]) -> bool:
+    return bool(exclude.search(relative)) or any(spec.match_file(relative[len(base) :]) for base, spec in gitignores)
+
+
+def iter_dir_files(
+    directory: Union[str, Path],
+    suffix: str = ".ipynb",
+    exclude: Optional[Pattern[str]] = None,
+    gitignore: bool = True,
+    include: Optional[Pattern[str]] = None,
+) -> Iterator[str]:
+    """Yield the files with the given suffix below a directory as they are found, in a stable order.
+
+    Directories matching exclude (the default excludes if None) or ignored by a .gitignore file are not entered, and
+    only files matching include (if given) are yielded. Paths are searched as "/"-separated paths relative to the
+    directory, with a leading "/" and, for directories, a trailing "/". Symbolic links to directories are not followed.
+    """
+    if exclude is None:
+        exclude = compile_excludes()
+    # Directories to visit: path, relative path, and the .gitignore specs that apply (with the path they're relative to)
+    stack: List[Tuple[str, str, List[Tuple[str, Any]]]] = [(str(resolve(directory)), "/", [])]
+    while stack:
+        path, relative, gitignores = stack.pop()
+        if gitignore:
+            spec = _read_gitignore(path)
+            if spec is not None:
+                gitignores = [*gitignores, (relative, spec)]
+        subdirectories = []
+        for entry in _sorted_entries(path):
+            is_dir = _entry_kind(entry, suffix)
+            if is_dir is None:
+                continue
+            entry_relative = f"{relative}{entry.name}/" if is_dir else f"{relative}{entry.name}"
+            if _is_excluded(entry_relative, exclude, gitignores):
+                continue
+            if is_dir:
+                subdirectories.append((entry.path, entry_relative, gitignores))
+            elif include is None or include.search(entry_relative):
+                yield entry.path
+        stack.extend(reversed(subdirectories))
+
+
+def is_dir_file(
+    directory: Union[str, Path],
+    path: str,
+    *,
+    suffix: str = ".ipynb",
+    exclude: Optional[Pattern[str]] = None,
+    gitignore: bool = True,
+    include: Optional[Pattern[str]] = None,
+) -> bool:
+    """Whether iter_dir_files would yield a path (e.g. a new file) below a directory, without walking the directory.
+
+    Only the directories leading to the path are looked at, for their .gitignore files.
+    """
+    # pylint: disable=too-many-arguments
+    if exclude is None:
+        exclude = compile_excludes()
+    prefix = os.path.join(str(resolve(directory)), "")
+    if not path.startswith(prefix) or not path.endswith(suffix) or not os.path.isfile(path):
+        return False
+    parts = path[len(prefix) :].split(os.sep)
+    current, relative = prefix, "/"
+    gitignores: List[Tuple[str, Any]] = []
+    for i, part in enumerate(parts):
+        if gitignore:
+            spec = _read_gitignore(current)
+            if spec is not None:
+                gitignores = [*gitignores, (relative, spec)]
+        is_dir = i < len(parts) - 1
+        current = os.path.join(current, part)
+        if is_dir and os.path.islink(current):  # Not followed by the walk
+            return False
+        relative = f"{relative}{part}/" if is_dir else f"{relative}{part}"
+        if _is_excluded(relative, exclude, gitignores):
+            return False
+    return include is None or bool(include.search(relative))
+
+
+def get_files(
+    path: Union[str, Path], exclude: Optional[Pattern[str]] = None, include: Optional[Pattern[str]] = None
+) -> List[str]:
     resolved_path = resolve(path)
     if resolved_path.is_dir():
-        return list(map(str, dir_to_files(resolved_path)))
+        return list(iter_dir_files(resolved_path, exclude=exclude, include=include))
     return [str(resolved_path)]
 
 
 def dir_to_files(directory: Path, suffix: str = ".ipynb") -> List[Path]:
-    return list(directory.glob(f"**/*{suffix}"))
+    return list(map(Path, iter_dir_files(directory, suffix)))
 
 
 def filter_files(
     files: Iterable[str],
     include_regexes: Sequence[str] = (),
     exclude_regexes: Sequence[str] = (),
+    suffix: str = ".ipynb",
 ) -> List[str]:
-    include = [re.compile(regex) for regex in (".*.ipynb", *include_regexes)]
-    exclude = [re.compile(regex) for regex in exclude_regexes]
-    return [
-        file
-        for file in files
-        if all(regex.match(file) for regex in include) and not any(regex.match(file) for regex in exclude)
-    ]
+    """Files with the suffix that match any of the include regexes (if any) and none of the exclude regexes.
+
+    The regexes are matched at the start of the file paths, and compiled once into a single alternation.
+    """
+    include = compile_regexes(tuple(include_regexes), "included paths")
+    exclude = compile_regexes(tuple(exclude_regexes), "excluded paths")
+    files = [file for file in files if file.endswith(suffix)]
+    if include is not None:
+        files = [file for file in files if include.match(file)]
+    if exclude is not None:
+        files = [file for file in files if not exclude.match(file)]
+    return files
 
 
 def check_paths_exist(paths: Sequence[Union[str, Path]]) -> None:
@@ -0,0 +1,51 @@
+"""Notebooks that changed in git repositories, so that only those are formatted or checked."""
+
+import subprocess
+from pathlib import Path
+from typing import Iterable, List, Optional, Set, Union
+
+from jupyterblack.util.error_messages import git_error
+from jupyterblack.util.files import resolve
+
+
+def _git(directory: Union[str, Path], *args: str) -> str:
+    try:
+        completed = subprocess.run(
+            ["git", "-C", str(directory), *args], capture_output=True, check=True, encoding="utf-8"
+        )
+    except FileNotFoundError:
+        git_error("git is not installed")
+    except subprocess.CalledProcessError as exc:
+        git_error(exc.stderr.strip() or f"git {' '.join(args)} failed")
+    return completed.stdout
+
+
+def _split(output: str) -> List[str]:
+    return [name for name in output.split("\0") if name]
+
+
+def repository_root(path: Union[str, Path]) -> Path:
+    """Top-level directory of the git repository of a file or directory."""
+    resolved_path = resolve(path)
+    directory = resolved_path if resolved_path.is_dir() else resolved_path.parent
+    return resolve(_git(directory, "rev-parse", "--show-toplevel").strip())
+
+
+def changed_files(
+    targets: Iterable[Union[str, Path]], since: Optional[str] = None, staged: bool = False, suffix: str = ".ipynb"
+) -> Set[str]:
+    """Resolved paths of the existing files with the suffix that changed in the repositories of the targets.
+
+    With since, these are the files of the working tree that differ from that commit (staged or not) and untracked
+    files that are not ignored. With staged, these are the files staged in the index.
+    """
+    changed: Set[str] = set()
+    for root in sorted({repository_root(target) for target in targets}):
+        names: List[str] = []
+        if since is not None:
+            names += _split(_git(root, "diff", "--name-only", "-z", "--diff-filter=d", since, "--"))
+            names += _split(_git(root, "ls-files", "--others", "--exclude-standard", "-z"))
+        if staged:
+            names += _split(_git(root, "diff", "--cached", "--name-only", "-z", "--diff-filter=d", "--"))
+        changed.update(str(root / name) for name in names if name.endswith(suffix) and (root / name).is_file())
+    return changed
@@ -0,0 +1,87 @@
+"""Decode notebooks with orjson or ujson when they are installed, and fall back to the standard library.
+
+Notebooks are always encoded with the standard library: neither orjson (no indent=1) nor ujson (floats are written as
+1e-7 instead of 1e-07) write the same bytes as ``json.dumps(notebook, indent=1)``. Decoding is equivalent with all
+backends, except that orjson reads integers beyond 64 bits as floats. It is therefore only used when numbers don't
+matter, i.e. when only the cells are read and the notebook is not written back. Any document a fast backend rejects
+(e.g. NaN with orjson) is decoded again with the standard library, which also raises the usual errors.
+
+The backend can be forced with the JUPYTERBLACK_JSON_BACKEND environment variable (json, ujson, orjson or auto).
+"""
+
+import importlib
+import json
+import os
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+AUTO_BACKEND = "auto"
+
+
+class JsonBackend(NamedTuple):
+    name: str
+    loads: Callable[[str], Any]
+    exact_numbers: bool
+
+
+STDLIB_BACKEND = JsonBackend("json", json.loads, exact_numbers=True)
+
+# In order of preference
+_BACKEND_MODULES: Dict[str, bool] = {"orjson": False, "ujson": True}
+
+
+def _import_backend(name: str) -> Optional[JsonBackend]:
+    if name == STDLIB_BACKEND.name:
+        return STDLIB_BACKEND
+    try:
+        module = importlib.import_module(name)
+    except ImportError:
+        return None
+    return JsonBackend(name, module.loads, exact_numbers=_BACKEND_MODULES[name])
+
+
+def available_backends(name: Optional[str] = None) -> List[JsonBackend]:
+    """Installed backends in order of preference, or only the requested one."""
+    name = name or os.environ.get("JUPYTERBLACK_JSON_BACKEND", AUTO_BACKEND)
+    if name == AUTO_BACKEND:
+        names = [*_BACKEND_MODULES, STDLIB_BACKEND.name]
+    elif name in _BACKEND_MODULES or name == STDLIB_BACKEND.name:
+        names = [name]
+    else:
+        raise ValueError(f"Unknown JSON backend {name!r}, expected one of {[AUTO_BACKEND, *_BACKEND_MODULES, 'json']}")
+    backends = [_import_backend(backend_name) for backend_name in names]
+    return [backend for backend in backends if backend is not None] or [STDLIB_BACKEND]
+
+
+_backends = available_backends()
+
+
+def set_backend(name: str) -> None:
+    """Select the backend (json, ujson, orjson or auto) for this process."""
+    global _backends  # pylint: disable=global-statement
+    _backends = available_backends(name)
+
+
+def get_backend(exact_numbers: bool = True) -> JsonBackend:
+    for backend in _backends:
+        if backend.exact_numbers or not exact_numbers:
+            return backend
+    return STDLIB_BACKEND
+
+
+def loads(text: str, exact_numbers: bool = True) -> Any:
+    """Decode JSON text like json.loads.
+
+    With exact_numbers=False, integers beyond 64 bits may be decoded as floats.
+    """
+    backend = get_backend(exact_numbers)
+    if backend is STDLIB_BACKEND:
+        return json.loads(text)
+    try:
+        return backend.loads(text)
+    except (ValueError, OverflowError):
+        return json.loads(text)
+
+
+def dumps_notebook(content_json: Any) -> str:
+    """Encode a notebook the way jupyterblack writes notebooks."""
+    return json.dumps(content_json, indent=1)
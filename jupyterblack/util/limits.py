@@ -0,0 +1,163 @@
+"""Time and memory budgets of formatting (--cell-timeout, --file-timeout and --memory-limit), and size policies.
+
+Black runs of cells are interrupted by a SIGALRM timer when they take longer than the cell timeout, and raise
+MemoryError when a worker process goes over its memory limit, an address space limit above its usage at start. Those
+cells are left unchanged and reported as invalid code. Notebooks over the file timeout, and workers that die, are
+handled by the parent process, which kills and replaces their worker (see supervisor.py).
+
+Size policies are applied from the size of files before they are read: notebooks over --max-file-size are skipped,
+notebooks over --large-file-size are formatted without decoding them in full when they are laid out as jblack writes
+them, as Jupyter does for ASCII notebooks (and decoded otherwise, which --max-file-size bounds), and --max-in-flight
+bounds the total size of the notebooks that workers hold at once. Cells over --max-cell-lines are left unchanged.
+"""
+
+import gc
+import signal
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from attr import attrs
+
+# Interval of the SIGALRM that interrupts a cell over its time budget, until it is interrupted
+ALARM_INTERVAL = 0.05
+# Key of the invalid report of a notebook that was left unchanged as a whole
+NOTEBOOK_KEY = "<notebook>"
+TIMED_OUT = "Formatting took longer than {seconds:g}s ({option}), the {what} was left unchanged"
+OUT_OF_MEMORY = "Formatting ran out of memory (--memory-limit), the {what} was left unchanged"
+WORKER_DIED = "The worker process died (exit code {exitcode}, e.g. when out of memory), the notebook was left unchanged"
+TOO_LARGE = "The notebook is larger than {megabytes:g} MB (--max-file-size), it was left unchanged"
+TOO_LONG = "The cell is longer than {lines} lines (--max-cell-lines), it was left unchanged"
+MEGABYTE = 1024 * 1024
+
+
+@attrs(auto_attribs=True, frozen=True)
+class Limits:
+    """Budgets in seconds and MB and size policies in MB and lines, None for no limit."""
+
+    cell_timeout: Optional[float] = None
+    file_timeout: Optional[float] = None
+    memory_limit: Optional[float] = None
+    max_file_size: Optional[float] = None
+    large_file_size: Optional[float] = None
+    max_in_flight: Optional[float] = None
+    max_cell_lines: Optional[int] = None
+
+    @property
+    def is_supervised(self) -> bool:
+        """Whether files must be formatted in worker processes that the parent process can kill."""
+        return self.file_timeout is not None or self.memory_limit is not None
+
+    def skip_reason(self, size: int) -> Optional[str]:
+        """Why a notebook of size bytes is skipped without reading it, if it is."""
+        if self.max_file_size is not None and size > self.max_file_size * MEGABYTE:
+            return TOO_LARGE.format(megabytes=self.max_file_size)
+        return None
+
+    def is_large(self, size: int) -> bool:
+        """Whether a notebook of size bytes is formatted without decoding it in full."""
+        return self.large_file_size is not None and size > self.large_file_size * MEGABYTE
+
+    def cell_skip_reason(self, code: str) -> Optional[str]:
+        if self.max_cell_lines is not None and code.count("\n") + (not code.endswith("\n")) > self.max_cell_lines:
+            return TOO_LONG.format(lines=self.max_cell_lines)
+        return None
+
+
+class BudgetExceeded(Exception):
+    """A cell went over its time or memory budget."""
+
+
+class _CellTimeout(BaseException):
+    """Raised by the SIGALRM handler, through the broad exception handlers around black calls."""
+
+
+_current = Limits()
+
+
+def current() -> Limits:
+    return _current
+
+
+def configure(limits: Limits, in_worker: bool = False) -> None:
+    """Apply limits to this process: the memory limit only applies to worker processes."""
+    global _current  # pylint: disable=global-statement
+    _current = limits
+    if in_worker and limits.memory_limit is not None:
+        limit_memory(limits.memory_limit)
+
+
+@contextmanager
+def applied(limits: Limits) -> Iterator[None]:
+    """Apply limits to this process for the duration of the block."""
+    previous = _current
+    configure(limits)
+    try:
+        yield
+    finally:
+        configure(previous)
+
+
+def _can_alarm() -> bool:
+    return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+
+@contextmanager
+def cell_budget() -> Iterator[None]:
+    """Raise BudgetExceeded when the block takes longer than the cell timeout or runs out of memory.
+
+    The timeout only applies in the main thread of a process, where signals are handled, e.g. not in the threads of
+    AsyncFormatter(use_threads=True). Garbage is still collected in the block, so that cyclic garbage does not build up
+    towards --memory-limit, but an alarm that comes during a collection waits for the next alarm interval.
+    """
+    timeout = _current.cell_timeout
+    if timeout is None or not _can_alarm():
+        try:
+            yield
+        except MemoryError as exc:
+            raise BudgetExceeded(OUT_OF_MEMORY.format(what="cell")) from exc
+        return
+    is_armed = True
+    is_collecting = False
+
+    # The exception of an alarm that comes while a finalizer runs is lost, and reported as an unraisable exception:
+    # alarms are ignored while garbage is collected, e.g. while the files of safer are finalized, and repeat until one
+    # comes outside a collection.
+    def on_collection(phase: str, _: Dict[str, int]) -> None:
+        nonlocal is_collecting
+        is_collecting = phase == "start"
+
+    def on_alarm(*_: Any) -> None:
+        if is_armed and not is_collecting:  # Not once the block is done, if the alarm comes just as it ends
+            raise _CellTimeout()
+
+    gc.callbacks.append(on_collection)
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout, ALARM_INTERVAL)
+    try:
+        yield
+    except _CellTimeout as exc:
+        raise BudgetExceeded(TIMED_OUT.format(seconds=timeout, option="--cell-timeout", what="cell")) from exc
+    except MemoryError as exc:
+        raise BudgetExceeded(OUT_OF_MEMORY.format(what="cell")) from exc
+    finally:
+        is_armed = False
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+        gc.callbacks.remove(on_collection)
+
+
+def limit_memory(megabytes: float) -> None:
+    """Limit the address space of this process to megabytes above its current size, where /proc is available."""
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+
+        with open("/proc/self/statm", encoding="ascii") as fobj:
+            baseline = int(fobj.read().split()[0]) * resource.getpagesize()
+    except (ImportError, OSError, ValueError, IndexError):
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = baseline + int(megabytes * 1024 * 1024)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
@@ -0,0 +1,73 @@
+"""Mask IPython syntax in code cells, so that a cell can be formatted with a single black call.
+
+Line magics (``%time f()``), shell escapes (``!pip install black``), help lines (``obj?``, ``?obj``) and the
+right-hand side of assignments from magics (``files = !ls``) are replaced with unique names, which are valid
+expression statements, and restored after formatting. Cells starting with a cell magic that runs Python (``%%time``)
+are formatted with their first line masked; other cell magics (``%%bash``) are not Python and are not formatted at all.
+"""
+
+import re
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+MAGICS_MARKS = ("%", "!", "?", "$")
+
+# Cell magics whose body is Python, like black's own list
+PYTHON_CELL_MAGICS = frozenset(("capture", "prun", "pypy", "python", "python3", "time", "timeit"))
+
+_ASSIGNED_MAGIC = re.compile(r"^(\s*[\w.,\[\]()* ]+?\s*=\s*)([%!].*)$")
+# Help lines ending with ? or ??, e.g. "os.path.join?" or "np.*load*?", and not comments or strings ending with ?
+_HELP_LINE = re.compile(r"^[\w.*]+\?{1,2}$")
+_CELL_MAGIC = re.compile(r"%%(\w*)")
+
+
+def is_cell_magic(code: str) -> bool:
+    """Whether the cell starts with a cell magic whose body is not Python (e.g. %%bash), and can't be formatted."""
+    match = _CELL_MAGIC.match(code.lstrip())
+    return match is not None and match.group(1) not in PYTHON_CELL_MAGICS
+
+
+def _is_magic_line(line: str) -> bool:
+    stripped = line.strip()
+    if not stripped or stripped.startswith("#"):
+        return False
+    return stripped.startswith(MAGICS_MARKS) or _HELP_LINE.match(stripped) is not None
+
+
+def mask_magics(code: str) -> Tuple[str, Dict[str, str]]:
+    """Replace IPython syntax with unique names and return the masked code and the names to restore."""
+    replacements: Dict[str, str] = {}
+    if not any(mark in code for mark in MAGICS_MARKS):
+        return code, replacements
+    token = uuid.uuid4().hex
+    lines: List[str] = []
+    for line in code.splitlines(keepends=True):
+        content = line.rstrip("\r\n")
+        newline = line[len(content) :]
+        if _is_magic_line(content):
+            indent = content[: len(content) - len(content.lstrip())]
+            prefix, magic = indent, content[len(indent) :]
+        else:
+            match = _ASSIGNED_MAGIC.match(content)
+            if match is None:
+                lines.append(line)
+                continue
+            prefix, magic = match.groups()
+        # Names as long as the magic (when possible) keep black's line length decisions unchanged
+        name = f"jblack_{len(replacements)}_{token}"[: max(len(magic), 16 + len(str(len(replacements))))]
+        replacements[name] = magic
+        lines.append(f"{prefix}{name}{newline}")
+    return "".join(lines), replacements
+
+
+def restore_magics(text: str, replacements: Dict[str, str]) -> str:
+    for name, magic in replacements.items():
+        text = text.replace(name, magic)
+    return text
+
+
+def unmask_magics(code: str, replacements: Dict[str, str]) -> Optional[str]:
+    """Restore masked IPython syntax, or return None if black did not keep every name exactly once."""
+    if any(code.count(name) != 1 for name in replacements):
+        return None
+    return restore_magics(code, replacements)
@@ -1,5 +1,801 @@
+import heapq
+import http.client
+import json
+import os
 import signal
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from itertools import chain
+from multiprocessing import Pool
+from multiprocessing.pool import AsyncResult
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
 
+from attr import Factory, attrs
+from black import FileMode
 
-def init_worker() -> None:
+from jupyterblack.parser import (
+    BlackFileModeKwargs,
+    BlackFormatter,
+    BlackLintRes,
+    Notebook,
+    NotebookFormatRes,
+    check_jupyter_file,
+    check_notebook,
+    format_jupyter_file,
+    format_notebook,
+    write_jupyter_file,
+)
+from jupyterblack.util import json_backend, limits, stats
+from jupyterblack.util.cache import Cache, CellData, FileData
+from jupyterblack.util.client import DaemonClient, DaemonError
+from jupyterblack.util.error_messages import invalid_content
+from jupyterblack.util.files import STDIN_NAME, read_file
+from jupyterblack.util.limits import Limits
+from jupyterblack.util.sources import find_code_sources
+from jupyterblack.util.stats import Stats
+from jupyterblack.util.supervisor import OUT_OF_MEMORY, TIMEOUT, Failure, SupervisedPool
+from jupyterblack.util.workers import AUTO_WORKERS, cpu_count
+
+# Rough amount of notebook bytes that makes the start-up of one more worker process worth it
+AUTO_BYTES_PER_WORKER = 256 * 1024
+# Files discovered ahead of the files sent to workers, to send the most expensive of them first
+SCHEDULE_WINDOW = 256
+# Upper bound of code cells sent to a worker at once when splitting notebooks in cells
+CELL_BATCH_SIZE = 64
+
+_worker_cache: Optional[Cache] = None
+_worker_mode: Optional[FileMode] = None
+
+
+@attrs(auto_attribs=True)
+class FileReport:
+    """Compact outcome of formatting or checking a file.
+
+    Workers write formatted files themselves, so only this record (and not the formatted notebook) is sent back to
+    the parent process.
+    """
+
+    file: str
+    is_changed: bool
+    invalid_report: Dict[str, str]
+    duration: float = 0.0
+    is_cached: bool = False
+    new_cells: Dict[str, CellData] = Factory(dict)
+    # Checks only: indices of the cells that would be reformatted, and their unified diffs if requested
+    failing_cells: List[int] = Factory(list)
+    diff: str = ""
+    # Stats collected by the worker that processed the file, merged in the parent process (see --stats)
+    stats: Optional[Stats] = None
+    # Data of the file once done with it, recorded in the cache without reading the file again in the parent process
+    file_data: Optional[FileData] = None
+
+    @property
+    def is_okay(self) -> bool:
+        return not self.is_changed
+
+
+def init_worker(
+    cache: Optional[Cache] = None,
+    kwargs: Optional[BlackFileModeKwargs] = None,
+    collect_stats: bool = False,
+    worker_limits: Optional[Limits] = None,
+) -> None:
+    """Set up the state shared by every file a worker processes: the cache, the black mode, stats and budgets."""
+    global _worker_cache, _worker_mode  # pylint: disable=global-statement
     signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_cache = cache
+    _worker_mode = FileMode(**kwargs) if kwargs is not None else None
+    limits.configure(worker_limits or Limits(), in_worker=True)
+    if collect_stats:
+        stats.enable()
+    else:
+        stats.disable()
+
+
+def auto_workers(files: Sequence[str], cache: Optional[Cache] = None, split_cells: bool = False) -> int:
+    """Number of worker processes for the given files, where 1 means a serial run.
+
+    A worker is only added per AUTO_BYTES_PER_WORKER of notebooks that still need work, as starting a process pool
+    costs more than it saves on small runs. Unless cells are split over workers, there are no more workers than files.
+    """
+    pending = [file for file in files if cache is None or cache.is_changed(file)]
+    total_bytes = sum(_file_size(file) for file in pending)
+    return workers_for_bytes(total_bytes, cpu_count() if split_cells else min(cpu_count(), len(pending)))
+
+
+def workers_for_bytes(total_bytes: int, max_workers: int) -> int:
+    """Number of worker processes for an amount of notebook bytes, where 1 means a serial run."""
+    return max(1, min(max_workers, total_bytes // AUTO_BYTES_PER_WORKER))
+
+
+def auto_workers_lazily(
+    files: Iterable[str], cache: Optional[Cache] = None, split_cells: bool = False
+) -> Tuple[Iterable[str], int]:
+    """Files and the number of worker processes for them, without waiting for the end of a lazy discovery.
+
+    Files are only consumed until there is enough work for every CPU; the returned files then chain the files that
+    were consumed with the rest of the discovery. Sequences and split cells (which need every cell up front) are
+    handled like auto_workers.
+    """
+    if isinstance(files, Sequence) or split_cells:
+        files = list(files)
+        return files, auto_workers(files, cache, split_cells)
+    files = iter(files)
+    head: List[str] = []
+    n_pending = total_bytes = 0
+    for file in files:
+        head.append(file)
+        if cache is None or cache.is_changed(file):
+            n_pending += 1
+            total_bytes += _file_size(file)
+            if n_pending >= cpu_count() and total_bytes >= cpu_count() * AUTO_BYTES_PER_WORKER:
+                return chain(head, files), cpu_count()
+    return head, auto_workers(head, cache)
+
+
+def format_cells_in_worker(cells: List[List[str]]) -> List[Tuple[str, Dict[str, str]]]:
+    """Format a batch of code cells, given as lists of source lines."""
+    formatter = BlackFormatter("<cells>", {}, mode=_worker_mode, file_contents="")
+    results = []
+    for cell_lines in cells:
+        format_res = formatter.format_black_cell(cell_lines)
+        results.append((format_res.output, format_res.invalid_report))
+    return results
+
+
+def _uncached_code_cells(files: Sequence[str], cache: Cache) -> List[List[str]]:
+    """Distinct code cells of changed files that are not in the cache yet.
+
+    Size policies apply as when formatting the files: files over the maximum size are not read, and large files are
+    not decoded in full (their cells are left to the formatting of the file when their layout needs decoding).
+    """
+    sources: Dict[str, List[str]] = {}
+    for file in files:
+        if not cache.is_changed(file):
+            continue
+        size = _file_size(file)
+        if limits.current().skip_reason(size) is not None:
+            continue  # Reported when the file itself is formatted
+        try:
+            for source in _code_cell_sources(read_file(file), is_large=limits.current().is_large(size)):
+                code = "".join(source)
+                if code not in sources and code not in cache:
+                    sources[code] = source
+        except (OSError, ValueError):
+            continue  # Reported when the file itself is formatted
+    return list(sources.values())
+
+
+def _code_cell_sources(text: str, is_large: bool) -> List[List[str]]:
+    if is_large:
+        spans = find_code_sources(text, strict=False)
+        return [cast(List[str], span.source) for span in spans] if spans is not None else []
+    content_json = json_backend.loads(text, exact_numbers=False)
+    return [cell["source"] for cell in content_json.get("cells", []) if cell.get("cell_type") == "code"]
+
+
+def prefill_cells(
+    files: Sequence[str], kwargs: BlackFileModeKwargs, n_workers: int, cache: Optional[Cache] = None
+) -> Cache:
+    """Format the distinct code cells of all files in batches over a process pool and store them in the cache.
+
+    Formatting the files afterwards only hits the cell cache, so a single huge notebook is spread over all workers and
+    the output is the same as in a serial run.
+    """
+    if cache is None:
+        cache = Cache.in_memory(kwargs)
+    cells = _uncached_code_cells(files, cache)
+    if not cells:
+        return cache
+
+    batch_size = max(1, min(CELL_BATCH_SIZE, len(cells) // (n_workers * 4)))
+    batches = [cells[i : i + batch_size] for i in range(0, len(cells), batch_size)]
+    initargs = (None, kwargs, False, limits.current())
+    with Pool(processes=n_workers, initializer=init_worker, initargs=initargs) as process_pool:
+        for batch, results in zip(batches, process_pool.imap(format_cells_in_worker, batches)):
+            for cell_lines, (output, invalid_report) in zip(batch, results):
+                cache.set_cell("".join(cell_lines), output, invalid_report)
+    return cache
+
+
+def format_file_report(
+    file: str, kwargs: BlackFileModeKwargs, cache: Optional[Cache] = None, mode: Optional[FileMode] = None
+) -> FileReport:
+    if cache is not None and not cache.is_changed(file):
+        return FileReport(file, is_changed=False, invalid_report={}, is_cached=True)
+    size = _file_size(file)
+    skip_reason = limits.current().skip_reason(size)
+    if skip_reason is not None:
+        stats.count("files_skipped")
+        return _skipped_report(file, skip_reason)
+    start = time.perf_counter()
+    format_res = format_jupyter_file(file, kwargs, cache, mode, low_memory=limits.current().is_large(size))
+    return FileReport(
+        file,
+        is_changed=format_res.is_changed,
+        invalid_report=format_res.invalid_report,
+        duration=time.perf_counter() - start,
+        new_cells=cache.pop_new_cells() if cache is not None else {},
+        file_data=_done_file_data(file, cache, is_done=not format_res.invalid_report),
+    )
+
+
+def check_file_report(
+    file: str,
+    kwargs: BlackFileModeKwargs,
+    cache: Optional[Cache] = None,
+    mode: Optional[FileMode] = None,
+    *,
+    all_cells: bool = False,
+    diff: bool = False,
+) -> FileReport:
+    # pylint: disable=too-many-arguments
+    if cache is not None and not cache.is_changed(file):
+        return FileReport(file, is_changed=False, invalid_report={}, is_cached=True)
+    size = _file_size(file)
+    skip_reason = limits.current().skip_reason(size)
+    if skip_reason is not None:
+        stats.count("files_skipped")
+        return _skipped_report(file, skip_reason)
+    start = time.perf_counter()
+    lint_res = check_jupyter_file(file, kwargs, cache, mode, all_cells=all_cells, diff=diff)
+    return FileReport(
+        file,
+        is_changed=not lint_res.is_okay,
+        invalid_report=lint_res.invalid_report,
+        duration=time.perf_counter() - start,
+        new_cells=cache.pop_new_cells() if cache is not None else {},
+        failing_cells=lint_res.failing_cells,
+        diff=lint_res.output,
+        file_data=_done_file_data(file, cache, is_done=lint_res.is_okay and not lint_res.invalid_report),
+    )
+
+
+def _done_file_data(file: str, cache: Optional[Cache], is_done: bool) -> Optional[FileData]:
+    """Data of a file to record in the cache, read where the file was processed, e.g. in a worker."""
+    if cache is None or not is_done:
+        return None
+    try:
+        return cache.get_file_data(file)
+    except OSError:
+        return None
+
+
+def _skipped_report(file: str, reason: str, duration: float = 0.0) -> FileReport:
+    """Report of a file left unchanged as a whole, e.g. too large to be read."""
+    print(f"Skipped {file}: {reason}")
+    return FileReport(file, is_changed=False, invalid_report={limits.NOTEBOOK_KEY: reason}, duration=duration)
+
+
+def format_file_in_worker(file: str, kwargs: BlackFileModeKwargs) -> FileReport:
+    report = format_file_report(file, kwargs, _worker_cache, _worker_mode)
+    report.stats = stats.pop()
+    return report
+
+
+def check_file_in_worker(
+    file: str, kwargs: BlackFileModeKwargs, all_cells: bool = False, diff: bool = False
+) -> FileReport:
+    report = check_file_report(file, kwargs, _worker_cache, _worker_mode, all_cells=all_cells, diff=diff)
+    report.stats = stats.pop()
+    return report
+
+
+def format_notebook_in_worker(
+    notebook: Notebook, kwargs: BlackFileModeKwargs
+) -> Tuple[NotebookFormatRes, Dict[str, CellData]]:
+    format_res = format_notebook(notebook, kwargs, _worker_cache, _worker_mode)
+    return format_res, _worker_cache.pop_new_cells() if _worker_cache is not None else {}
+
+
+def format_notebook_in_server_worker(
+    notebook: Notebook, kwargs: BlackFileModeKwargs, name: str = "<notebook>"
+) -> NotebookFormatRes:
+    """Format a notebook in a long-lived worker, which keeps the cells it formats in its own bounded cache."""
+    try:
+        return format_notebook(notebook, kwargs, _worker_cache, _worker_mode, name)
+    finally:
+        _trim_worker_cache()
+
+
+def check_notebook_in_server_worker(
+    notebook: Notebook,
+    kwargs: BlackFileModeKwargs,
+    name: str = "<notebook>",
+    all_cells: bool = False,
+    diff: bool = False,
+) -> BlackLintRes:
+    """Check a notebook in a long-lived worker, like format_notebook_in_server_worker."""
+    try:
+        return check_notebook(notebook, kwargs, _worker_cache, _worker_mode, name, all_cells=all_cells, diff=diff)
+    finally:
+        _trim_worker_cache()
+
+
+def _trim_worker_cache() -> None:
+    if _worker_cache is not None:
+        _worker_cache.pop_new_cells()
+        _worker_cache.evict()
+
+
+class StreamResult(NamedTuple):
+    """Outcome of a notebook of a stream (jblack --ndjson -), with its result as a line of JSON."""
+
+    text: str
+    is_changed: bool
+    is_malformed: bool
+
+
+def stream_result(
+    number: int,
+    line: Union[str, bytes],
+    kwargs: BlackFileModeKwargs,
+    cache: Optional[Cache] = None,
+    mode: Optional[FileMode] = None,
+    *,
+    is_check: bool = False,
+    all_cells: bool = False,
+    diff: bool = False,
+) -> StreamResult:
+    """Format or check the notebook given as JSON on line number of a stream.
+
+    The result has the formatted notebook, or the cells that would be reformatted when checking, and an error instead
+    for lines that are not notebooks, so that one bad line does not stop the stream.
+    """
+    # pylint: disable=too-many-arguments
+    name = f"{STDIN_NAME}:{number}"
+    record: Dict[str, Any] = {"line": number}
+    try:
+        notebook = json_backend.loads(line.decode("utf-8") if isinstance(line, bytes) else line)
+    except ValueError as exc:  # Including UnicodeDecodeError
+        return StreamResult(json.dumps({**record, "error": f"Notebook {name} is not valid JSON: {exc}"}), False, True)
+    try:
+        if not isinstance(notebook, dict):
+            raise ValueError(f"Notebook {name} is malformed")
+        if is_check:
+            lint_res = check_notebook(notebook, kwargs, cache, mode, name, all_cells=all_cells, diff=diff)
+            record.update(
+                is_changed=not lint_res.is_okay,
+                invalid_report=lint_res.invalid_report,
+                failing_cells=lint_res.failing_cells,
+            )
+            if diff:
+                record["diff"] = lint_res.output
+        else:
+            format_res = format_notebook(notebook, kwargs, cache, mode, name)
+            record.update(
+                is_changed=format_res.is_changed, invalid_report=format_res.invalid_report, notebook=format_res.notebook
+            )
+    except ValueError as exc:
+        return StreamResult(json.dumps({**record, "error": str(exc)}), False, True)
+    return StreamResult(json.dumps(record), record["is_changed"], False)
+
+
+def stream_result_in_worker(
+    numbered_line: Tuple[int, Union[str, bytes]],
+    kwargs: BlackFileModeKwargs,
+    is_check: bool = False,
+    all_cells: bool = False,
+    diff: bool = False,
+) -> StreamResult:
+    try:
+        return stream_result(
+            *numbered_line, kwargs, _worker_cache, _worker_mode, is_check=is_check, all_cells=all_cells, diff=diff
+        )
+    finally:
+        _trim_worker_cache()
+
+
+def iter_stream_results(
+    lines: Iterable[Union[str, bytes]],
+    kwargs: BlackFileModeKwargs,
+    n_workers: int = 1,
+    cache: Optional[Cache] = None,
+    *,
+    is_check: bool = False,
+    all_cells: bool = False,
+    diff: bool = False,
+) -> Generator[StreamResult, None, None]:
+    """Results of the notebooks of a stream, one per line (blank lines are skipped), in order and as soon as each is
+    done, so that a long stream is formatted by one process without waiting for its end.
+
+    Lines are only read from the stream while at most twice as many as there are workers are in flight, so that a
+    stream faster than its workers is not read in memory. Workers keep the cells they format in their own bounded
+    cache; cells formatted serially are added to the cache.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    numbered_lines = ((number, line) for number, line in enumerate(lines, 1) if line.strip())
+    if n_workers == 1:
+        mode = FileMode(**kwargs)
+        for number, line in numbered_lines:
+            yield stream_result(number, line, kwargs, cache, mode, is_check=is_check, all_cells=all_cells, diff=diff)
+            if cache is not None:
+                cache.pop_new_cells()
+                cache.evict()
+        return
+    func = partial(stream_result_in_worker, kwargs=kwargs, is_check=is_check, all_cells=all_cells, diff=diff)
+    initargs = (cache, kwargs, False, limits.current())
+    in_flight: Deque["AsyncResult[StreamResult]"] = deque()
+    with Pool(processes=n_workers, initializer=init_worker, initargs=initargs) as process_pool:
+        for numbered_line in numbered_lines:
+            in_flight.append(process_pool.apply_async(func, (numbered_line,)))
+            while len(in_flight) > 2 * n_workers or (in_flight and in_flight[0].ready()):
+                yield in_flight.popleft().get()
+        while in_flight:
+            yield in_flight.popleft().get()
+
+
+def _file_size(file: str) -> int:
+    try:
+        return os.path.getsize(file)
+    except OSError:
+        return 0
+
+
+def file_costs(files: Iterable[str], cache: Optional[Cache] = None) -> Dict[str, float]:
+    """Expected cost of formatting each file, in seconds or, when no file is in the cache, in bytes.
+
+    The cost of a file is the time it took in a previous run or, for new files, its size scaled by the throughput of
+    previous runs.
+    """
+    sizes = {file: _file_size(file) for file in files}
+    costs = {file: cache.costs[file] for file in sizes if file in cache.costs} if cache is not None else {}
+    known_size = sum(sizes[file] for file in costs)
+    if not known_size:
+        return {file: float(size) for file, size in sizes.items()}
+    seconds_per_byte = sum(costs.values()) / known_size
+    return {file: costs.get(file, size * seconds_per_byte) for file, size in sizes.items()}
+
+
+def schedule_files(files: Iterable[str], cache: Optional[Cache] = None) -> List[str]:
+    """Order files most expensive first, so that a large file does not end up last in a worker's queue."""
+    costs = file_costs(files, cache)
+    return sorted(costs, key=costs.__getitem__, reverse=True)
+
+
+def schedule_files_lazily(
+    files: Iterable[str], cache: Optional[Cache] = None, window: int = SCHEDULE_WINDOW
+) -> Generator[str, None, None]:
+    """Order files most expensive first among the next window files, so that a lazy discovery keeps streaming.
+
+    Costs are estimated like file_costs, with the throughput of the files of previous runs that are in the cache.
+    """
+    seconds_per_byte = None
+    if cache is not None:
+        known = [file for file in cache.costs if file in cache.files]
+        known_size = sum(cache.files[file].st_size for file in known)
+        if known_size:
+            seconds_per_byte = sum(cache.costs[file] for file in known) / known_size
+    # Most expensive first, then in the order of discovery
+    heap: List[Tuple[float, int, str]] = []
+    for index, file in enumerate(files):
+        size = _file_size(file)
+        if seconds_per_byte is None or cache is None:
+            cost = float(size)
+        else:
+            cost = cache.costs.get(file, size * seconds_per_byte)
+        heapq.heappush(heap, (-cost, index, file))
+        if len(heap) >= window:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+def iter_format_files(
+    files: Iterable[str],
+    kwargs: BlackFileModeKwargs,
+    n_workers: Union[int, str] = 1,
+    cache: Optional[Cache] = None,
+    split_cells: bool = False,
+) -> Generator[FileReport, None, None]:
+    """Format files and yield their reports as soon as each file is done.
+
+    Files can be a lazy iterable, e.g. from iter_target_files, so that formatting starts during discovery (files are
+    then processed in discovery order instead of most expensive first). With split_cells, the code cells of all files
+    are spread over the worker pool instead of whole files.
+    """
+    return _iter_reports(
+        format_file_report,
+        format_file_in_worker,
+        files,
+        kwargs,
+        n_workers=n_workers,
+        cache=cache,
+        is_written=True,
+        split_cells=split_cells,
+    )
+
+
+def iter_check_files(
+    files: Iterable[str],
+    kwargs: BlackFileModeKwargs,
+    n_workers: Union[int, str] = 1,
+    cache: Optional[Cache] = None,
+    split_cells: bool = False,
+    *,
+    all_cells: bool = False,
+    diff: bool = False,
+) -> Generator[FileReport, None, None]:
+    """Check files and yield their reports as soon as each file is done.
+
+    Files can be a lazy iterable, as for iter_format_files. With split_cells, the code cells of all files are spread
+    over the worker pool instead of whole files. With all_cells or diff, every cell of the files is checked (see
+    BlackFormatter.run_check). Closing the generator early stops the pending work.
+    """
+    # pylint: disable=too-many-arguments
+    return _iter_reports(
+        partial(check_file_report, all_cells=all_cells, diff=diff),
+        partial(check_file_in_worker, all_cells=all_cells, diff=diff),
+        files,
+        kwargs,
+        n_workers=n_workers,
+        cache=cache,
+        is_written=False,
+        split_cells=split_cells,
+    )
+
+
+def format_files(
+    files: Sequence[str],
+    kwargs: BlackFileModeKwargs,
+    n_workers: Union[int, str] = 1,
+    cache: Optional[Cache] = None,
+) -> List[FileReport]:
+    """Format files, in a process pool if more than one worker is requested, and update the cache."""
+    return _in_order(files, iter_format_files(files, kwargs, n_workers, cache))
+
+
+def check_files(
+    files: Sequence[str],
+    kwargs: BlackFileModeKwargs,
+    n_workers: Union[int, str] = 1,
+    cache: Optional[Cache] = None,
+) -> List[FileReport]:
+    """Check files, in a process pool if more than one worker is requested, and update the cache."""
+    return _in_order(files, iter_check_files(files, kwargs, n_workers, cache))
+
+
+def format_notebooks(
+    notebooks: Iterable[Notebook],
+    kwargs: Optional[BlackFileModeKwargs] = None,
+    n_workers: Union[int, str] = 1,
+    cache: Optional[Cache] = None,
+) -> List[NotebookFormatRes]:
+    """Format notebooks held in memory (see parser.format_notebook), in a process pool if more than one worker is
+    requested, and return their results in order.
+
+    Cells formatted by the workers are added to the cache, which is not written: call cache.write() to keep them.
+    """
+    notebooks = list(notebooks)
+    kwargs = kwargs or {}
+    if n_workers == AUTO_WORKERS:
+        total_bytes = sum(len(notebook) if isinstance(notebook, (str, bytes)) else 0 for notebook in notebooks)
+        n_workers = workers_for_bytes(total_bytes, min(cpu_count(), len(notebooks)))
+    if n_workers == 1 or len(notebooks) <= 1:
+        mode = FileMode(**kwargs)
+        results = [format_notebook(notebook, kwargs, cache, mode) for notebook in notebooks]
+        if cache is not None:
+            cache.pop_new_cells()
+    else:
+        results = []
+        with Pool(processes=int(n_workers), initializer=init_worker, initargs=(cache, kwargs)) as process_pool:
+            for format_res, new_cells in process_pool.imap(
+                partial(format_notebook_in_worker, kwargs=kwargs), notebooks, chunksize=1
+            ):
+                results.append(format_res)
+                if cache is not None:
+                    cache.update_cells(new_cells)
+    if cache is not None:
+        cache.evict()
+    return results
+
+
+def _imap_files(
+    func: Callable[[str], FileReport],
+    files: Iterable[str],
+    n_workers: int,
+    cache: Optional[Cache],
+    kwargs: BlackFileModeKwargs,
+) -> Generator[FileReport, None, None]:
+    """Reports of files as workers are done with them.
+
+    With budgets or a bound on the size of the files in flight, the pool is one that kills workers over budget and
+    only sends files to workers while the total size of the files they hold stays within the bound.
+    """
+    run_limits = limits.current()
+    initargs = (cache, kwargs, stats.current() is not None, run_limits)
+    if run_limits.is_supervised or run_limits.max_in_flight is not None:
+        max_weight = run_limits.max_in_flight * limits.MEGABYTE if run_limits.max_in_flight is not None else None
+        with SupervisedPool(n_workers, _failure_report, initializer=init_worker, initargs=initargs) as supervised_pool:
+            yield from supervised_pool.imap_unordered(
+                func, files, run_limits.file_timeout, weigh=_file_size, max_weight=max_weight
+            )
+    else:
+        with Pool(processes=n_workers, initializer=init_worker, initargs=initargs) as process_pool:
+            yield from process_pool.imap_unordered(func, files, chunksize=1)
+
+
+def _failure_report(file: str, failure: Failure) -> FileReport:
+    """Report of a file left unchanged because its worker went over budget or died."""
+    if failure.kind == TIMEOUT:
+        reason = limits.TIMED_OUT.format(
+            seconds=limits.current().file_timeout, option="--file-timeout", what="notebook"
+        )
+    elif failure.kind == OUT_OF_MEMORY:
+        reason = limits.OUT_OF_MEMORY.format(what="notebook")
+    else:
+        reason = limits.WORKER_DIED.format(exitcode=failure.exitcode)
+    stats.count("files_over_budget")
+    return _skipped_report(file, reason, failure.seconds)
+
+
+def _in_order(files: Sequence[str], reports: Iterable[FileReport]) -> List[FileReport]:
+    order = {file: i for i, file in enumerate(files)}
+    return sorted(reports, key=lambda report: order[report.file])
+
+
+def _iter_reports(
+    serial_func: Callable[..., FileReport],
+    worker_func: Callable[..., FileReport],
+    files: Iterable[str],
+    kwargs: BlackFileModeKwargs,
+    *,
+    n_workers: Union[int, str],
+    cache: Optional[Cache],
+    is_written: bool,
+    split_cells: bool,
+) -> Generator[FileReport, None, None]:
+    # pylint: disable=too-many-arguments
+    if n_workers == AUTO_WORKERS:
+        files, n_workers = auto_workers_lazily(files, cache, split_cells)
+    if split_cells and n_workers != 1:
+        files = list(files)
+        with stats.timer("prefill cells"):
+            cache = prefill_cells(files, kwargs, int(n_workers), cache)
+        n_workers = 1
+    reports: List[FileReport] = []
+    try:
+        # No need to set up a process Pool for a single worker (slow when run on a single file), unless the files need
+        # a worker that can be killed when over budget
+        if n_workers == 1 and not limits.current().is_supervised:
+            mode = FileMode(**kwargs)
+            for file in files:
+                reports.append(_collect_stats(serial_func(file, kwargs, cache, mode)))
+                yield reports[-1]
+        else:
+            if isinstance(files, Sequence):
+                scheduled_files: Iterable[str] = schedule_files(files, cache)
+            else:
+                scheduled_files = schedule_files_lazily(files, cache)
+            for report in _imap_files(
+                partial(worker_func, kwargs=kwargs), scheduled_files, int(n_workers), cache, kwargs
+            ):
+                reports.append(_collect_stats(report))
+                yield report
+    finally:  # Also keep the work that was done when the run is interrupted
+        _update_cache(cache, reports, is_written)
+
+
+def daemon_file_report(
+    client: DaemonClient,
+    file: str,
+    kwargs: BlackFileModeKwargs,
+    is_check: bool,
+    cache: Optional[Cache] = None,
+    *,
+    all_cells: bool = False,
+    diff: bool = False,
+) -> FileReport:
+    """Format or check a file through jblackd; the file is read and written locally."""
+    # pylint: disable=too-many-arguments
+    if cache is not None and not cache.is_changed(file):
+        return FileReport(file, is_changed=False, invalid_report={}, is_cached=True)
+    start = time.perf_counter()
+    contents = read_file(file)
+    try:
+        response = client.format_notebook(contents, kwargs, check=is_check, all_cells=all_cells, diff=diff)
+    except DaemonError as exc:
+        if exc.status == 400:  # Invalid request: the notebook is not one
+            invalid_content(file)
+        raise SystemExit(f"Error: jblackd failed on {file}: {exc}") from exc
+    except (OSError, http.client.HTTPException, ValueError) as exc:  # E.g. the daemon stopped during the run
+        raise SystemExit(f"Error: jblackd failed on {file}: {exc}") from exc
+    if response["is_changed"] and not is_check:
+        print(f"Reformatting {file}")
+        write_jupyter_file(response["notebook"], file)
+    return FileReport(
+        file,
+        is_changed=response["is_changed"],
+        invalid_report=response["invalid_report"],
+        duration=time.perf_counter() - start,
+        failing_cells=response.get("failing_cells", []),
+        diff=response.get("diff", ""),
+        file_data=_done_file_data(
+            file, cache, is_done=not response["invalid_report"] and not (is_check and response["is_changed"])
+        ),
+    )
+
+
+def iter_daemon_files(
+    client: DaemonClient,
+    files: Iterable[str],
+    kwargs: BlackFileModeKwargs,
+    is_check: bool = False,
+    cache: Optional[Cache] = None,
+    *,
+    all_cells: bool = False,
+    diff: bool = False,
+) -> Generator[FileReport, None, None]:
+    """Format or check files through jblackd, with as many requests in flight as the daemon has workers.
+
+    Reports are yielded in the order of the files. Closing the generator early cancels the requests not sent yet.
+    """
+    # pylint: disable=too-many-arguments
+    reports: List[FileReport] = []
+    n_threads = max(1, int(client.ping().get("workers", 1)))
+    in_flight: Deque["Future[FileReport]"] = deque()
+    file_report = partial(
+        daemon_file_report, client, kwargs=kwargs, is_check=is_check, cache=cache, all_cells=all_cells, diff=diff
+    )
+    try:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            try:
+                for file in files:
+                    in_flight.append(executor.submit(file_report, file))
+                    while len(in_flight) > 2 * n_threads or (in_flight and in_flight[0].done()):
+                        reports.append(_collect_stats(in_flight.popleft().result()))
+                        yield reports[-1]
+                while in_flight:
+                    reports.append(_collect_stats(in_flight.popleft().result()))
+                    yield reports[-1]
+            finally:
+                for future in in_flight:
+                    future.cancel()
+    finally:
+        _update_cache(cache, reports, is_written=not is_check)
+
+
+def _collect_stats(report: FileReport) -> FileReport:
+    """Merge the stats of a worker into the stats of this process, and record the file."""
+    collector = stats.current()
+    if collector is not None:
+        if report.stats is not None:
+            collector.merge(report.stats)
+        collector.record_file(report.file, report.duration, report.is_cached)
+    report.stats = None
+    return report
+
+
+def _update_cache(cache: Optional[Cache], reports: Sequence[FileReport], is_written: bool) -> None:
+    """Merge cells formatted by workers into the cache and record files that are now formatted.
+
+    Files with invalid code are never recorded, so that their invalid report is shown on every run.
+    """
+    if cache is None:
+        return
+    for report in reports:
+        cache.update_cells(report.new_cells)
+        report.new_cells = {}
+        if not report.is_cached:
+            cache.set_cost(report.file, report.duration)
+    cache.mark_done(
+        (report.file for report in reports if (is_written or report.is_okay) and not report.invalid_report),
+        {report.file: report.file_data for report in reports if report.file_data is not None},
+    )
+    cache.write()
@@ -0,0 +1,113 @@
+"""JSON reports of runs (--report-json), and their merge over the shards of a run (--shard) for jblack-merge.
+
+The merged report passes or fails like a single run over every notebook:
+
+    $ jblack --check --shard 1/2 --report-json shard-1.json notebooks/
+    $ jblack --check --shard 2/2 --report-json shard-2.json notebooks/
+    $ jblack-merge shard-1.json shard-2.json
+"""
+
+import json
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence
+
+from jupyterblack.util.shards import Shard
+
+if TYPE_CHECKING:
+    from jupyterblack.util.processing import FileReport
+
+REPORT_VERSION = 1
+
+
+def make_report(
+    results: Sequence["FileReport"], *, mode: str, shard: Optional[Shard], n_files: int, complete: bool = True
+) -> Dict[str, Any]:
+    """JSON report of the results of a run, of the shard of a run or of all of them.
+
+    n_files is the number of notebooks discovered, in all shards, and complete is false when the run stopped early.
+    """
+    return {
+        "version": REPORT_VERSION,
+        "mode": mode,
+        "shard": list(shard) if shard is not None else None,
+        "n_files": n_files,
+        "complete": complete,
+        "files": [
+            {
+                "file": res.file,
+                "is_changed": res.is_changed,
+                "invalid_report": res.invalid_report,
+                "failing_cells": res.failing_cells,
+                "duration": res.duration,
+            }
+            for res in sorted(results, key=lambda res: res.file)
+        ],
+    }
+
+
+def write_report(path: str, report: Dict[str, Any]) -> None:
+    with open(path, "w", encoding="utf-8") as fobj:
+        json.dump(report, fobj, indent=2)
+        fobj.write("\n")
+
+
+def read_report(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, encoding="utf-8") as fobj:
+            report = json.load(fobj)
+    except (OSError, ValueError) as exc:
+        raise SystemExit(f"Error: cannot read the report {path}: {exc}") from exc
+    if not isinstance(report, dict) or report.get("version") != REPORT_VERSION:
+        raise SystemExit(f"Error: {path} is not a jblack report (version {REPORT_VERSION})")
+    return report
+
+
+def merge_reports(reports: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Report of a run from the reports of all its shards, exiting if shards are missing or were split differently."""
+    if not reports:
+        raise SystemExit("Error: no reports to merge")
+    first = reports[0]
+    for report in reports:
+        if report["shard"] is None:
+            raise SystemExit("Error: only reports of shards (--shard) can be merged")
+        if (report["mode"], report["shard"][1], report["n_files"]) != (
+            first["mode"],
+            first["shard"][1],
+            first["n_files"],
+        ):
+            raise SystemExit(
+                "Error: the reports are not shards of the same run (mode, shard count or notebooks differ)"
+            )
+    count = first["shard"][1]
+    indices = sorted(report["shard"][0] for report in reports)
+    if indices != list(range(1, count + 1)):
+        missing = sorted(set(range(1, count + 1)) - set(indices))
+        duplicated = sorted({index for index in indices if indices.count(index) > 1})
+        raise SystemExit(
+            f"Error: expected a report of each of the {count} shards, missing: {missing or 'none'}, "
+            f"duplicated: {duplicated or 'none'}"
+        )
+    files = sorted((entry for report in reports for entry in report["files"]), key=lambda entry: entry["file"])
+    if len({entry["file"] for entry in files}) != len(files):
+        raise SystemExit(
+            "Error: notebooks are in several shards, the shards were split differently "
+            "(e.g. --shard-by cost with different caches)"
+        )
+    complete = all(report["complete"] for report in reports)
+    if complete and len(files) != first["n_files"]:
+        raise SystemExit(f"Error: the shards have {len(files)} notebooks out of {first['n_files']}")
+    return {**first, "shard": None, "complete": complete, "files": files}
+
+
+def report_file_reports(report: Dict[str, Any]) -> List["FileReport"]:
+    from jupyterblack.util.processing import FileReport  # pylint: disable=import-outside-toplevel
+
+    return [
+        FileReport(
+            entry["file"],
+            entry["is_changed"],
+            entry["invalid_report"],
+            duration=entry["duration"],
+            failing_cells=entry["failing_cells"],
+        )
+        for entry in report["files"]
+    ]
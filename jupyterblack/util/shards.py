@@ -0,0 +1,45 @@
+"""Split the notebooks of a run across machines (--shard INDEX/COUNT), balanced by size or by cost.
+
+Every machine discovers the same notebooks and keeps its own shard, so no coordination is needed: the split only
+depends on the paths of the notebooks and their weights. Weights are file sizes by default, the same on every machine
+with the same checkout; the costs of previous runs are only stable across machines that share the same cache.
+"""
+
+import heapq
+from typing import List, Mapping, Tuple
+
+SHARD_WEIGHTS = ("size", "cost")
+
+Shard = Tuple[int, int]
+
+
+def parse_shard(value: str) -> Shard:
+    """(INDEX, COUNT) from INDEX/COUNT, where INDEX is 1-based, raising ValueError if it is malformed."""
+    index, sep, count = value.partition("/")
+    if not sep or not index.strip().isdigit() or not count.strip().isdigit():
+        raise ValueError(f"invalid shard: {value!r} (expected INDEX/COUNT, e.g. 1/4)")
+    shard = int(index), int(count)
+    if not 1 <= shard[0] <= shard[1]:
+        raise ValueError(f"invalid shard: {value!r} (expected 1 <= INDEX <= COUNT)")
+    return shard
+
+
+def split_files(weights: Mapping[str, float], count: int) -> List[List[str]]:
+    """Sorted files of each of count shards, with balanced total weights.
+
+    Files are assigned heaviest first, ties broken by path, to the lightest shard so far, ties broken by index. The
+    split is the same for the same weights whatever the order of the files.
+    """
+    shards: List[List[str]] = [[] for _ in range(count)]
+    loads = [(0.0, index) for index in range(count)]
+    for file in sorted(weights, key=lambda file: (-weights[file], file)):
+        load, index = heapq.heappop(loads)
+        shards[index].append(file)
+        heapq.heappush(loads, (load + weights[file], index))
+    return [sorted(files) for files in shards]
+
+
+def shard_files(weights: Mapping[str, float], shard: Shard) -> List[str]:
+    """Sorted files of a shard (INDEX, COUNT) of the files of weights."""
+    index, count = shard
+    return split_files(weights, count)[index - 1]
@@ -0,0 +1,245 @@
+"""Locate and replace the sources of code cells in the text of a notebook, without decoding the rest of it.
+
+Outputs, metadata and attachments are by far the largest part of most notebooks and never change when formatting, so
+they are only scanned, not decoded and re-encoded. Splicing is only done on text that is laid out exactly as
+``json.dumps(notebook, indent=1)`` would lay it out, apart from whitespace after the notebook (e.g. the final newline
+Jupyter writes), which is dropped, so that the result is byte-identical to re-serializing the whole notebook.
+"""
+
+import json
+import re
+from typing import Callable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+_NUMBER = re.compile(r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?")
+_LITERALS = ("true", "false", "null", "NaN", "Infinity", "-Infinity")
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_WHITESPACE_CHARACTERS = " \t\n\r"
+# Characters written as is by json.dumps(..., indent=1), which escapes the others (ensure_ascii)
+_CANONICAL_CHARACTERS = bytes(range(0x20, 0x80)) + b"\n"
+# Characters checked at once, so that checking a huge notebook does not copy all of it
+_CHECK_CHUNK_SIZE = 1024 * 1024
+
+
+class SourceSpan(NamedTuple):
+    """Position of the source of a code cell in the notebook text."""
+
+    start: int
+    end: int
+    depth: int
+    source: Union[str, List[str]]
+    # Position of the cell in the cells of the notebook
+    cell_index: int = 0
+
+
+class _NotCanonical(Exception):
+    pass
+
+
+class _Scanner:
+    """Recursive-descent scanner of JSON text that returns the spans of members and items instead of values.
+
+    In strict mode, the text must be exactly as json.dumps(..., indent=1) writes it; otherwise any valid JSON layout
+    is accepted.
+    """
+
+    def __init__(self, text: str, strict: bool):
+        self.text = text
+        self.strict = strict
+
+    def expect(self, pos: int, token: str) -> int:
+        if not self.text.startswith(token, pos):
+            raise _NotCanonical(pos)
+        return pos + len(token)
+
+    def skip_whitespace(self, pos: int, depth: int, closing: bool = False) -> int:
+        if self.strict:
+            return self.expect(pos, "\n" + " " * (depth if closing else depth + 1))
+        return _WHITESPACE.match(self.text, pos).end()  # type: ignore[union-attr]
+
+    def string(self, pos: int) -> int:
+        if not self.text.startswith('"', pos):
+            raise _NotCanonical(pos)
+        # str.find is much faster than a regular expression on the long strings of embedded images
+        end = self.text.find('"', pos + 1)
+        while end != -1:
+            n_backslashes = 0
+            while self.text[end - 1 - n_backslashes] == "\\":
+                n_backslashes += 1
+            if n_backslashes % 2 == 0:
+                break
+            end = self.text.find('"', end + 1)
+        if end == -1:
+            raise _NotCanonical(pos)
+        end += 1
+        # The text is printable ASCII in strict mode, and such strings without escapes are written as is by json.dumps
+        if self.strict and (self.text.find("\\", pos, end) != -1 or self.text.find("\n", pos, end) != -1):
+            token = self.text[pos:end]
+            if json.dumps(json.loads(token)) != token:
+                raise _NotCanonical(pos)
+        return end
+
+    def value(self, pos: int, depth: int) -> int:
+        char = self.text[pos : pos + 1]
+        if char == '"':
+            return self.string(pos)
+        if char == "{":
+            return self.members(pos, depth)[0]
+        if char == "[":
+            return self.items(pos, depth)[0]
+        for literal in _LITERALS:
+            if self.text.startswith(literal, pos):
+                return pos + len(literal)
+        match = _NUMBER.match(self.text, pos)
+        if match is None:
+            raise _NotCanonical(pos)
+        if self.strict and json.dumps(json.loads(match.group())) != match.group():
+            raise _NotCanonical(pos)
+        return match.end()
+
+    def open(self, pos: int, depth: int, bracket: str) -> Tuple[int, bool]:
+        """Position after an opening bracket and whether the container is empty."""
+        pos = self.expect(pos, bracket)
+        empty_end = pos if self.strict else self.skip_whitespace(pos, depth)
+        closing = "}" if bracket == "{" else "]"
+        if self.text.startswith(closing, empty_end):
+            return empty_end + 1, True
+        return pos, False
+
+    def next(self, pos: int, depth: int, bracket: str) -> Tuple[int, bool]:
+        """Position after the separator following an item, and whether that was the last item."""
+        if not self.strict:
+            pos = self.skip_whitespace(pos, depth)
+        if self.text.startswith(",", pos):
+            return pos + 1, False
+        if self.strict:
+            pos = self.skip_whitespace(pos, depth, closing=True)
+        return self.expect(pos, bracket), True
+
+    def members(
+        self, pos: int, depth: int, member_value: Optional[Callable[[str, int, int], int]] = None
+    ) -> Tuple[int, List[Tuple[str, int, int]]]:
+        """Scan the object at pos and return its end and the (key, value start, value end) of its members.
+
+        member_value(key, pos, depth) can replace the scanning of member values.
+        """
+        pos, is_empty = self.open(pos, depth, "{")
+        members: List[Tuple[str, int, int]] = []
+        keys = set()
+        while not is_empty:
+            key_start = self.skip_whitespace(pos, depth)
+            key_end = self.string(key_start)
+            key = json.loads(self.text[key_start:key_end])
+            if key in keys:  # json.loads keeps the last duplicate only
+                raise _NotCanonical(key_start)
+            keys.add(key)
+            if self.strict:
+                value_start = self.expect(key_end, ": ")
+            else:
+                value_start = self.skip_whitespace(self.expect(self.skip_whitespace(key_end, depth), ":"), depth)
+            if member_value is not None:
+                value_end = member_value(key, value_start, depth + 1)
+            else:
+                value_end = self.value(value_start, depth + 1)
+            members.append((key, value_start, value_end))
+            pos, is_empty = self.next(value_end, depth, "}")
+        return pos, members
+
+    def items(
+        self, pos: int, depth: int, item_value: Optional[Callable[[int, int], int]] = None
+    ) -> Tuple[int, List[Tuple[int, int]]]:
+        """Scan the array at pos and return its end and the (start, end) of its items.
+
+        item_value(pos, depth) can replace the scanning of items.
+        """
+        pos, is_empty = self.open(pos, depth, "[")
+        items: List[Tuple[int, int]] = []
+        while not is_empty:
+            item_start = self.skip_whitespace(pos, depth)
+            item_end = (item_value or self.value)(item_start, depth + 1)
+            items.append((item_start, item_end))
+            pos, is_empty = self.next(item_end, depth, "]")
+        return pos, items
+
+
+def find_code_sources(text: str, strict: bool = True) -> Optional[List[SourceSpan]]:
+    """Spans of the sources of all code cells, in order, or None if the text can't be handled without decoding it.
+
+    With strict, None is also returned when the notebook is not laid out as ``json.dumps(notebook, indent=1)``.
+    """
+    scanner = _Scanner(text, strict)
+    spans: List[SourceSpan] = []
+    cell_ends: List[int] = []
+
+    def cell_value(pos: int, depth: int) -> int:
+        end, members = scanner.members(pos, depth)
+        cell_ends.append(end)
+        cell = {key: (value_start, value_end) for key, value_start, value_end in members}
+        if "cell_type" not in cell or "source" not in cell:
+            raise _NotCanonical(pos)
+        if json.loads(text[slice(*cell["cell_type"])]) == "code":
+            source_start, source_end = cell["source"]
+            source = json.loads(text[source_start:source_end])
+            spans.append(SourceSpan(source_start, source_end, depth + 1, source, cell_index=len(cell_ends) - 1))
+        return end
+
+    def root_value(key: str, pos: int, depth: int) -> int:
+        if key != "cells":
+            return scanner.value(pos, depth)
+        return scanner.items(pos, depth, item_value=cell_value)[0]
+
+    if strict and not _has_canonical_characters(text):
+        return None
+    try:
+        start = 0 if strict else scanner.skip_whitespace(0, 0)
+        end, members = scanner.members(start, 0, member_value=root_value)
+        # Only whitespace may follow the notebook, which splicing drops in strict mode
+        if (content_end(text) != end) if strict else (scanner.skip_whitespace(end, 0) != len(text)):
+            return None
+    except (_NotCanonical, ValueError, IndexError, RecursionError):
+        return None
+    if not any(key == "cells" for key, _, _ in members):
+        return None
+    return spans
+
+
+def _has_canonical_characters(text: str) -> bool:
+    if not text.isascii():
+        return False
+    for start in range(0, len(text), _CHECK_CHUNK_SIZE):
+        if text[start : start + _CHECK_CHUNK_SIZE].encode("ascii").translate(None, _CANONICAL_CHARACTERS):
+            return False
+    return True
+
+
+def content_end(text: str) -> int:
+    """Position of the whitespace at the end of the text, without copying it."""
+    end = len(text)
+    while end and text[end - 1] in _WHITESPACE_CHARACTERS:
+        end -= 1
+    return end
+
+
+def serialize_source(source: Union[str, List[str]], depth: int) -> str:
+    """Source serialized as json.dumps(..., indent=1) would at depth."""
+    return json.dumps(source, indent=1).replace("\n", "\n" + " " * depth)
+
+
+def iter_spliced(text: str, spans: Sequence[SourceSpan], sources: Sequence[Union[str, List[str]]]) -> Iterator[str]:
+    """Parts of the text with the given spans replaced by the new sources, to write without joining them.
+
+    Whitespace after the notebook is dropped, like json.dumps(..., indent=1) writes it.
+    """
+    pos = 0
+    for span, source in zip(spans, sources):
+        yield text[pos : span.start]
+        yield serialize_source(source, span.depth)
+        pos = span.end
+    yield text[pos : content_end(text)]
+
+
+def splice_sources(text: str, spans: Sequence[SourceSpan], sources: Sequence[Union[str, List[str]]]) -> str:
+    """Replace the given spans by the new sources, serialized as json.dumps(..., indent=1) would at their depth.
+
+    Whitespace after the notebook is dropped.
+    """
+    return "".join(iter_spliced(text, spans, sources))
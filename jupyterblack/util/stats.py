@@ -0,0 +1,167 @@
+"""Opt-in instrumentation of the stages of a run (--stats), with the slowest notebooks and cells.
+
+Collection is off unless enable() is called, and instrumented code then only pays for a global lookup. Worker
+processes collect their own stats, which are shipped back with every file report and merged in the parent.
+"""
+
+import heapq
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from attr import attrib, attrs
+
+# Stages in the order of a run; the time of the stages is summed over workers, so it can exceed the wall time
+STAGES = ("discover", "read", "parse", "black", "write")
+DEFAULT_TOP_N = 10
+# Characters of the first line of a cell shown in reports
+CELL_LABEL_LENGTH = 60
+
+T = TypeVar("T")
+
+
+@attrs(auto_attribs=True)
+class Stats:
+    """Time per stage, counters and the slowest notebooks and cells, as min-heaps of (seconds, label)."""
+
+    top_n: int = DEFAULT_TOP_N
+    stage_times: Dict[str, float] = attrib(factory=dict)
+    counts: Dict[str, int] = attrib(factory=dict)
+    slowest_files: List[Tuple[float, str]] = attrib(factory=list)
+    slowest_cells: List[Tuple[float, str]] = attrib(factory=list)
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        self.stage_times[stage] = self.stage_times.get(stage, 0.0) + seconds
+
+    def count(self, name: str, number: int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + number
+
+    def _push(self, heap: List[Tuple[float, str]], seconds: float, label: str) -> None:
+        if len(heap) < self.top_n:
+            heapq.heappush(heap, (seconds, label))
+        elif seconds > heap[0][0]:
+            heapq.heapreplace(heap, (seconds, label))
+
+    def record_file(self, file: str, seconds: float, is_cached: bool = False) -> None:
+        self.count("files")
+        if is_cached:
+            self.count("file_cache_hits")
+        else:
+            self._push(self.slowest_files, seconds, file)
+
+    def record_cell(self, file: str, code: str, seconds: float) -> None:
+        """Record the black run of a cell, labelled with its file and first line."""
+        self.add_time("black", seconds)
+        self.count("black_runs")
+        if len(self.slowest_cells) < self.top_n or seconds > self.slowest_cells[0][0]:
+            first_line = code.strip().split("\n", 1)[0][:CELL_LABEL_LENGTH]
+            self._push(self.slowest_cells, seconds, f"{file}: {first_line}")
+
+    def merge(self, other: "Stats") -> None:
+        for stage, seconds in other.stage_times.items():
+            self.add_time(stage, seconds)
+        for name, number in other.counts.items():
+            self.count(name, number)
+        for seconds, file in other.slowest_files:
+            self._push(self.slowest_files, seconds, file)
+        for seconds, label in other.slowest_cells:
+            self._push(self.slowest_cells, seconds, label)
+
+    def to_json(self, wall_time: Optional[float] = None) -> Dict[str, Any]:
+        return {
+            "wall_time": wall_time,
+            "stages": {stage: self.stage_times.get(stage, 0.0) for stage in _ordered(self.stage_times)},
+            "counts": dict(sorted(self.counts.items())),
+            "slowest_files": [{"file": file, "seconds": seconds} for seconds, file in _sorted(self.slowest_files)],
+            "slowest_cells": [{"cell": cell, "seconds": seconds} for seconds, cell in _sorted(self.slowest_cells)],
+        }
+
+    def summary(self, wall_time: Optional[float] = None) -> str:
+        lines = ["Stats" + (f" ({wall_time:.3f}s):" if wall_time is not None else ":")]
+        lines.append("  " + ", ".join(f"{name}: {number}" for name, number in sorted(self.counts.items())))
+        stages = ", ".join(f"{stage} {self.stage_times[stage]:.3f}s" for stage in _ordered(self.stage_times))
+        lines.append(f"  time per stage (summed over workers): {stages or 'none'}")
+        for title, heap in (("notebooks", self.slowest_files), ("cells", self.slowest_cells)):
+            if heap:
+                lines.append(f"  slowest {title}:")
+                lines.extend(f"    {seconds:8.3f}s  {label}" for seconds, label in _sorted(heap))
+        return "\n".join(lines)
+
+
+def _ordered(stage_times: Dict[str, float]) -> List[str]:
+    return [stage for stage in STAGES if stage in stage_times] + sorted(set(stage_times) - set(STAGES))
+
+
+def _sorted(heap: List[Tuple[float, str]]) -> List[Tuple[float, str]]:
+    return sorted(heap, reverse=True)
+
+
+# Stats of this process, None when collection is off
+_current: Optional[Stats] = None
+
+
+def enable(top_n: int = DEFAULT_TOP_N) -> Stats:
+    global _current  # pylint: disable=global-statement
+    _current = Stats(top_n)
+    return _current
+
+
+def disable() -> Optional[Stats]:
+    """Stop collecting and return what was collected."""
+    global _current  # pylint: disable=global-statement
+    stats, _current = _current, None
+    return stats
+
+
+def current() -> Optional[Stats]:
+    return _current
+
+
+def pop() -> Optional[Stats]:
+    """Stats collected since the last call, for workers to ship them back to the parent process."""
+    global _current  # pylint: disable=global-statement
+    if _current is None:
+        return None
+    stats, _current = _current, Stats(_current.top_n)
+    return stats
+
+
+def count(name: str, number: int = 1) -> None:
+    if _current is not None:
+        _current.count(name, number)
+
+
+@contextmanager
+def _timer(stats: Stats, stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_time(stage, time.perf_counter() - start)
+
+
+_NULL_TIMER: ContextManager[None] = nullcontext()
+
+
+def timer(stage: str) -> ContextManager[None]:
+    """Context manager adding the time of its block to a stage, when collecting."""
+    return _NULL_TIMER if _current is None else _timer(_current, stage)
+
+
+def timed_iter(stage: str, items: Iterable[T]) -> Iterator[T]:
+    """Iterate over items, adding the time taken to produce each of them to a stage."""
+    iterator = iter(items)
+    while True:
+        with timer(stage):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def write_json(path: str, stats: Stats, wall_time: Optional[float] = None) -> None:
+    with open(path, "w", encoding="utf-8") as fobj:
+        json.dump(stats.to_json(wall_time), fobj, indent=2)
+        fobj.write("\n")
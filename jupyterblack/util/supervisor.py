@@ -0,0 +1,172 @@
+"""Process pool that kills and replaces workers stuck on a task, so that the time of a run stays bounded.
+
+multiprocessing.Pool cannot stop a single task: a notebook that black takes minutes on, or a worker killed when out
+of memory, stalls the whole run. SupervisedPool sends one task at a time to each worker over its own pipe, kills the
+worker of a task that goes over its deadline and starts a new one in its place. It can also hold tasks back while
+the tasks in flight are too heavy, e.g. large notebooks that would not fit in memory at once.
+"""
+
+import multiprocessing
+import time
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Dict, Generic, Iterable, Iterator, List, NamedTuple, Optional, Tuple, TypeVar, cast
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_DONE, _OUT_OF_MEMORY, _ERROR = range(3)
+# Kinds of failures
+TIMEOUT, OUT_OF_MEMORY, DIED = "timeout", "out of memory", "died"
+
+
+class Failure(NamedTuple):
+    kind: str
+    seconds: float
+    exitcode: Optional[int] = None
+
+
+def _serve(conn: Connection, initializer: Optional[Callable[..., None]], initargs: Tuple[Any, ...]) -> None:
+    """Worker loop: run the tasks received on conn until it is closed."""
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        func, item = task
+        try:
+            reply: Tuple[int, Any] = (_DONE, func(item))
+        except MemoryError:
+            reply = (_OUT_OF_MEMORY, None)
+        except Exception as exc:  # pylint: disable=broad-except
+            reply = (_ERROR, exc)
+        conn.send(reply)
+
+
+class _Worker:
+    def __init__(self, initializer: Optional[Callable[..., None]], initargs: Tuple[Any, ...]):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_serve, args=(child_conn, initializer, initargs), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class SupervisedPool(Generic[T, R]):
+    """Pool of worker processes that run func on items, with a deadline per item.
+
+    Items that go over the deadline, run out of memory or whose worker dies are passed to on_failure, and its result
+    is yielded instead. Other exceptions are raised, like with multiprocessing.Pool.
+    """
+
+    def __init__(
+        self,
+        n_workers: int,
+        on_failure: Callable[[T, Failure], R],
+        initializer: Optional[Callable[..., None]] = None,
+        initargs: Tuple[Any, ...] = (),
+    ):
+        self.n_workers = n_workers
+        self.on_failure = on_failure
+        self.initializer = initializer
+        self.initargs = initargs
+        self._workers: List[_Worker] = []
+
+    def __enter__(self) -> "SupervisedPool[T, R]":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+    def _start_worker(self) -> _Worker:
+        worker = _Worker(self.initializer, self.initargs)
+        self._workers.append(worker)
+        return worker
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        worker.kill()
+        self._workers.remove(worker)
+        return self._start_worker()
+
+    def imap_unordered(
+        self,
+        func: Callable[[T], R],
+        items: Iterable[T],
+        timeout: Optional[float] = None,
+        weigh: Optional[Callable[[T], float]] = None,
+        max_weight: Optional[float] = None,
+    ) -> Iterator[R]:
+        """Results of func on items as they are done, killing workers that take longer than timeout on an item.
+
+        With weigh and max_weight, an item is only sent to a worker while the total weight of the items in flight stays
+        within max_weight, or when no other item is in flight, e.g. to bound the memory that workers need at once.
+        """
+        # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+        pending = iter(items)
+        idle = [self._start_worker() for _ in range(self.n_workers)]
+        # Worker, item, weight and start time of each busy worker, by the connection of the worker
+        busy: Dict[Connection, Tuple[_Worker, T, float, float]] = {}
+        held: List[Tuple[T, float]] = []  # The next item, while it waits for the weight in flight to go down
+        in_flight = 0.0
+        is_exhausted = False
+        while True:
+            while idle and not is_exhausted:
+                if not held:
+                    try:
+                        item = next(pending)
+                    except StopIteration:
+                        is_exhausted = True
+                        break
+                    held.append((item, weigh(item) if weigh is not None else 0.0))
+                item, weight = held[0]
+                if busy and max_weight is not None and in_flight + weight > max_weight:
+                    break
+                held.clear()
+                worker = idle.pop()
+                busy[worker.conn] = (worker, item, weight, time.monotonic())
+                in_flight += weight
+                try:
+                    worker.conn.send((func, item))
+                except OSError:  # The worker died, which wait() reports below
+                    pass
+            if not busy:
+                return
+            wait_time = None
+            if timeout is not None:
+                wait_time = max(0.0, min(start for *_, start in busy.values()) + timeout - time.monotonic())
+            ready = wait(list(busy), timeout=wait_time)
+            for conn in ready:
+                worker, item, weight, start = busy.pop(cast(Connection, conn))
+                in_flight -= weight
+                try:
+                    status, result = worker.conn.recv()
+                except (EOFError, OSError):  # The worker died, e.g. killed by the kernel when out of memory
+                    worker.process.join()
+                    failure = Failure(DIED, time.monotonic() - start, worker.process.exitcode)
+                    idle.append(self._replace(worker))
+                    yield self.on_failure(item, failure)
+                    continue
+                idle.append(worker)
+                if status == _ERROR:
+                    raise result
+                if status == _OUT_OF_MEMORY:
+                    result = self.on_failure(item, Failure(OUT_OF_MEMORY, time.monotonic() - start))
+                yield result
+            now = time.monotonic()
+            for conn, (worker, item, weight, start) in list(busy.items()):
+                if timeout is not None and now - start >= timeout:
+                    del busy[conn]
+                    in_flight -= weight
+                    idle.append(self._replace(worker))
+                    yield self.on_failure(item, Failure(TIMEOUT, now - start))
+
+    def close(self) -> None:
+        """Kill the workers, e.g. busy on the rest of the items when the caller stops early."""
+        for worker in self._workers:
+            worker.kill()
+        self._workers = []
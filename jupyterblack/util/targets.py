@@ -1,11 +1,129 @@
-from typing import List
+import os
+from pathlib import Path
+from typing import AbstractSet, Callable, Iterator, List, Optional, Pattern, Set, Tuple
 
-from jupyterblack.util.files import filter_files, get_files
+from jupyterblack.util.files import (
+    compile_excludes,
+    compile_include,
+    filter_files,
+    is_dir_file,
+    iter_dir_files,
+    resolve,
+)
 
 
-def targets_to_files(targets: List[str]) -> List[str]:
-    files: List[str] = []
+def iter_target_files(
+    targets: List[str],
+    exclude: Optional[str] = None,
+    extend_exclude: Optional[str] = None,
+    include: Optional[str] = None,
+    changed: Optional[AbstractSet[str]] = None,
+) -> Iterator[str]:
+    """Lazy iterator over the notebooks of the targets, each once, in discovery order.
+
+    Files given explicitly are never excluded, only the contents of directories are filtered, during the walk. Invalid
+    regexes are reported right away, not when the discovery starts.
+
+    With changed (resolved paths, e.g. from git.changed_files), only those files are considered and target directories
+    are not walked, so that the discovery scales with the number of changed files.
+    """
+    return _iter_target_files(targets, compile_excludes(exclude, extend_exclude), compile_include(include), changed)
+
+
+def _iter_target_files(
+    targets: List[str],
+    exclude_regex: Pattern[str],
+    include_regex: Optional[Pattern[str]],
+    changed: Optional[AbstractSet[str]],
+) -> Iterator[str]:
+    seen: Set[str] = set()
     for target in targets:
-        files.extend(get_files(target))
+        resolved_target = resolve(target)
+        if resolved_target.is_dir() and changed is not None:
+            files = _iter_changed_dir_files(resolved_target, changed, exclude_regex, include_regex)
+        elif resolved_target.is_dir():
+            files = iter_dir_files(resolved_target, exclude=exclude_regex, include=include_regex)
+        elif changed is not None and str(resolved_target) not in changed:
+            continue
+        else:
+            files = iter(filter_files([str(resolved_target)]))
+        for file in files:
+            if file not in seen:
+                seen.add(file)
+                yield file
+
+
+def _iter_changed_dir_files(
+    directory: Path, changed: AbstractSet[str], exclude_regex: Pattern[str], include_regex: Optional[Pattern[str]]
+) -> Iterator[str]:
+    """Changed files below a directory that a walk of the directory would yield (.gitignore files aside)."""
+    prefix = os.path.join(str(directory), "")
+    for file in sorted(changed):
+        if not file.startswith(prefix):
+            continue
+        parts = file[len(prefix) :].split(os.sep)
+        relative = "/" + "/".join(parts)
+        if any(exclude_regex.search(path) for path in [*_relative_dirs(parts[:-1]), relative]):
+            continue
+        if include_regex is None or include_regex.search(relative):
+            yield file
+
+
+def _relative_dirs(parts: List[str]) -> List[str]:
+    """Relative paths, as iter_dir_files searches them, of the directories leading to a path split in parts."""
+    return ["/" + "/".join(parts[: i + 1]) + "/" for i in range(len(parts))]
+
+
+def watched_directories(
+    targets: List[str], exclude: Optional[str] = None, extend_exclude: Optional[str] = None
+) -> Tuple[List[str], Callable[[str], bool]]:
+    """Directories to watch for changes of the notebooks of the targets, and whether to watch their subdirectories.
+
+    Target directories are watched with the subdirectories the discovery walks into (.gitignore files aside), and
+    target files through their parent directory.
+    """
+    exclude_regex = compile_excludes(exclude, extend_exclude)
+    resolved_targets = [resolve(target) for target in targets]
+    prefixes = [os.path.join(str(target), "") for target in resolved_targets if target.is_dir()]
+    directories = sorted({str(target if target.is_dir() else target.parent) for target in resolved_targets})
+
+    def is_watched_dir(path: str) -> bool:
+        for prefix in prefixes:
+            if path.startswith(prefix):
+                parts = path[len(prefix) :].split(os.sep)
+                return not any(exclude_regex.search(relative) for relative in _relative_dirs(parts))
+        return False
+
+    return directories, is_watched_dir
+
+
+def target_file_matcher(
+    targets: List[str],
+    exclude: Optional[str] = None,
+    extend_exclude: Optional[str] = None,
+    include: Optional[str] = None,
+) -> Callable[[str], bool]:
+    """Whether the discovery of the notebooks of the targets would find a (resolved) path, e.g. a new notebook, without
+    running the discovery again."""
+    exclude_regex = compile_excludes(exclude, extend_exclude)
+    include_regex = compile_include(include)
+    resolved_targets = [resolve(target) for target in targets]
+    directories = [target for target in resolved_targets if target.is_dir()]
+    files = set(filter_files([str(target) for target in resolved_targets if not target.is_dir()]))
+
+    def is_target_file(path: str) -> bool:
+        return path in files or any(
+            is_dir_file(directory, path, exclude=exclude_regex, include=include_regex) for directory in directories
+        )
+
+    return is_target_file
+
 
-    return sorted(filter_files(set(files)))
+def targets_to_files(
+    targets: List[str],
+    exclude: Optional[str] = None,
+    extend_exclude: Optional[str] = None,
+    include: Optional[str] = None,
+    changed: Optional[AbstractSet[str]] = None,
+) -> List[str]:
+    return sorted(iter_target_files(targets, exclude, extend_exclude, include, changed))
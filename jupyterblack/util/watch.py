@@ -0,0 +1,225 @@
+"""Watch target directories and report the notebooks that were saved, for jblack --watch.
+
+Changes are read from inotify on Linux (through libc, without dependencies) and found by polling the modification
+times of the notebooks elsewhere, or when inotify is not available.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+# Quiet time after the last change of a burst of saves, and upper bound of the wait for the burst to end, in seconds
+DEBOUNCE_SECONDS = 0.05
+MAX_DEBOUNCE_SECONDS = 0.5
+POLL_INTERVAL_SECONDS = 0.2
+# Polls between two discoveries of new notebooks when polling
+POLLS_PER_DISCOVERY = 10
+# Minimum time between two writes of the cache while watching, which is also written when the watch stops
+CACHE_WRITE_SECONDS = 30.0
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_IN_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+_EVENT_HEADER = struct.Struct("iIII")
+
+Signature = Tuple[int, int]
+
+
+def signature(path: str) -> Optional[Signature]:
+    """Modification time and size of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class Watcher(ABC):
+    """Source of paths of notebooks that may have changed."""
+
+    name: str
+
+    @abstractmethod
+    def wait(self, timeout: float) -> Set[str]:
+        """Paths changed since the last call, waiting for up to timeout seconds for a first change."""
+
+    def close(self) -> None:
+        pass
+
+
+class PollingWatcher(Watcher):
+    """Compare the modification time and size of the notebooks found by discover, every poll interval."""
+
+    name = "polling"
+
+    def __init__(self, discover: Callable[[], Iterable[str]], interval: float = POLL_INTERVAL_SECONDS):
+        self.discover = discover
+        self.interval = interval
+        self.signatures = {file: signature(file) for file in discover()}
+        self._n_polls = 0
+
+    def _poll(self) -> Set[str]:
+        self._n_polls += 1
+        if self._n_polls % POLLS_PER_DISCOVERY == 0:
+            for file in self.discover():
+                self.signatures.setdefault(file, None)
+        changed = set()
+        for file, old in self.signatures.items():
+            new = signature(file)
+            if new != old:
+                self.signatures[file] = new
+                if new is not None:
+                    changed.add(file)
+        return changed
+
+    def wait(self, timeout: float) -> Set[str]:
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = self._poll()
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return changed
+            time.sleep(min(self.interval, remaining))
+
+
+class InotifyWatcher(Watcher):
+    """Read the files closed after writing or moved into the watched directories from inotify.
+
+    New directories are watched as they are created. When the kernel queue overflows, all known notebooks are reported
+    as changed, so that the caller checks them.
+    """
+
+    name = "inotify"
+
+    def __init__(
+        self,
+        directories: Iterable[str],
+        is_watched_dir: Callable[[str], bool],
+        discover: Callable[[], Iterable[str]],
+        suffix: str = ".ipynb",
+    ):
+        self.is_watched_dir = is_watched_dir
+        self.discover = discover
+        self.suffix = suffix
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._directories: Dict[int, str] = {}
+        try:
+            for directory in directories:
+                self._watch_tree(directory)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, directory: str) -> None:
+        descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _IN_MASK)
+        if descriptor < 0:
+            raise OSError(ctypes.get_errno(), f"Cannot watch {directory} with inotify")
+        self._directories[descriptor] = directory
+
+    def _watch_tree(self, directory: str) -> None:
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            self._watch(current)
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False) and self.is_watched_dir(entry.path):
+                            stack.append(entry.path)
+            except OSError:
+                continue
+
+    def _read_events(self) -> Set[str]:
+        changed: Set[str] = set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        pos = 0
+        while pos < len(data):
+            descriptor, mask, _, length = _EVENT_HEADER.unpack_from(data, pos)
+            name = os.fsdecode(data[pos + _EVENT_HEADER.size : pos + _EVENT_HEADER.size + length].rstrip(b"\0"))
+            pos += _EVENT_HEADER.size + length
+            if mask & _IN_Q_OVERFLOW:
+                changed.update(self.discover())
+                continue
+            path = os.path.join(self._directories.get(descriptor, ""), name)
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO) and self.is_watched_dir(path):
+                    self._watch_tree(path)
+                    changed.update(self.discover())  # Notebooks may have been written before the watch was set
+            elif name.endswith(self.suffix) and mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO):
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout: float) -> Set[str]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        return self._read_events() if readable else set()
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def make_watcher(
+    directories: List[str],
+    is_watched_dir: Callable[[str], bool],
+    discover: Callable[[], Iterable[str]],
+    polling: bool = False,
+) -> Watcher:
+    """Inotify watcher on Linux, unless polling is requested or inotify is not available (e.g. out of watches)."""
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directories, is_watched_dir, discover)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(discover)
+
+
+def wait_for_saves(watcher: Watcher, timeout: float) -> Set[str]:
+    """Paths changed by a burst of saves, once no change came for DEBOUNCE_SECONDS (or after MAX_DEBOUNCE_SECONDS)."""
+    changed = watcher.wait(timeout)
+    if not changed:
+        return changed
+    deadline = time.monotonic() + MAX_DEBOUNCE_SECONDS
+    while time.monotonic() < deadline:
+        more = watcher.wait(DEBOUNCE_SECONDS)
+        if not more:
+            break
+        changed |= more
+    return changed
+
+
+def watch(
+    watcher: Watcher,
+    handle: Callable[[List[str]], Iterable[str]],
+    known: Callable[[str], bool],
+    stop: Optional[Callable[[], bool]] = None,
+) -> None:
+    """Call handle with the known notebooks saved since it was last called, until stop() is true.
+
+    handle returns the files it wrote: those writes are not reported again. Files whose modification time and size are
+    the same as when they were last handled are skipped too.
+    """
+    signatures: Dict[str, Optional[Signature]] = {}
+    while stop is None or not stop():
+        changed = [
+            path
+            for path in sorted(wait_for_saves(watcher, timeout=0.5))
+            if known(path) and (path not in signatures or signature(path) != signatures[path])
+        ]
+        if changed:
+            written = set(handle(changed))
+            for path in {*changed, *written}:
+                signatures[path] = signature(path)
@@ -0,0 +1,12 @@
+"""Number of worker processes, without the imports of processing, so that arguments are parsed quickly."""
+
+import os
+
+AUTO_WORKERS = "auto"
+
+
+def cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))  # type: ignore[attr-defined]
+    except AttributeError:  # Not available on macOS and Windows
+        return os.cpu_count() or 1
@@ -35,9 +35,12 @@ setup(
     packages=["jupyterblack", "jupyterblack/util"],
     include_package_data=True,
     install_requires=["attrs", "black", "safer", "typing_extensions"],
+    extras_require={"fast": ["orjson", "ujson"]},
     entry_points={
         "console_scripts": [
             "jblack=jupyterblack.__main__:main",
+            "jblackd=jupyterblack.daemon:main",
+            "jblack-merge=jupyterblack.__main__:merge_main",
         ]
     },
 )
@@ -0,0 +1,45 @@
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Union
+
+from pytest import MonkeyPatch, fixture
+
+from jupyterblack.util.files import read_file
+
+NOTEBOOKS = Path(__file__).parent / "notebooks"
+
+
+@fixture(autouse=True)
+def cache_dir(tmp_path: Path, monkeypatch: MonkeyPatch) -> Path:
+    """Keep the formatting cache of each test out of the user's cache directory."""
+    directory = tmp_path / "cache"
+    monkeypatch.setenv("JUPYTERBLACK_CACHE_DIR", str(directory))
+    return directory
+
+
+@fixture(scope="session")
+def bad_contents() -> str:
+    """Notebook that needs formatting, laid out as Jupyter saves notebooks."""
+    return read_file(NOTEBOOKS / "no_opts" / "test_bad_format.ipynb")
+
+
+@fixture(scope="session")
+def fixed_contents() -> str:
+    """The notebook of bad_contents once formatted, laid out as jblack writes notebooks."""
+    return read_file(NOTEBOOKS / "no_opts" / "test_fixed_format.ipynb")
+
+
+@fixture
+def write_notebooks(bad_contents: str) -> Callable[..., List[str]]:  # pylint: disable=redefined-outer-name
+    """Write notebooks (bad_contents unless other contents are given) at paths relative to a directory, creating
+    their parent directories, and return their resolved paths."""
+
+    def write(directory: Union[str, Path], relative_paths: Iterable[str], contents: Optional[str] = None) -> List[str]:
+        files = []
+        for relative_path in relative_paths:
+            path = Path(directory) / relative_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(bad_contents if contents is None else contents, encoding="utf-8")
+            files.append(str(path.resolve()))
+        return files
+
+    return write
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Any, List
+
+from pytest import MonkeyPatch, mark, raises
+
+from jupyterblack.api import AsyncFormatter, Cache, NotebookFormatRes, check_notebook, format_notebook, format_notebooks
+from jupyterblack.util import aio
+
+
+def test_format_notebook_keeps_the_given_form(bad_contents: str, fixed_contents: str) -> None:
+    result = format_notebook(bad_contents)
+    assert result.notebook == result.output == fixed_contents
+    assert result.is_changed and not result.invalid_report
+
+    assert format_notebook(bad_contents.encode("utf-8")).notebook == fixed_contents.encode("utf-8")
+    assert format_notebook(json.loads(bad_contents)).notebook == json.loads(fixed_contents)
+
+    fixed = json.loads(fixed_contents)
+    result = format_notebook(fixed)
+    assert result.notebook is fixed and not result.is_changed
+
+
+def test_format_notebook_rejects_malformed_notebooks() -> None:
+    with raises(ValueError):
+        format_notebook("{not json", name="broken.ipynb")
+    with raises(ValueError):
+        format_notebook({"cells": [{"cell_type": "code"}]})
+    with raises(TypeError):
+        format_notebook(42)  # type: ignore[arg-type]
+
+
+@mark.parametrize("n_workers", [1, 2, "auto"])
+def test_format_notebooks_in_order(n_workers: object, bad_contents: str, fixed_contents: str) -> None:
+    notebooks = [bad_contents, json.loads(fixed_contents), bad_contents.encode("utf-8")]
+    cache = Cache.in_memory({"line_length": 70})
+
+    results = format_notebooks(notebooks, {"line_length": 70}, n_workers, cache)  # type: ignore[arg-type]
+
+    assert [result.output for result in results] == [format_notebook(bad_contents, {"line_length": 70}).output] * 3
+    assert [result.is_changed for result in results] == [True, True, True]
+    assert isinstance(results[2].notebook, bytes)
+    assert cache.cells and not cache.new_cells
+
+
+def test_check_notebook(bad_contents: str, fixed_contents: str) -> None:
+    lint_res = check_notebook(bad_contents.encode("utf-8"), all_cells=True)
+    assert not lint_res.is_okay and len(lint_res.failing_cells) > 1
+    assert check_notebook(json.loads(fixed_contents)).is_okay
+
+
+@mark.parametrize("use_threads", [False, True])
+def test_async_formatter(use_threads: bool, bad_contents: str, fixed_contents: str) -> None:
+    async def format_all() -> List[NotebookFormatRes]:
+        async with AsyncFormatter(n_workers=2, max_concurrency=2, use_threads=use_threads) as formatter:
+            lint_res = await formatter.check_notebook(bad_contents, name="bad.ipynb", diff=True)
+            assert lint_res.file == "bad.ipynb" and lint_res.output.startswith("--- bad.ipynb:cell_")
+            return await asyncio.gather(*(formatter.format_notebook(bad_contents, timeout=60) for _ in range(5)))
+
+    results = asyncio.run(format_all())
+    assert [result.notebook for result in results] == [fixed_contents] * 5
+
+
+def test_async_formatter_timeout_and_cancellation(bad_contents: str, fixed_contents: str) -> None:
+    async def run_requests() -> None:
+        async with AsyncFormatter(max_concurrency=1, use_threads=True) as formatter:
+            with raises(asyncio.TimeoutError):
+                await formatter.format_notebook(bad_contents, timeout=0)
+            task = asyncio.ensure_future(formatter.format_notebook(bad_contents))
+            await asyncio.sleep(0)
+            task.cancel()
+            with raises(asyncio.CancelledError):
+                await task
+            # The cancelled requests gave their place back
+            result = await formatter.format_notebook(bad_contents, timeout=60)
+            assert result.notebook == fixed_contents
+
+    asyncio.run(run_requests())
+
+
+def test_async_formatter_keeps_places_until_workers_are_done(
+    monkeypatch: MonkeyPatch, bad_contents: str, fixed_contents: str
+) -> None:
+    lock = threading.Lock()
+    running: List[int] = []
+    max_running: List[int] = []
+    format_notebook_func = aio.format_notebook
+
+    def slow_format_notebook(*args: Any) -> NotebookFormatRes:
+        with lock:
+            running.append(1)
+            max_running.append(len(running))
+        time.sleep(0.2)
+        with lock:
+            running.pop()
+        return format_notebook_func(*args)
+
+    monkeypatch.setattr(aio, "format_notebook", slow_format_notebook)
+
+    async def run_requests() -> None:
+        async with AsyncFormatter(n_workers=4, max_concurrency=1, use_threads=True) as formatter:
+            for _ in range(4):
+                with raises(asyncio.TimeoutError):
+                    await formatter.format_notebook(bad_contents, timeout=0.05)
+            result = await formatter.format_notebook(bad_contents, timeout=60)
+            assert result.notebook == fixed_contents
+
+    asyncio.run(run_requests())
+    assert max(max_running) == 1
+
+
+def test_async_formatter_bounds_cells_in_workers() -> None:
+    huge_cell = "x = {" + ", ".join(f"'k{i}': [{i}, ({i}, {i})]" for i in range(20000)) + "}\n"
+    notebook = {"cells": [{"cell_type": "code", "metadata": {}, "outputs": [], "source": [huge_cell]}], "metadata": {}}
+
+    async def format_huge() -> NotebookFormatRes:
+        async with AsyncFormatter(cell_timeout=0.1) as formatter:
+            return await formatter.format_notebook(notebook, timeout=60)
+
+    start = time.perf_counter()
+    result = asyncio.run(format_huge())
+    assert time.perf_counter() - start < 10
+    assert "(--cell-timeout)" in result.invalid_report[huge_cell]
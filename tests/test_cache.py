@@ -0,0 +1,109 @@
+import hashlib
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, List, Union
+
+from pytest import MonkeyPatch
+
+from jupyterblack.__main__ import run
+from jupyterblack.parser import check_jupyter_file, format_jupyter_file
+from jupyterblack.util import cache as cache_module
+from jupyterblack.util.cache import Cache, hash_digest
+
+
+def test_file_cache_hit_skips_work(cache_dir: Path, bad_contents: str) -> None:
+    with TemporaryDirectory() as temp_dir:
+        file = str(Path(temp_dir) / "notebook.ipynb")
+        Path(file).write_text(bad_contents, encoding="utf-8")
+        run([file])
+
+        cache = Cache.read({}, cache_dir=cache_dir)
+        assert not cache.is_changed(file)
+        assert cache.cells
+        assert format_jupyter_file(file, {}, cache).output == ""
+        assert check_jupyter_file(file, {}, cache).is_okay
+
+        Path(file).write_text(bad_contents, encoding="utf-8")
+        assert cache.is_changed(file)
+        assert not check_jupyter_file(file, {}, cache).is_okay
+
+
+def test_cell_cache_is_keyed_by_mode(cache_dir: Path) -> None:
+    default = Cache.read({}, cache_dir=cache_dir)
+    default.set_cell("a=1\n", "a = 1\n", {})
+    default.write()
+    assert Cache.read({}, cache_dir=cache_dir).get_cell("a=1\n") == ("a = 1\n", {})
+    assert Cache.read({"line_length": 70}, cache_dir=cache_dir).get_cell("a=1\n") is None
+
+
+def test_cell_cache_lru_eviction(cache_dir: Path) -> None:
+    cache = Cache.read({}, cache_dir=cache_dir, max_cells=2)
+    for source in ("a\n", "b\n", "c\n"):
+        cache.set_cell(source, source, {})
+    cache.get_cell("a\n")
+    cache.write()
+
+    cache = Cache.read({}, cache_dir=cache_dir, max_cells=2)
+    assert cache.get_cell("a\n") is not None
+    assert cache.get_cell("b\n") is None
+    assert cache.get_cell("c\n") is not None
+
+
+def test_file_hash_in_chunks(tmp_path: Path, monkeypatch: MonkeyPatch, bad_contents: str) -> None:
+    file = tmp_path / "notebook.ipynb"
+    file.write_text(bad_contents, encoding="utf-8")
+    expected = hashlib.sha256(file.read_bytes()).hexdigest()
+    assert hash_digest(file) == expected
+    monkeypatch.delattr(hashlib, "file_digest", raising=False)
+    monkeypatch.setattr(cache_module, "HASH_CHUNK_SIZE", 7)
+    assert hash_digest(file) == expected
+
+
+def test_workers_hash_the_files_they_are_done_with(
+    tmp_path: Path, cache_dir: Path, monkeypatch: MonkeyPatch, write_notebooks: Callable[..., List[str]]
+) -> None:
+    files = [Path(file) for file in write_notebooks(tmp_path, [f"notebook_{i}.ipynb" for i in range(3)])]
+    hashed: List[str] = []
+
+    def record_hash_digest(path: Union[str, Path]) -> str:
+        hashed.append(str(path))
+        return hash_digest(path)
+
+    # Workers are forked with this hash_digest, but their calls are not recorded in this process
+    monkeypatch.setattr(cache_module, "hash_digest", record_hash_digest)
+    run([str(tmp_path), "-w", "2"])
+    assert not hashed
+    cache = Cache.read({}, cache_dir=cache_dir)
+    assert all(not cache.is_changed(file) for file in files)
+    assert cache.files[str(files[0])].hash == hash_digest(files[0])
+
+
+def test_file_entries_are_capped(tmp_path: Path, cache_dir: Path, write_notebooks: Callable[..., List[str]]) -> None:
+    files = [Path(file) for file in write_notebooks(tmp_path, [f"notebook_{i}.ipynb" for i in range(3)])]
+    cache = Cache.read({}, cache_dir=cache_dir, max_files=2)
+    cache.mark_done(files)
+    for file in files:
+        cache.set_cost(file, 1.0)
+    assert not cache.is_changed(files[0])
+    cache.write()
+
+    cache = Cache.read({}, cache_dir=cache_dir, max_files=2)
+    assert list(cache.files) == [str(files[2]), str(files[0])]
+    assert list(cache.costs) == [str(files[1]), str(files[2])]
+
+    # Entries of files that no longer exist are dropped when they are looked up
+    files[0].unlink()
+    assert cache.is_changed(files[0])
+    assert list(cache.files) == [str(files[2])]
+
+
+def test_no_cache_and_clear_cache(cache_dir: Path, bad_contents: str) -> None:
+    with TemporaryDirectory() as temp_dir:
+        file = str(Path(temp_dir) / "notebook.ipynb")
+        Path(file).write_text(bad_contents, encoding="utf-8")
+        run([file, "--no-cache"])
+        assert not cache_dir.exists()
+        run([file])
+        assert cache_dir.exists()
+        run([file, "--check", "--clear-cache", "--no-cache"])
+        assert not cache_dir.exists()
@@ -0,0 +1,144 @@
+# pylint: disable=redefined-outer-name
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+from black import TargetVersion
+from pytest import FixtureRequest, MonkeyPatch, fixture, raises
+
+from jupyterblack import daemon
+from jupyterblack.__main__ import run
+from jupyterblack.daemon import make_server, server_address
+from jupyterblack.util.client import DaemonClient, DaemonError
+from jupyterblack.util.files import read_file
+
+
+@fixture(params=["unix", "tcp"])
+def address(request: FixtureRequest, cache_dir: Path) -> Iterator[str]:
+    """Address of a jblackd running in a thread of the test process."""
+    server = make_server(f"unix:{cache_dir / 'jblackd.sock'}" if request.param == "unix" else "localhost:0")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server_address(server)
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.daemon.close()
+        thread.join()
+
+
+def test_daemon_formats_notebooks_and_cells(address: str, bad_contents: str, fixed_contents: str) -> None:
+    client = DaemonClient.connect(address)
+    assert client is not None
+    assert client.ping()["workers"] == 1
+
+    response = client.format_notebook(bad_contents, {})
+    assert response["notebook"] == fixed_contents
+    assert response["is_changed"] and not response["invalid_report"]
+    assert client.format_notebook(json.loads(bad_contents), {})["notebook"] == json.loads(fixed_contents)
+    response = client.format_notebook(bad_contents, {}, check=True)
+    assert response == {
+        "is_changed": True,
+        "invalid_report": {},
+        "failing_cells": response["failing_cells"],
+        "diff": "",
+    }
+    assert len(response["failing_cells"]) == 1
+    response = client.format_notebook(bad_contents, {}, check=True, all_cells=True, diff=True)
+    assert len(response["failing_cells"]) > 1 and response["diff"].startswith("--- <notebook>:cell_")
+    response = client.format_notebook(fixed_contents, {}, check=True)
+    assert response == {"is_changed": False, "invalid_report": {}, "failing_cells": [], "diff": ""}
+
+    response = client.format_cells(["x = 'a'", "%time f( )", "def f(:\n"], {"line_length": 70})
+    assert response["cells"] == ['x = "a"\n', "%time f( )\n", "def f(:\n"]
+    assert list(response["invalid_report"]) == ["def f(:\n"]
+    assert client.format_cells(
+        ["x = 'a'\n"], {"string_normalization": False, "target_versions": {TargetVersion.PY38}}
+    ) == {
+        "cells": ["x = 'a'\n"],
+        "is_changed": False,
+        "invalid_report": {},
+    }
+
+
+def test_daemon_rejects_invalid_requests(address: str) -> None:
+    client = DaemonClient(address)
+    with raises(DaemonError, match="malformed"):
+        client.format_notebook("{not json", {})
+    with raises(DaemonError, match="Unknown mode options"):
+        client.format_cells(["x = 1"], {"line_lenght": 70})
+    with raises(DaemonError, match="cells must be"):
+        client.format_cells([1], {})  # type: ignore[list-item]
+    assert client.format_cells([], {})["cells"] == []  # The daemon is still serving
+
+
+def test_jblack_uses_running_daemon(
+    address: str, tmp_path: Path, monkeypatch: MonkeyPatch, bad_contents: str, fixed_contents: str
+) -> None:
+    notebook = tmp_path / "notebook.ipynb"
+    notebook.write_text(bad_contents, encoding="utf-8")
+    monkeypatch.setenv("JBLACKD_ADDRESS", address)
+    with raises(SystemExit):
+        run(["--daemon", "--check", str(notebook)])
+    run(["--daemon", str(notebook)])
+    assert read_file(notebook) == fixed_contents
+    run(["--daemon", "--check", str(notebook)])
+
+
+def test_jblack_falls_back_without_daemon(
+    tmp_path: Path, monkeypatch: MonkeyPatch, bad_contents: str, fixed_contents: str
+) -> None:
+    notebook = tmp_path / "notebook.ipynb"
+    notebook.write_text(bad_contents, encoding="utf-8")
+    monkeypatch.setenv("JBLACKD_ADDRESS", f"unix:{tmp_path / 'missing.sock'}")
+    assert DaemonClient.connect() is None
+    run(["--daemon", str(notebook)])
+    assert read_file(notebook) == fixed_contents
+
+
+def test_jblack_stops_when_the_daemon_fails(
+    address: str, tmp_path: Path, monkeypatch: MonkeyPatch, bad_contents: str
+) -> None:
+    notebook = tmp_path / "notebook.ipynb"
+    notebook.write_text(bad_contents, encoding="utf-8")
+    monkeypatch.setenv("JBLACKD_ADDRESS", address)
+
+    def fail(payload: Any) -> Dict[str, Any]:
+        raise RuntimeError("out of order")
+
+    monkeypatch.setattr(daemon, "handle_request", fail)
+    with raises(SystemExit, match="jblackd failed on .*RuntimeError: out of order"):
+        run(["--daemon", str(notebook)])
+
+    def disconnect(*args: Any, **kwargs: Any) -> Dict[str, Any]:
+        raise ConnectionResetError("Connection reset by peer")
+
+    monkeypatch.setattr(DaemonClient, "format_notebook", disconnect)
+    with raises(SystemExit, match="jblackd failed on .*Connection reset by peer"):
+        run(["--daemon", str(notebook)])
+    assert read_file(notebook) == bad_contents
+
+
+def test_daemon_handles_requests_in_process_one_at_a_time(address: str, monkeypatch: MonkeyPatch) -> None:
+    running: List[int] = []
+    max_running: List[int] = []
+    handle_request = daemon.handle_request
+
+    def slow_handle_request(payload: Any) -> Dict[str, Any]:
+        running.append(1)
+        max_running.append(len(running))
+        time.sleep(0.1)
+        running.pop()
+        return handle_request(payload)
+
+    monkeypatch.setattr(daemon, "handle_request", slow_handle_request)
+    client = DaemonClient(address)
+    threads = [threading.Thread(target=client.format_cells, args=(["x=1"], {})) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(max_running) == 1
@@ -0,0 +1,100 @@
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, List
+
+from pytest import CaptureFixture, raises
+
+from jupyterblack.__main__ import run
+from jupyterblack.util.files import read_file
+from jupyterblack.util.git import changed_files
+from jupyterblack.util.targets import targets_to_files
+
+
+def git(repository: Path, *args: str) -> None:
+    subprocess.run(
+        ["git", "-C", str(repository), "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        check=True,
+        capture_output=True,
+    )
+
+
+def create_repository(root: Path, write_notebooks: Callable[..., List[str]]) -> Path:
+    """Repository with a committed tree of notebooks, where the first commit is tagged base."""
+    git(root, "init", "-q")
+    write_notebooks(root, ["old.ipynb", "sub/old.ipynb", "sub/deleted.ipynb", "node_modules/old.ipynb"])
+    git(root, "add", "-A")
+    git(root, "commit", "-q", "-m", "base")
+    git(root, "tag", "base")
+    return root.resolve()
+
+
+def test_changed_since_and_staged(bad_contents: str, write_notebooks: Callable[..., List[str]]) -> None:
+    with TemporaryDirectory() as temp_dir:
+        root = create_repository(Path(temp_dir), write_notebooks)
+        (root / "committed.ipynb").write_text(bad_contents, encoding="utf-8")
+        git(root, "add", "committed.ipynb")
+        git(root, "commit", "-q", "-m", "add")
+        (root / "sub" / "staged.ipynb").write_text(bad_contents, encoding="utf-8")
+        git(root, "add", "sub/staged.ipynb")
+        (root / "sub" / "old.ipynb").write_text(bad_contents + "\n", encoding="utf-8")
+        (root / "node_modules" / "old.ipynb").write_text(bad_contents + "\n", encoding="utf-8")
+        (root / "untracked.ipynb").write_text(bad_contents, encoding="utf-8")
+        (root / "untracked.py").write_text("", encoding="utf-8")
+        (root / "sub" / "deleted.ipynb").unlink()
+
+        assert changed_files([root], since="base") == {
+            str(root / name)
+            for name in [
+                "committed.ipynb",
+                "sub/staged.ipynb",
+                "sub/old.ipynb",
+                "node_modules/old.ipynb",
+                "untracked.ipynb",
+            ]
+        }
+        assert changed_files([root / "sub"], since="HEAD") == {
+            str(root / name)
+            for name in ["sub/staged.ipynb", "sub/old.ipynb", "node_modules/old.ipynb", "untracked.ipynb"]
+        }
+        assert changed_files([root], staged=True) == {str(root / "sub" / "staged.ipynb")}
+
+        # Changed files are intersected with the targets and filtered like a walk of the target directories would
+        changed = changed_files([root], since="base")
+        assert targets_to_files([str(root / "sub")], changed=changed) == [
+            str(root / "sub" / "old.ipynb"),
+            str(root / "sub" / "staged.ipynb"),
+        ]
+        assert targets_to_files([str(root)], changed=changed, extend_exclude="/sub/") == [
+            str(root / "committed.ipynb"),
+            str(root / "untracked.ipynb"),
+        ]
+        assert targets_to_files([str(root / "old.ipynb"), str(root / "committed.ipynb")], changed=changed) == [
+            str(root / "committed.ipynb")
+        ]
+
+
+def test_run_staged_only_formats_staged_notebooks(
+    capsys: CaptureFixture, bad_contents: str, write_notebooks: Callable[..., List[str]]
+) -> None:
+    with TemporaryDirectory() as temp_dir:
+        root = create_repository(Path(temp_dir), write_notebooks)
+        (root / "staged.ipynb").write_text(bad_contents, encoding="utf-8")
+        git(root, "add", "staged.ipynb")
+
+        with raises(SystemExit):
+            run(["--check", "--staged", str(root)])
+        assert "Would reformat" in capsys.readouterr().out
+        run(["--staged", str(root)])
+        assert read_file(root / "staged.ipynb") != bad_contents
+        assert read_file(root / "old.ipynb") == bad_contents
+        run(["--check", "--changed-since", "HEAD", str(root)])
+
+
+def test_git_errors(write_notebooks: Callable[..., List[str]]) -> None:
+    with TemporaryDirectory() as temp_dir:
+        with raises(SystemExit, match="not a git repository"):
+            changed_files([temp_dir], staged=True)
+        root = create_repository(Path(temp_dir), write_notebooks)
+        with raises(SystemExit, match="Could not list changed files"):
+            changed_files([root], since="no-such-ref")
@@ -0,0 +1,76 @@
+import json
+from pathlib import Path
+from typing import Iterator, List
+
+from pytest import fixture, importorskip, mark, raises
+
+from jupyterblack.util import json_backend
+from jupyterblack.util.files import read_file
+
+NOTEBOOKS = Path(__file__).parent / "notebooks"
+
+# Documents on which JSON libraries are known to disagree
+CORPUS: List[str] = [
+    '{"a": 1, "a": 2}',
+    '"\\ud800"',
+    '"\\ud83d\\ude00 \\u00e9 \\u2028 \\u0000 \\/"',
+    '"é☃"',
+    "[NaN, Infinity, -Infinity, 1E400]",
+    "[-0.0, 0.0, 1.0, 1e-07, 0.1, 0.30000000000000004, 5e-324, 1.7976931348623157e308, 2.2250738585072014e-308]",
+    "[9007199254740993, 9007199254740993.0, 1.23456789012345678901234567890]",
+    "[9223372036854775807, -9223372036854775808, 18446744073709551615]",
+    "[123456789012345678901234567890, -9223372036854775809]",
+    '{"nested": {"list": [[], {}, [{}], true, false, null]}}',
+    *(read_file(path) for path in sorted(NOTEBOOKS.glob("**/*.ipynb"))),
+]
+
+# Backends of the "fast" extra are skipped when they are not installed
+BACKENDS = ["orjson", "ujson", json_backend.STDLIB_BACKEND.name]
+
+
+@fixture(params=BACKENDS)
+def backend(request) -> Iterator[str]:  # type: ignore[no-untyped-def]
+    if request.param != json_backend.STDLIB_BACKEND.name:
+        importorskip(request.param)
+    json_backend.set_backend(request.param)
+    yield request.param
+    json_backend.set_backend(json_backend.AUTO_BACKEND)
+
+
+def _typed(value: object) -> str:
+    """repr that also tells apart 1 and 1.0, and -0.0 and 0.0."""
+    return f"{type(value).__name__}:{value!r}" if not isinstance(value, (list, dict)) else repr(value)
+
+
+@mark.parametrize("document", CORPUS)
+def test_exact_loads_matches_stdlib(backend: str, document: str) -> None:
+    # pylint: disable=redefined-outer-name,unused-argument
+    loaded = json_backend.loads(document)
+    expected = json.loads(document)
+    assert repr(loaded) == repr(expected)
+    assert json_backend.dumps_notebook(loaded) == json.dumps(expected, indent=1)
+    if isinstance(expected, list):
+        assert [_typed(value) for value in loaded] == [_typed(value) for value in expected]
+
+
+@mark.parametrize("document", CORPUS)
+def test_inexact_loads_preserves_strings(backend: str, document: str) -> None:
+    # pylint: disable=redefined-outer-name,unused-argument
+    loaded = json_backend.loads(document, exact_numbers=False)
+    expected = json.loads(document)
+    if isinstance(expected, dict) and "cells" in expected:
+        assert loaded["cells"] == expected["cells"]
+    elif isinstance(expected, str):
+        assert loaded == expected
+
+
+def test_invalid_documents_raise_stdlib_errors(backend: str) -> None:
+    # pylint: disable=redefined-outer-name,unused-argument
+    for document in ("", "{", '{"a": }', "[1,]"):
+        with raises(json.JSONDecodeError):
+            json_backend.loads(document)
+
+
+def test_unknown_backend() -> None:
+    with raises(ValueError):
+        json_backend.available_backends("simplejson")
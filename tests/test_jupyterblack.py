@@ -1,10 +1,11 @@
 # pylint: disable=redefined-outer-name
 import json
+import os
 from pathlib import Path
 from tempfile import NamedTemporaryFile, TemporaryDirectory
 from typing import List, Union
 
-from pytest import mark, raises
+from pytest import CaptureFixture, mark, raises
 
 from jupyterblack.__main__ import run
 from jupyterblack.util.files import read_file
@@ -53,6 +54,12 @@ SKIP_STRING_SPEC_2_MULTI_WORKER = Spec(
     options=["--skip-string-normalization", "--workers", "3"],
 )
 
+SKIP_STRING_SPEC_SPLIT_CELLS = Spec(
+    bad_contents=read_file(NOTEBOOKS / "skip_string" / "test_bad_format.ipynb"),
+    fixed_contents=read_file(NOTEBOOKS / "skip_string" / "test_fixed_format.ipynb"),
+    options=["-s", "-w", "2", "--split-cells"],
+)
+
 SKIP_STRING_SPEC_3 = Spec(
     bad_contents=read_file(NOTEBOOKS / "skip_string" / "test_bad_format.ipynb"),
     fixed_contents=read_file(NOTEBOOKS / "skip_string" / "test_fixed_format.ipynb"),
@@ -66,13 +73,21 @@ MAGIC_SPEC = Spec(
     options=[],
 )
 
+MAGIC_SPEC_SPLIT_CELLS = Spec(
+    bad_contents=read_file(NOTEBOOKS / "magics" / "test_bad_format.ipynb"),
+    fixed_contents=read_file(NOTEBOOKS / "magics" / "test_fixed_format.ipynb"),
+    options=["--workers", "2", "--split-cells", "--no-cache"],
+)
+
 
 SPECS = [
     MAGIC_SPEC,
+    MAGIC_SPEC_SPLIT_CELLS,
     NO_OPTS_SPEC,
     SKIP_STRING_SPEC_1,
     SKIP_STRING_SPEC_2,
     SKIP_STRING_SPEC_3,
+    SKIP_STRING_SPEC_SPLIT_CELLS,
     SKIP_STRING_SPEC_2_MULTI_WORKER,
     SKIP_STRING_SPEC_2_MULTI_WORKER,
 ]
@@ -163,3 +178,60 @@ def test_format_dir_default(spec: Spec) -> None:
         # Do the rest of the files - targets are the files
         check_before_and_after_format(files[:-6], affected_files=files[:-6])
         files = []
+
+
+def test_unchanged_file_is_not_rewritten(capsys: CaptureFixture) -> None:
+    with TemporaryDirectory() as temp_dir:
+        formatted = Path(temp_dir) / "formatted.ipynb"
+        formatted.write_text(json.dumps(json.loads(NO_OPTS_SPEC.fixed), indent=1), encoding="utf-8")
+        bad = Path(temp_dir) / "bad.ipynb"
+        bad.write_text(NO_OPTS_SPEC.bad, encoding="utf-8")
+        os.utime(formatted, ns=(0, 0))
+
+        run([temp_dir, "--no-cache"])
+
+        assert formatted.stat().st_mtime_ns == 0
+        out = capsys.readouterr().out
+        assert f"Reformatting {formatted}" not in out
+        assert f"Reformatting {bad}" in out
+        assert "1 file reformatted, 1 file left unchanged." in out
+
+
+def test_check_all_cells(capsys: CaptureFixture) -> None:
+    with TemporaryDirectory() as temp_dir:
+        bad = Path(temp_dir) / "bad.ipynb"
+        bad.write_text(NO_OPTS_SPEC.bad, encoding="utf-8")
+        with raises(SystemExit):
+            run(["--check", "--all-cells", "--no-cache", temp_dir])
+        cells = json.loads(NO_OPTS_SPEC.bad)["cells"]
+        fixed_cells = json.loads(NO_OPTS_SPEC.fixed)["cells"]
+        failing = [index for index, (cell, fixed) in enumerate(zip(cells, fixed_cells)) if cell != fixed]
+        assert len(failing) > 1
+        cells_list = ", ".join(map(str, failing))
+        assert f"Would reformat {bad} (cells {cells_list})" in capsys.readouterr().out
+
+
+def test_diff_does_not_write(capsys: CaptureFixture) -> None:
+    with TemporaryDirectory() as temp_dir:
+        bad = Path(temp_dir) / "bad.ipynb"
+        bad.write_text(NO_OPTS_SPEC.bad, encoding="utf-8")
+        run(["--diff", "--no-cache", temp_dir])
+        assert bad.read_text(encoding="utf-8") == NO_OPTS_SPEC.bad
+        out = capsys.readouterr().out
+        assert f"--- {bad}:cell_" in out
+        assert "\n+" in out and "\n-" in out
+        assert "1 file would be reformatted." in out
+
+        with raises(SystemExit):
+            run(["--diff", "--check", "--no-cache", temp_dir])
+
+
+@mark.parametrize("workers", ["1", "2"])
+def test_fail_fast(workers: str, capsys: CaptureFixture) -> None:
+    with TemporaryDirectory() as temp_dir:
+        for name in "abcd":
+            (Path(temp_dir) / f"{name}.ipynb").write_text(NO_OPTS_SPEC.bad, encoding="utf-8")
+        with raises(SystemExit) as exc_info:
+            run(["--check", "--fail-fast", "--no-cache", "-w", workers, temp_dir])
+        assert str(exc_info.value).count("  - ") == 1
+        assert "(--fail-fast)" in capsys.readouterr().out
@@ -0,0 +1,226 @@
+import gc
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from pytest import CaptureFixture, MonkeyPatch, mark, raises
+
+from jupyterblack.__main__ import run
+from jupyterblack.parser import BlackFormatRes, BlackFormatter
+from jupyterblack.util import limits, processing
+from jupyterblack.util.cache import Cache
+from jupyterblack.util.limits import Limits
+from jupyterblack.util.processing import format_files
+from jupyterblack.util.supervisor import DIED, OUT_OF_MEMORY, TIMEOUT, Failure, SupervisedPool
+
+# Machine-generated cell that black takes seconds on
+HUGE_CELL = "x = {" + ", ".join(f"'k{i}': [{i}, ({i}, {i})]" for i in range(20000)) + "}\n"
+
+
+def notebook_with_cells(*sources: str) -> str:
+    cells: List[Dict[str, Any]] = [
+        {"cell_type": "code", "execution_count": None, "metadata": {}, "outputs": [], "source": [source]}
+        for source in sources
+    ]
+    return json.dumps({"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 4}, indent=1)
+
+
+def run_task(item: str) -> str:
+    if item == "hang":
+        time.sleep(60)
+    elif item == "die":
+        os._exit(3)  # pylint: disable=protected-access
+    elif item == "allocate":
+        return str(len(bytearray(512 * 1024 * 1024)))
+    return item.upper()
+
+
+def describe_failure(item: str, failure: Failure) -> str:
+    return f"{item}: {failure.kind}" + (f" {failure.exitcode}" if failure.exitcode is not None else "")
+
+
+def test_cells_over_time_budget_are_left_unchanged_and_not_cached(tmp_path: Path, cache_dir: Path) -> None:
+    file = tmp_path / "notebook.ipynb"
+    file.write_text(notebook_with_cells(HUGE_CELL, "y=[1,2 , 3]"), encoding="utf-8")
+    cache = Cache.read({}, cache_dir=cache_dir)
+    with limits.applied(Limits(cell_timeout=0.1)):
+        start = time.perf_counter()
+        (report,) = format_files([str(file)], {}, 1, cache)
+    assert time.perf_counter() - start < 5
+    assert report.is_changed
+    assert list(report.invalid_report) == [HUGE_CELL]
+    assert "(--cell-timeout)" in report.invalid_report[HUGE_CELL]
+    sources = ["".join(cell["source"]) for cell in json.loads(file.read_text(encoding="utf-8"))["cells"]]
+    assert sources == [HUGE_CELL, "y = [1, 2, 3]\n"]
+    assert HUGE_CELL not in cache
+
+
+class SlowFinalizer:
+    """Cyclic garbage with a finalizer that runs for longer than the alarm interval."""
+
+    def __init__(self) -> None:
+        self.cycle = self
+
+    def __del__(self) -> None:
+        time.sleep(0.2)
+
+
+@mark.filterwarnings("error::pytest.PytestUnraisableExceptionWarning")
+def test_cell_timeouts_do_not_come_in_finalizers(tmp_path: Path) -> None:
+    file = tmp_path / "notebook.ipynb"
+    file.write_text(notebook_with_cells(HUGE_CELL), encoding="utf-8")
+    for _ in range(3):
+        SlowFinalizer()
+    with limits.applied(Limits(cell_timeout=0.1)):
+        (report,) = format_files([str(file)], {}, 1)
+    assert "(--cell-timeout)" in report.invalid_report[HUGE_CELL]
+
+
+def test_garbage_is_collected_under_a_cell_timeout() -> None:
+    callbacks = list(gc.callbacks)
+    with limits.applied(Limits(cell_timeout=10)), limits.cell_budget():
+        assert gc.isenabled()
+    assert gc.callbacks == callbacks
+
+
+def test_supervised_pool_replaces_workers_over_budget() -> None:
+    items = ["a", "hang", "b", "die", "c", "d"]
+    with SupervisedPool(2, describe_failure) as pool:
+        start = time.perf_counter()
+        results = sorted(pool.imap_unordered(run_task, items, timeout=1))
+    assert time.perf_counter() - start < 10
+    assert results == ["A", "B", "C", "D", f"die: {DIED} 3", f"hang: {TIMEOUT}"]
+
+
+def test_supervised_pool_raises_errors() -> None:
+    with SupervisedPool(1, describe_failure) as pool, raises(AttributeError):
+        list(pool.imap_unordered(run_task, ["a", None]))  # type: ignore[list-item]
+
+
+@mark.skipif(not sys.platform.startswith("linux"), reason="the memory limit relies on /proc")
+def test_supervised_pool_reports_workers_out_of_memory() -> None:
+    initargs = (Limits(memory_limit=64), True)
+    with SupervisedPool(1, describe_failure, initializer=limits.configure, initargs=initargs) as pool:
+        assert list(pool.imap_unordered(run_task, ["allocate", "a"])) == [f"allocate: {OUT_OF_MEMORY}", "A"]
+
+
+@mark.parametrize("workers", ["1", "2"])
+def test_notebooks_over_time_budget_are_skipped(
+    workers: str, tmp_path: Path, capsys: CaptureFixture, bad_contents: str, fixed_contents: str
+) -> None:
+    huge, bad = tmp_path / "huge.ipynb", tmp_path / "bad.ipynb"
+    huge.write_text(notebook_with_cells(HUGE_CELL * 10), encoding="utf-8")
+    bad.write_text(bad_contents, encoding="utf-8")
+    start = time.perf_counter()
+    run(["--file-timeout", "1", "--show-invalid-code", "-w", workers, str(tmp_path)])
+    assert time.perf_counter() - start < 10
+    assert huge.read_text(encoding="utf-8") == notebook_with_cells(HUGE_CELL * 10)
+    assert bad.read_text(encoding="utf-8") == fixed_contents
+    out = capsys.readouterr().out
+    assert f"Skipped {huge}: Formatting took longer than 1s (--file-timeout)" in out
+    assert limits.current() == Limits()
+
+
+def test_notebooks_over_max_file_size_are_skipped_unread(
+    tmp_path: Path, capsys: CaptureFixture, monkeypatch: MonkeyPatch, bad_contents: str
+) -> None:
+    large, bad = tmp_path / "large.ipynb", tmp_path / "bad.ipynb"
+    large.write_text(notebook_with_cells("x=1\n" * 300000), encoding="utf-8")
+    bad.write_text(bad_contents, encoding="utf-8")
+    read_files = []
+    monkeypatch.setattr(processing, "format_jupyter_file", lambda file, *args, **kwargs: read_files.append(file))
+    with limits.applied(Limits(max_file_size=1)):
+        (large_report,) = format_files([str(large)], {}, 1)
+    assert not read_files
+    assert not large_report.is_changed
+    assert "(--max-file-size)" in large_report.invalid_report[limits.NOTEBOOK_KEY]
+    assert f"Skipped {large}" in capsys.readouterr().out
+
+
+def test_cells_over_max_cell_lines_are_left_unchanged(tmp_path: Path) -> None:
+    file = tmp_path / "notebook.ipynb"
+    long_cell = "x=1\n" * 20
+    file.write_text(notebook_with_cells(long_cell, "y=[1,2 , 3]"), encoding="utf-8")
+    run(["--max-cell-lines", "10", "--no-cache", "-w", "1", str(file)])
+    sources = ["".join(cell["source"]) for cell in json.loads(file.read_text(encoding="utf-8"))["cells"]]
+    assert sources == [long_cell, "y = [1, 2, 3]\n"]
+
+
+def test_large_notebooks_are_formatted_without_decoding_them(
+    tmp_path: Path, monkeypatch: MonkeyPatch, bad_contents: str, fixed_contents: str
+) -> None:
+    jupyter, other = tmp_path / "jupyter.ipynb", tmp_path / "other.ipynb"
+    # Laid out as Jupyter saves notebooks, with sorted keys and a final newline
+    jupyter.write_text(bad_contents, encoding="utf-8")
+    # Laid out differently from how jblack writes notebooks, so it can only be formatted by decoding it
+    other.write_text(json.dumps(json.loads(bad_contents), indent=2), encoding="utf-8")
+    decoded = []
+    apply_format_json = BlackFormatter._apply_format_json  # pylint: disable=protected-access
+
+    def record_decoding(formatter: BlackFormatter) -> BlackFormatRes:
+        decoded.append(formatter.path)
+        return apply_format_json(formatter)
+
+    monkeypatch.setattr(BlackFormatter, "_apply_format_json", record_decoding)
+    options = ["--large-file-size", "0.0001", "--no-cache", "-w", "1", str(tmp_path)]
+    with raises(SystemExit, match="Files that need formatting"):
+        run(["--check", *options])
+    run(options)
+    run(["--check", *options])
+    assert decoded == [str(other)]
+    assert jupyter.read_text(encoding="utf-8") == fixed_contents
+    assert other.read_text(encoding="utf-8") == fixed_contents
+
+
+def test_split_cells_apply_size_policies_before_reading(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    huge, large = tmp_path / "huge.ipynb", tmp_path / "large.ipynb"
+    huge.write_text(notebook_with_cells("x=1\n" * 500), encoding="utf-8")
+    large.write_text(notebook_with_cells("y=[1,2 , 3]"), encoding="utf-8")
+    read_files: List[str] = []
+    decoded: List[str] = []
+    read_file_in_parent, loads = processing.read_file, processing.json_backend.loads
+
+    def record_read(file: str) -> str:
+        read_files.append(file)
+        return read_file_in_parent(file)
+
+    def record_loads(text: str, exact_numbers: bool = True) -> Any:
+        decoded.append(text)
+        return loads(text, exact_numbers)
+
+    monkeypatch.setattr(processing, "read_file", record_read)
+    monkeypatch.setattr(processing.json_backend, "loads", record_loads)
+    options = ["--max-file-size", "0.001", "--large-file-size", "0.0001", "--split-cells", "-w", "2", "--no-cache"]
+    run([*options, str(tmp_path)])
+    assert read_files == [str(large)]
+    assert large.read_text(encoding="utf-8") not in decoded
+    assert "".join(json.loads(large.read_text(encoding="utf-8"))["cells"][0]["source"]) == "y = [1, 2, 3]\n"
+
+
+def weigh_item(item: str) -> float:
+    return float(len(item))
+
+
+def run_timed_task(item: str) -> Tuple[str, float, float]:
+    start = time.monotonic()
+    time.sleep(0.3)
+    return item, start, time.monotonic()
+
+
+def skip_timed_task(item: str, _: Failure) -> Tuple[str, float, float]:
+    return item, 0.0, 0.0
+
+
+def test_supervised_pool_bounds_the_weight_in_flight() -> None:
+    items = ["aaa", "bb", "c", "dddddd", "e"]
+    with SupervisedPool(3, skip_timed_task) as pool:
+        results = list(pool.imap_unordered(run_timed_task, items, weigh=weigh_item, max_weight=4))
+    assert sorted(item for item, *_ in results) == sorted(items)
+    for item, start, _ in results:
+        running = [other for other, other_start, other_end in results if other_start <= start < other_end]
+        # Items heavier than the bound run alone
+        assert sum(len(other) for other in running) <= max(4, len(item))
+        assert len(item) <= 4 or running == [item]
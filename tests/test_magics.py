@@ -0,0 +1,92 @@
+from typing import Any, List
+
+from pytest import MonkeyPatch, mark
+
+from jupyterblack import parser
+from jupyterblack.parser import BlackFormatter
+from jupyterblack.util.magics import mask_magics, unmask_magics
+
+
+def format_cell(code: str) -> parser.BlackFormatRes:
+    formatter = BlackFormatter("<test>", {}, file_contents="")
+    return formatter.format_black_cell(code.splitlines(keepends=True))
+
+
+@mark.parametrize(
+    "code, expected",
+    [
+        ("a=1\n%time f( a )\nb=2", "a = 1\n%time f( a )\nb = 2\n"),
+        ("!pip install black\nimport  os", "!pip install black\nimport os\n"),
+        ("files = !ls -la\nprint( files )", "files = !ls -la\nprint(files)\n"),
+        ("x  =  %timeit -o f()\n", "x = %timeit -o f()\n"),
+        ("os.path.join?\n??os\nx=1", "os.path.join?\n??os\nx = 1\n"),
+        ("for i in range(3):\n    %time f(i)\n", "for i in range(3):\n    %time f(i)\n"),
+        (
+            "import os\n%load_ext autoreload\ndef f():\n  pass",
+            "import os\n\n%load_ext autoreload\n\n\ndef f():\n    pass\n",
+        ),
+        ("x = ('%d'\n     % 1)", 'x = "%d" % 1\n'),
+        ("# What?\nx=1", "# What?\nx = 1\n"),
+        ("x=1  # why?", "x = 1  # why?\n"),
+        ("s='what?'\nt = f( 'how??' )", 's = "what?"\nt = f("how??")\n'),
+        ('s = """\nwhy?\n"""\nx=1', 's = """\nwhy?\n"""\nx = 1\n'),
+        ("np.*load*?\nx=1", "np.*load*?\nx = 1\n"),
+    ],
+)
+def test_format_cells_with_magics(code: str, expected: str) -> None:
+    format_res = format_cell(code)
+    assert not format_res.invalid_report
+    assert format_res.output == expected
+
+
+def test_cell_magics_are_not_formatted(monkeypatch: MonkeyPatch) -> None:
+    calls: List[Any] = []
+    monkeypatch.setattr(parser, "format_str", lambda **kwargs: calls.append(kwargs))
+    code = "%%bash\necho  $PATH\nls   -la"
+    assert format_cell(code).output == code
+    assert not calls
+
+
+@mark.parametrize(
+    "code, expected",
+    [
+        ("%%time\nx=1", "%%time\nx = 1\n"),
+        ("%%timeit -n 3\ny = f( x )\n", "%%timeit -n 3\ny = f(x)\n"),
+        ("%%capture out\n!ls\nprint( 1 )", "%%capture out\n!ls\nprint(1)\n"),
+    ],
+)
+def test_python_cell_magics_are_formatted(code: str, expected: str) -> None:
+    format_res = format_cell(code)
+    assert not format_res.invalid_report
+    assert format_res.output == expected
+
+
+def test_magic_cells_need_a_single_black_call(monkeypatch: MonkeyPatch) -> None:
+    calls: List[str] = []
+    format_str = parser.format_str
+
+    def counting_format_str(src_contents: str, mode: Any) -> str:
+        calls.append(src_contents)
+        return format_str(src_contents=src_contents, mode=mode)
+
+    monkeypatch.setattr(parser, "format_str", counting_format_str)
+    assert (
+        format_cell("%matplotlib inline\n%time x=1\n!ls\ny=2").output == "%matplotlib inline\n%time x=1\n!ls\ny = 2\n"
+    )
+    assert len(calls) == 1
+
+
+def test_invalid_code_is_reported_with_magics() -> None:
+    code = "%time x=1\nx = = 2\n"
+    format_res = format_cell(code)
+    assert format_res.output == code
+    assert "jblack_" not in format_res.invalid_report[code]
+
+
+def test_mask_round_trip() -> None:
+    code = "a=1\n  %time f()\nb = !ls\n"
+    masked, replacements = mask_magics(code)
+    assert "%" not in masked and "!" not in masked
+    assert len(replacements) == 2
+    assert unmask_magics(masked, replacements) == code
+    assert unmask_magics(masked.replace(next(iter(replacements)), ""), replacements) is None
@@ -0,0 +1,127 @@
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Iterable, Iterator, List
+
+from pytest import MonkeyPatch, raises
+
+from jupyterblack.__main__ import run
+from jupyterblack.arguments import parse_args
+from jupyterblack.util import processing
+from jupyterblack.util.cache import Cache
+from jupyterblack.util.files import read_file
+from jupyterblack.util.processing import (
+    AUTO_WORKERS,
+    FileReport,
+    auto_workers,
+    check_files,
+    format_files,
+    iter_check_files,
+    iter_format_files,
+    schedule_files,
+    schedule_files_lazily,
+)
+
+
+def test_workers_return_compact_reports(tmp_path: Path, write_notebooks: Callable[..., List[str]]) -> None:
+    files = write_notebooks(tmp_path, [f"{i}.ipynb" for i in range(4)])
+    reports = format_files(files, {}, n_workers=2)
+    assert all(isinstance(report, FileReport) for report in reports)
+    assert not any(hasattr(report, "output") for report in reports)
+    assert [report.file for report in reports] == files
+    assert all(report.is_changed and report.duration > 0 for report in reports)
+
+    assert all(report.is_okay for report in check_files(files, {}, n_workers=2))
+
+
+def test_schedule_files_largest_or_costliest_first(cache_dir: Path) -> None:
+    with TemporaryDirectory() as temp_dir:
+        small, medium, large = (str(Path(temp_dir) / f"{name}.ipynb") for name in ("small", "medium", "large"))
+        for file, size in ((small, 10), (medium, 100), (large, 1000)):
+            Path(file).write_text("x" * size, encoding="utf-8")
+        assert schedule_files([small, medium, large]) == [large, medium, small]
+
+        cache = Cache.read({}, cache_dir=cache_dir)
+        cache.costs = {small: 10.0, large: 2.0}  # The small file was slow in a previous run
+        assert schedule_files([small, medium, large], cache) == [small, large, medium]
+
+
+def test_schedule_files_lazily_within_a_window(tmp_path: Path) -> None:
+    sizes = [10, 1000, 20, 30, 500, 40]
+    files = [str(tmp_path / f"{i}.ipynb") for i in range(len(sizes))]
+    for file, size in zip(files, sizes):
+        Path(file).write_text("x" * size, encoding="utf-8")
+    consumed = []
+
+    def discover() -> Iterator[str]:
+        for file in files:
+            consumed.append(file)
+            yield file
+
+    scheduled = schedule_files_lazily(discover(), window=3)
+    assert next(scheduled) == files[1]
+    assert len(consumed) == 3
+    assert list(scheduled) == [files[3], files[4], files[5], files[2], files[0]]
+
+
+def test_cli_sends_the_largest_files_first(
+    tmp_path: Path, monkeypatch: MonkeyPatch, bad_contents: str, write_notebooks: Callable[..., List[str]]
+) -> None:
+    write_notebooks(tmp_path, [f"{i}.ipynb" for i in range(5)])
+    # Discovered last
+    large = tmp_path / "z.ipynb"
+    large.write_text(json.dumps({**json.loads(bad_contents), "metadata": {"x": "x" * 10000}}), encoding="utf-8")
+    sent: List[str] = []
+
+    def imap_files(_func: Callable[[str], FileReport], files: Iterable[str], *_: Any) -> Iterator[FileReport]:
+        for file in files:
+            sent.append(file)
+            yield processing.format_file_report(file, {})
+
+    monkeypatch.setattr(processing, "_imap_files", imap_files)
+    run(["-w", "2", "--no-cache", str(tmp_path)])
+    assert sent[0] == str(large)
+    assert len(sent) == 6
+
+
+def test_iter_files_streams_reports(tmp_path: Path, write_notebooks: Callable[..., List[str]]) -> None:
+    files = write_notebooks(tmp_path, [f"{i}.ipynb" for i in range(3)])
+    reports = iter_check_files(files, {}, n_workers=2)
+    first = next(reports)
+    assert not first.is_okay
+    assert sorted([first.file, *(report.file for report in reports)]) == files
+
+
+def test_auto_workers(tmp_path: Path, monkeypatch: MonkeyPatch, write_notebooks: Callable[..., List[str]]) -> None:
+    files = write_notebooks(tmp_path, [f"{i}.ipynb" for i in range(8)])
+    assert auto_workers(files) == 1  # Tiny notebooks are formatted serially
+    monkeypatch.setattr(processing, "AUTO_BYTES_PER_WORKER", 1)
+    monkeypatch.setattr(processing, "cpu_count", lambda: 4)
+    assert auto_workers(files) == 4
+    assert auto_workers(files[:2]) == 2
+
+
+def test_workers_argument() -> None:
+    assert parse_args("nb.ipynb").workers == AUTO_WORKERS
+    assert parse_args("-w", "3", "nb.ipynb").workers == 3
+    for value in ("0", "many"):
+        with raises(SystemExit):
+            parse_args("-w", value, "nb.ipynb")
+
+
+def test_split_cells_matches_serial_output(bad_contents: str) -> None:
+    notebook = json.loads(bad_contents)
+    notebook["cells"] = [
+        {**cell, "source": [f"x_{i}= {{ 'a':{i} }}\n", *cell["source"]]}
+        for i in range(50)
+        for cell in notebook["cells"]
+    ]
+    with TemporaryDirectory() as temp_dir:
+        serial, split = str(Path(temp_dir) / "serial.ipynb"), str(Path(temp_dir) / "split.ipynb")
+        for file in (serial, split):
+            Path(file).write_text(json.dumps(notebook), encoding="utf-8")
+
+        format_files([serial], {})
+        [report] = list(iter_format_files([split], {}, n_workers=2, split_cells=True))
+        assert report.is_changed
+        assert read_file(split) == read_file(serial)
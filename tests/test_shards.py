@@ -0,0 +1,90 @@
+import json
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, List
+
+from pytest import MonkeyPatch, mark, raises
+
+from jupyterblack.__main__ import merge_main, run
+from jupyterblack.util import reports
+from jupyterblack.util.shards import parse_shard, shard_files, split_files
+
+
+def test_parse_shard() -> None:
+    assert parse_shard("1/4") == (1, 4)
+    assert parse_shard("4/4") == (4, 4)
+    for value in ("0/4", "5/4", "1", "a/b", "-1/2", "1/0"):
+        with raises(ValueError):
+            parse_shard(value)
+
+
+def test_split_files_is_stable_and_balanced() -> None:
+    weights = {f"{i:03}.ipynb": float(1000 if i < 3 else i) for i in range(100)}
+    shards = split_files(weights, 4)
+    assert sorted(file for files in shards for file in files) == sorted(weights)
+    assert split_files(dict(reversed(list(weights.items()))), 4) == shards
+    assert [shard_files(weights, (index, 4)) for index in range(1, 5)] == shards
+    loads = [sum(weights[file] for file in files) for files in shards]
+    assert max(loads) - min(loads) <= max(weights.values())
+    # Each of the heavy files lands on its own shard, where a split by count would put them together
+    assert sorted(sum(weights[file] == 1000 for file in files) for files in shards) == [0, 1, 1, 1]
+
+
+def run_shards(directory: Path, count: int, *args: str) -> List[str]:
+    paths = []
+    for index in range(1, count + 1):
+        path = str(directory / f"shard-{index}.json")
+        try:
+            run(["--check", "--no-cache", "-w", "1", "--shard", f"{index}/{count}", "--report-json", path, *args])
+        except SystemExit:
+            pass
+        paths.append(path)
+    return paths
+
+
+@mark.parametrize("n_bad", [0, 2])
+def test_merged_shards_match_a_single_run(
+    n_bad: int,
+    tmp_path: Path,
+    monkeypatch: MonkeyPatch,
+    fixed_contents: str,
+    write_notebooks: Callable[..., List[str]],
+) -> None:
+    notebooks = tmp_path / "notebooks"
+    write_notebooks(notebooks, [f"{i}.ipynb" for i in range(n_bad)])
+    write_notebooks(notebooks, [f"{i}.ipynb" for i in range(n_bad, n_bad + 5)], contents=fixed_contents)
+    paths = run_shards(tmp_path, 3, str(notebooks))
+    single_path = str(tmp_path / "single.json")
+    with raises(SystemExit) if n_bad else nullcontext():
+        run(["--check", "--no-cache", "-w", "1", "--report-json", single_path, str(notebooks)])
+
+    shard_reports = [reports.read_report(path) for path in paths]
+    assert all(report["files"] for report in shard_reports)
+    assert sum(len(report["files"]) for report in shard_reports) == n_bad + 5
+    merged = reports.merge_reports(shard_reports)
+    single = reports.read_report(single_path)
+    assert [entry["file"] for entry in merged["files"]] == [entry["file"] for entry in single["files"]]
+    assert [entry["is_changed"] for entry in merged["files"]] == [entry["is_changed"] for entry in single["files"]]
+
+    monkeypatch.setattr("sys.argv", ["jblack-merge", *paths, "-o", str(tmp_path / "merged.json")])
+    with raises(SystemExit) if n_bad else nullcontext():
+        merge_main()
+    assert json.loads((tmp_path / "merged.json").read_text(encoding="utf-8"))["shard"] is None
+
+
+def test_merge_rejects_missing_and_inconsistent_shards(
+    tmp_path: Path, fixed_contents: str, write_notebooks: Callable[..., List[str]]
+) -> None:
+    notebooks = tmp_path / "notebooks"
+    write_notebooks(notebooks, ["0.ipynb"])
+    write_notebooks(notebooks, ["1.ipynb", "2.ipynb", "3.ipynb"], contents=fixed_contents)
+    shard_reports = [reports.read_report(path) for path in run_shards(tmp_path, 2, str(notebooks))]
+
+    with raises(SystemExit, match="missing: \\[2\\]"):
+        reports.merge_reports(shard_reports[:1])
+    with raises(SystemExit, match="duplicated: \\[1\\]"):
+        reports.merge_reports([shard_reports[0], shard_reports[0]])
+    with raises(SystemExit, match="split differently"):
+        reports.merge_reports([shard_reports[0], {**shard_reports[1], "files": shard_reports[0]["files"]}])
+    with raises(SystemExit, match="not shards of the same run"):
+        reports.merge_reports([shard_reports[0], {**shard_reports[1], "n_files": 5}])
@@ -0,0 +1,92 @@
+import base64
+import json
+from pathlib import Path
+from typing import Any, Dict
+
+from pytest import mark
+
+from jupyterblack.parser import BlackFormatter
+from jupyterblack.util.files import read_file
+from jupyterblack.util.sources import find_code_sources, splice_sources
+
+NOTEBOOKS = Path(__file__).parent / "notebooks"
+
+
+def output_heavy_notebook() -> Dict[str, Any]:
+    notebook: Dict[str, Any] = json.loads(read_file(NOTEBOOKS / "skip_string" / "test_bad_format.ipynb"))
+    png = base64.b64encode(bytes(range(256)) * 64).decode("ascii")
+    outputs = [
+        {
+            "data": {"image/png": png, "text/plain": ["<Figure size 640x480>"]},
+            "metadata": {},
+            "output_type": "display_data",
+        },
+        {"data": {"application/json": {"x": [1, 2.5, 1e-07, -0.0, None, True], "é": "ünïcode ☃ \t"}}},
+        {"name": "stdout", "output_type": "stream", "text": ['a "quoted" \\ line\n', "\u0000\u001f\n"]},
+    ]
+    for cell in notebook["cells"]:
+        if cell["cell_type"] == "code":
+            cell["outputs"] = outputs
+    notebook["cells"].append({"cell_type": "markdown", "metadata": {"tags": []}, "source": ["# Title é\n"]})
+    notebook["cells"].append({"cell_type": "code", "metadata": {}, "outputs": [], "source": "x=1"})
+    notebook["cells"].append({"cell_type": "code", "metadata": {}, "outputs": [], "source": []})
+    return notebook
+
+
+@mark.parametrize("options", [{}, {"string_normalization": False}, {"line_length": 20}])
+def test_spliced_output_is_byte_identical(options: Dict[str, Any]) -> None:
+    contents = json.dumps(output_heavy_notebook(), indent=1)
+    assert find_code_sources(contents) is not None
+
+    formatter = BlackFormatter("<test>", options, file_contents=contents)  # type: ignore[arg-type]
+    # pylint: disable=protected-access
+    assert formatter.apply_format().output == formatter._apply_format_json().output
+
+
+def test_splicing_unchanged_sources_is_identity() -> None:
+    contents = json.dumps(output_heavy_notebook(), indent=1)
+    spans = find_code_sources(contents)
+    assert spans is not None
+    assert [span.source for span in spans][-2:] == ["x=1", []]
+    assert splice_sources(contents, spans, [span.source for span in spans]) == contents
+
+
+def test_whitespace_after_the_notebook_is_dropped() -> None:
+    contents = json.dumps(output_heavy_notebook(), indent=1)
+    spans = find_code_sources(contents + "\n")
+    assert spans is not None
+    assert spans == find_code_sources(contents)
+    assert splice_sources(contents + "\n", spans, [span.source for span in spans]) == contents
+    assert find_code_sources(contents + "\nx") is None
+
+
+@mark.parametrize(
+    "dumps_kwargs",
+    [
+        {"indent": 1, "ensure_ascii": False},
+        {"indent": 2},
+        {},
+        {"indent": 1, "sort_keys": True, "separators": (", ", ": ")},
+    ],
+)
+def test_non_canonical_layout_falls_back(dumps_kwargs: Dict[str, Any]) -> None:
+    notebook = output_heavy_notebook()
+    contents = json.dumps(notebook, **dumps_kwargs)
+    assert find_code_sources(contents) is None
+
+    lenient = find_code_sources(contents, strict=False)
+    assert lenient is not None
+    assert [span.source for span in lenient] == [
+        cell["source"] for cell in notebook["cells"] if cell["cell_type"] == "code"
+    ]
+
+    formatter = BlackFormatter("<test>", {}, file_contents=contents)
+    assert formatter.apply_format().output == json.dumps(json.loads(formatter.apply_format().output), indent=1)
+
+
+def test_invalid_documents() -> None:
+    for contents in ('{"cells": "x"}', '{"metadata": {}}', "[]", '{"cells": []} x', '{"cells": [], "cells": []}'):
+        assert find_code_sources(contents, strict=False) is None
+    # Raw control characters are invalid JSON, even if the layout matches
+    assert find_code_sources('{\n "cells": [],\n "x": "a\nb"\n}') is None
+    assert find_code_sources('{\n "cells": [],\n "x": "a\tb"\n}') is None
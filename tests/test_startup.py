@@ -0,0 +1,43 @@
+"""Start-up benchmark of the CLI: black and the formatting machinery must only be imported when there is work."""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict
+
+import jupyterblack
+
+HEAVY_MODULES = ("black", "safer", "attr", "jupyterblack.parser", "jupyterblack.util.processing")
+# Regression threshold of the total import time of a run without formatting work (black alone takes ~200 ms)
+STARTUP_IMPORT_BUDGET_US = 150_000
+
+
+def top_level_import_times(*args: str) -> Dict[str, int]:
+    """Cumulative import time in microseconds of the modules imported at top level by `python -m jupyterblack`."""
+    env = {**os.environ, "PYTHONPATH": str(Path(jupyterblack.__file__).parent.parent)}
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "jupyterblack", *args],
+        capture_output=True,
+        check=False,
+        encoding="utf-8",
+        env=env,
+    )
+    times = {}
+    for line in completed.stderr.splitlines():
+        if line.startswith("import time:"):
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit() and not name.startswith("  "):  # Nested imports are indented
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_help_and_empty_runs_do_not_import_black(tmp_path: Path) -> None:
+    for args in (["--help"], [str(tmp_path)], ["--check", str(tmp_path)]):
+        times = top_level_import_times(*args)
+        assert "jupyterblack.arguments" in times, args
+        assert not set(HEAVY_MODULES) & set(times), args
+        assert sum(times.values()) < STARTUP_IMPORT_BUDGET_US, (args, times)
+
+    (tmp_path / "notebook.ipynb").write_text('{"cells": []}', encoding="utf-8")
+    assert "black" in top_level_import_times("--check", "--no-cache", str(tmp_path))
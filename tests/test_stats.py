@@ -0,0 +1,51 @@
+import json
+from pathlib import Path
+from typing import Callable, List
+
+from pytest import CaptureFixture, mark
+
+from jupyterblack.__main__ import run
+from jupyterblack.util import stats
+from jupyterblack.util.stats import Stats
+
+
+def test_merge_keeps_the_slowest() -> None:
+    parent, child = Stats(top_n=2), Stats(top_n=2)
+    for seconds, file in ((1.0, "a"), (3.0, "b")):
+        parent.record_file(file, seconds)
+    child.record_file("c", 2.0)
+    child.record_file("d", 0.5, is_cached=True)
+    child.record_cell("c", "x = 1\ny = 2", 0.25)
+    parent.merge(child)
+
+    report = parent.to_json(wall_time=4.0)
+    assert [entry["file"] for entry in report["slowest_files"]] == ["b", "c"]
+    assert report["counts"] == {"black_runs": 1, "file_cache_hits": 1, "files": 4}
+    assert report["stages"] == {"black": 0.25}
+    assert report["slowest_cells"] == [{"cell": "c: x = 1", "seconds": 0.25}]
+
+
+def test_collection_is_off_by_default() -> None:
+    assert stats.current() is None
+    with stats.timer("read"):
+        stats.count("files")
+    assert stats.current() is None
+
+
+@mark.parametrize("workers", ["1", "2"])
+def test_stats_are_aggregated_over_workers(
+    workers: str, tmp_path: Path, capsys: CaptureFixture, write_notebooks: Callable[..., List[str]]
+) -> None:
+    write_notebooks(tmp_path, ["a.ipynb", "b.ipynb", "c.ipynb"])
+    stats_path = tmp_path / "stats.json"
+
+    run([str(tmp_path), "-w", workers, "--stats", "--stats-json", str(stats_path)])
+
+    report = json.loads(stats_path.read_text(encoding="utf-8"))
+    assert report["counts"]["files"] == 3
+    assert report["counts"]["black_runs"] > 0
+    assert report["counts"]["cell_cache_hits"] > 0  # Identical cells in the three notebooks
+    assert {"discover", "read", "parse", "black", "write"} <= set(report["stages"])
+    assert len(report["slowest_files"]) == 3 and report["slowest_cells"]
+    assert "slowest notebooks:" in capsys.readouterr().out
+    assert stats.current() is None
@@ -0,0 +1,120 @@
+import io
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+from pytest import CaptureFixture, MonkeyPatch, mark, raises
+
+from jupyterblack.__main__ import run
+from jupyterblack.util.processing import iter_stream_results
+
+
+def set_stdin(monkeypatch: MonkeyPatch, data: str) -> None:
+    monkeypatch.setattr("sys.stdin", io.TextIOWrapper(io.BytesIO(data.encode("utf-8")), encoding="utf-8"))
+
+
+def read_results(out: bytes) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in out.decode("utf-8").splitlines()]
+
+
+def test_format_stdin(
+    monkeypatch: MonkeyPatch, capsysbinary: CaptureFixture, bad_contents: str, fixed_contents: str
+) -> None:
+    set_stdin(monkeypatch, bad_contents)
+    run(["-"])
+    assert capsysbinary.readouterr().out.decode("utf-8") == fixed_contents
+
+    # Notebooks are written in the layout jblack writes notebooks in, like when formatting files
+    set_stdin(monkeypatch, json.dumps(json.loads(fixed_contents), indent=2))
+    run(["-", "--show-invalid-code"])
+    assert capsysbinary.readouterr().out.decode("utf-8") == fixed_contents
+
+
+def test_check_stdin(
+    monkeypatch: MonkeyPatch, capsysbinary: CaptureFixture, bad_contents: str, fixed_contents: str
+) -> None:
+    set_stdin(monkeypatch, bad_contents)
+    with raises(SystemExit, match="Would reformat <stdin>"):
+        run(["--check", "-"])
+    assert not capsysbinary.readouterr().out
+    set_stdin(monkeypatch, bad_contents)
+    run(["--diff", "-"])
+    assert capsysbinary.readouterr().out.decode("utf-8").startswith("--- <stdin>:cell_")
+    set_stdin(monkeypatch, fixed_contents)
+    run(["--check", "-"])
+    set_stdin(monkeypatch, "{")
+    with raises(SystemExit, match="<stdin> is malformed"):
+        run(["-"])
+
+
+@mark.parametrize("workers", ["1", "2"])
+def test_format_ndjson(
+    workers: str, monkeypatch: MonkeyPatch, capsysbinary: CaptureFixture, bad_contents: str, fixed_contents: str
+) -> None:
+    lines = [json.dumps(json.loads(bad_contents)), json.dumps(json.loads(fixed_contents)), "", "{", "[]"]
+    set_stdin(monkeypatch, "\n".join(lines) + "\n")
+    with raises(SystemExit, match="2 lines of stdin not read as notebooks"):
+        run(["--ndjson", "-w", workers, "-"])
+    bad, fixed, not_json, not_notebook = read_results(capsysbinary.readouterr().out)
+    assert bad["line"] == 1 and bad["is_changed"]
+    assert bad["notebook"] == json.loads(fixed_contents)
+    assert fixed["line"] == 2 and not fixed["is_changed"]
+    assert fixed["notebook"] == json.loads(fixed_contents)
+    assert not_json["line"] == 4 and "not valid JSON" in not_json["error"]
+    assert not_notebook["line"] == 5 and "malformed" in not_notebook["error"]
+
+
+def test_ndjson_lines_in_flight_are_bounded(bad_contents: str, fixed_contents: str) -> None:
+    consumed: List[int] = []
+
+    def lines() -> Iterator[str]:
+        for number in range(1, 21):
+            consumed.append(number)
+            yield json.dumps(json.loads(bad_contents if number % 2 else fixed_contents))
+
+    results = iter_stream_results(lines(), {}, n_workers=2)
+    first = json.loads(next(results).text)
+    assert first["line"] == 1
+    assert len(consumed) <= 5
+    numbers = [json.loads(result.text)["line"] for result in results]
+    assert numbers == list(range(2, 21))
+    assert len(consumed) == 20
+
+
+def test_check_ndjson(
+    monkeypatch: MonkeyPatch, capsysbinary: CaptureFixture, bad_contents: str, fixed_contents: str
+) -> None:
+    lines = [json.dumps(json.loads(fixed_contents)), json.dumps(json.loads(bad_contents))]
+    set_stdin(monkeypatch, "\n".join(lines))
+    with raises(SystemExit, match="1 notebook would be reformatted"):
+        run(["--ndjson", "--check", "--diff", "--all-cells", "-"])
+    fixed, bad = read_results(capsysbinary.readouterr().out)
+    assert not fixed["is_changed"] and fixed["failing_cells"] == [] and fixed["diff"] == ""
+    assert bad["is_changed"] and bad["failing_cells"] and bad["diff"].startswith("--- <stdin>:2:cell_")
+    assert "notebook" not in bad
+
+
+def test_stats_of_stdin_go_to_stderr(
+    monkeypatch: MonkeyPatch, capsysbinary: CaptureFixture, bad_contents: str, fixed_contents: str
+) -> None:
+    set_stdin(monkeypatch, bad_contents)
+    run(["--stats", "-"])
+    out, err = capsysbinary.readouterr()
+    assert json.loads(out.decode("utf-8")) == json.loads(fixed_contents)
+    assert "Stats" in err.decode("utf-8")
+
+    set_stdin(monkeypatch, json.dumps(json.loads(bad_contents)) + "\n")
+    run(["--ndjson", "--stats", "-"])
+    out, err = capsysbinary.readouterr()
+    (result,) = read_results(out)
+    assert result["notebook"] == json.loads(fixed_contents)
+    assert "Stats" in err.decode("utf-8")
+
+
+def test_stdin_is_the_only_target(tmp_path: Path) -> None:
+    with raises(SystemExit, match="single target -"):
+        run(["-", str(tmp_path)])
+    with raises(SystemExit, match="single target -"):
+        run(["--ndjson", str(tmp_path)])
+    with raises(SystemExit, match="combined with --watch, --shard"):
+        run(["--watch", "--shard", "1/2", "-"])
@@ -0,0 +1,144 @@
+from itertools import islice
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, Iterator, List
+
+from pytest import MonkeyPatch, raises
+
+from jupyterblack.__main__ import run
+from jupyterblack.util import processing
+from jupyterblack.util.files import compile_regexes, filter_files, read_file
+from jupyterblack.util.processing import auto_workers_lazily
+from jupyterblack.util.targets import iter_target_files, target_file_matcher, targets_to_files
+
+
+def test_default_excludes_prune_directories(write_notebooks: Callable[..., List[str]]) -> None:
+    with TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        kept = write_notebooks(root, ["a.ipynb", "sub/b.ipynb", "sub/deeper/c.ipynb", "builder/d.ipynb"])
+        write_notebooks(
+            root,
+            [
+                ".ipynb_checkpoints/a-checkpoint.ipynb",
+                "sub/.ipynb_checkpoints/b-checkpoint.ipynb",
+                ".git/e.ipynb",
+                ".venv/lib/f.ipynb",
+                "node_modules/pkg/g.ipynb",
+                "build/h.ipynb",
+                "not_a_notebook.py",
+            ],
+        )
+        assert targets_to_files([temp_dir]) == sorted(kept)
+
+
+def test_exclude_and_extend_exclude(write_notebooks: Callable[..., List[str]]) -> None:
+    with TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        write_notebooks(root, ["a.ipynb", "drafts/b.ipynb", "build/c.ipynb", "scratch_d.ipynb"])
+        files = targets_to_files([temp_dir], extend_exclude=r"/drafts/|/scratch_")
+        assert files == [str((root / "a.ipynb").resolve())]
+        # --exclude replaces the default excludes
+        files = targets_to_files([temp_dir], exclude=r"/drafts/")
+        assert [Path(file).relative_to(root.resolve()).as_posix() for file in files] == [
+            "a.ipynb",
+            "build/c.ipynb",
+            "scratch_d.ipynb",
+        ]
+        with raises(SystemExit):
+            iter_target_files([temp_dir], exclude="(")
+
+
+def test_include_is_applied_during_the_walk(bad_contents: str, write_notebooks: Callable[..., List[str]]) -> None:
+    with TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        included = write_notebooks(root, ["reports/a.ipynb", "reports/2020/b.ipynb"])
+        excluded = write_notebooks(root, ["scratch/c.ipynb", "d.ipynb"])
+        assert targets_to_files([temp_dir], include="^/reports/") == sorted(included)
+
+        run(["--include", "^/reports/", "--extend-exclude", "/2020/", temp_dir])
+        assert read_file(included[0]) != bad_contents
+        assert all(read_file(file) == bad_contents for file in [included[1], *excluded])
+
+
+def test_filter_files_compiles_combined_regexes() -> None:
+    files = ["/a/x.ipynb", "/b/y.ipynb", "/c/z.ipynb", "/a/w.py", "/a/v.ipynb.bak"]
+    assert filter_files(files) == ["/a/x.ipynb", "/b/y.ipynb", "/c/z.ipynb"]
+    assert filter_files(files, include_regexes=["/a/", "/b/"]) == ["/a/x.ipynb", "/b/y.ipynb"]
+    assert filter_files(files, exclude_regexes=["/a/", "/c/"]) == ["/b/y.ipynb"]
+    assert compile_regexes(("/a/", "/b/")) is compile_regexes(("/a/", "/b/"))
+    assert compile_regexes(()) is None
+    with raises(SystemExit):
+        filter_files(files, include_regexes=["("])
+
+
+def test_gitignore_rules(write_notebooks: Callable[..., List[str]]) -> None:
+    with TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        kept = write_notebooks(root, ["a.ipynb", "sub/b.ipynb"])
+        write_notebooks(root, ["ignored/c.ipynb", "sub/tmp_d.ipynb", "data/e.ipynb"])
+        (root / ".gitignore").write_text("ignored/\n/data\n", encoding="utf-8")
+        (root / "sub" / ".gitignore").write_text("tmp_*.ipynb\n", encoding="utf-8")
+        assert targets_to_files([temp_dir]) == sorted(kept)
+
+
+def test_explicit_files_are_never_excluded(bad_contents: str, write_notebooks: Callable[..., List[str]]) -> None:
+    with TemporaryDirectory() as temp_dir:
+        checkpoint = write_notebooks(Path(temp_dir), [".ipynb_checkpoints/a-checkpoint.ipynb"])[0]
+        assert targets_to_files([checkpoint, temp_dir, checkpoint]) == [checkpoint]
+
+        run([checkpoint])
+        assert read_file(checkpoint) != bad_contents
+
+
+def test_target_file_matcher_agrees_with_discovery(write_notebooks: Callable[..., List[str]]) -> None:
+    with TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        files = write_notebooks(
+            root,
+            [
+                "a.ipynb",
+                "sub/b.ipynb",
+                "sub/tmp_c.ipynb",
+                "ignored/d.ipynb",
+                "build/e.ipynb",
+                "skipped/f.ipynb",
+                "other/g.ipynb",
+                "other/h.ipynb",
+            ],
+        )
+        (root / ".gitignore").write_text("ignored/\n", encoding="utf-8")
+        (root / "sub" / ".gitignore").write_text("tmp_*.ipynb\n", encoding="utf-8")
+        (root / "notes.txt").write_text("", encoding="utf-8")
+        targets = [str(root), str(root / "other" / "g.ipynb")]
+        discovered = targets_to_files(targets, extend_exclude="/skipped/")
+        is_target_file = target_file_matcher(targets, extend_exclude="/skipped/")
+        assert sorted(file for file in files if is_target_file(file)) == discovered
+        assert not is_target_file(str(root / "notes.txt"))
+        assert not is_target_file(str(root / "missing.ipynb"))
+
+        is_target_file = target_file_matcher([str(root / "other" / "g.ipynb")])
+        assert [file for file in files if is_target_file(file)] == [str(root / "other" / "g.ipynb")]
+
+
+def test_discovery_is_lazy(monkeypatch: MonkeyPatch, write_notebooks: Callable[..., List[str]]) -> None:
+    with TemporaryDirectory() as temp_dir:
+        files = write_notebooks(Path(temp_dir), [f"{i}/{j}.ipynb" for i in range(3) for j in range(3)])
+        assert list(islice(iter_target_files([temp_dir]), 2)) == sorted(files)[:2]
+
+        # With enough work for every CPU, the worker count is known before the discovery is over
+        monkeypatch.setattr(processing, "cpu_count", lambda: 2)
+        monkeypatch.setattr(processing, "AUTO_BYTES_PER_WORKER", 1)
+        discovered: List[str] = []
+
+        def discover() -> Iterator[str]:
+            for file in iter_target_files([temp_dir]):
+                discovered.append(file)
+                yield file
+
+        lazy_files, n_workers = auto_workers_lazily(discover())
+        assert n_workers == 2
+        assert discovered == sorted(files)[:2]
+        assert list(lazy_files) == sorted(files)
+
+        monkeypatch.setattr(processing, "AUTO_BYTES_PER_WORKER", 10**9)
+        assert auto_workers_lazily(iter_target_files([temp_dir])) == (sorted(files), 1)
@@ -0,0 +1,177 @@
+# pylint: disable=redefined-outer-name
+import pickle
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterator, List
+
+from pytest import CaptureFixture, FixtureRequest, MonkeyPatch, fixture, mark
+
+from jupyterblack.__main__ import watch_targets
+from jupyterblack.arguments import parse_args
+from jupyterblack.util import targets
+from jupyterblack.util.cache import Cache
+from jupyterblack.util.targets import targets_to_files, watched_directories
+from jupyterblack.util.watch import InotifyWatcher, PollingWatcher, Watcher, make_watcher, watch
+
+
+def wait_until(condition: Callable[[], bool], timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+@fixture(params=["inotify", "polling"])
+def make(request: FixtureRequest, tmp_path: Path) -> Iterator[Callable[[], Watcher]]:
+    watchers: List[Watcher] = []
+
+    def make_tmp_watcher() -> Watcher:
+        directories, is_watched_dir = watched_directories([str(tmp_path)])
+        watcher = make_watcher(
+            directories, is_watched_dir, lambda: targets_to_files([str(tmp_path)]), polling=request.param == "polling"
+        )
+        watchers.append(watcher)
+        return watcher
+
+    yield make_tmp_watcher
+    for watcher in watchers:
+        watcher.close()
+
+
+def test_watchers_report_saved_notebooks(make: Callable[[], Watcher], tmp_path: Path) -> None:
+    (tmp_path / ".ipynb_checkpoints").mkdir()
+    (tmp_path / "a.ipynb").write_text("{}", encoding="utf-8")
+    watcher = make()
+    assert isinstance(watcher, (InotifyWatcher, PollingWatcher))
+    time.sleep(0.01)
+
+    (tmp_path / "a.ipynb").write_text('{"cells": []}', encoding="utf-8")
+    (tmp_path / ".ipynb_checkpoints" / "a-checkpoint.ipynb").write_text("{}", encoding="utf-8")
+    (tmp_path / "notes.txt").write_text("", encoding="utf-8")
+    assert wait_until(lambda: str(tmp_path / "a.ipynb") in watcher.wait(0.5))
+
+    (tmp_path / "new").mkdir()
+    (tmp_path / "new" / "b.ipynb").write_text("{}", encoding="utf-8")
+    assert wait_until(lambda: str(tmp_path / "new" / "b.ipynb") in watcher.wait(0.5))
+
+
+def test_watch_skips_its_own_writes(make: Callable[[], Watcher], tmp_path: Path) -> None:
+    notebook = tmp_path / "a.ipynb"
+    notebook.write_text("{}", encoding="utf-8")
+    watcher = make()
+    calls: List[List[str]] = []
+    stop = threading.Event()
+
+    def handle(files: List[str]) -> List[str]:
+        calls.append(files)
+        notebook.write_text('{"formatted": true}', encoding="utf-8")
+        return files
+
+    thread = threading.Thread(target=watch, args=(watcher, handle, lambda path: True, stop.is_set))
+    thread.start()
+    try:
+        time.sleep(0.05)
+        notebook.write_text('{"saved": true}', encoding="utf-8")
+        assert wait_until(lambda: len(calls) == 1)
+        time.sleep(1)
+        assert calls == [[str(notebook)]]
+    finally:
+        stop.set()
+        thread.join()
+
+
+@mark.parametrize("poll", [False, True])
+def test_watch_formats_saved_notebooks(
+    poll: bool, tmp_path: Path, capsys: CaptureFixture, bad_contents: str, fixed_contents: str
+) -> None:
+    notebook = tmp_path / "a.ipynb"
+    notebook.write_text(fixed_contents, encoding="utf-8")
+    namespace = parse_args(str(tmp_path), "--watch", *(["--poll"] if poll else []))
+    stop = threading.Event()
+    thread = threading.Thread(target=watch_targets, args=(namespace, stop.is_set))
+    thread.start()
+    try:
+        assert wait_until(lambda: "Watching 1 notebooks" in capsys.readouterr().out)
+        start = time.monotonic()
+        notebook.write_text(bad_contents, encoding="utf-8")
+        assert wait_until(lambda: notebook.read_text(encoding="utf-8") == fixed_contents)
+        assert time.monotonic() - start < 5
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_watch_checks_new_notebooks_and_writes_the_cache_at_most_once_in_a_while(
+    tmp_path: Path,
+    cache_dir: Path,
+    capsys: CaptureFixture,
+    monkeypatch: MonkeyPatch,
+    bad_contents: str,
+    fixed_contents: str,
+) -> None:
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    # The cache directory is in tmp_path, and new directories are discovered
+    tmp_path = tmp_path / "notebooks"
+    (tmp_path / "ignored").mkdir(parents=True)
+    notebook = tmp_path / "a.ipynb"
+    notebook.write_text(fixed_contents, encoding="utf-8")
+    (tmp_path / ".gitignore").write_text("ignored/\n", encoding="utf-8")
+    discoveries: List[List[str]] = []
+    dumps: List[Any] = []
+    original_targets_to_files, original_dump = targets.targets_to_files, pickle.dump
+
+    def record_targets_to_files(*args: Any) -> List[str]:
+        discoveries.append(original_targets_to_files(*args))
+        return discoveries[-1]
+
+    def record_dump(*args: Any, **kwargs: Any) -> None:
+        dumps.append(original_dump(*args, **kwargs))
+
+    monkeypatch.setattr(targets, "targets_to_files", record_targets_to_files)
+    monkeypatch.setattr(pickle, "dump", record_dump)
+    stop = threading.Event()
+    thread = threading.Thread(target=watch_targets, args=(parse_args(str(tmp_path), "--watch"), stop.is_set))
+    thread.start()
+    try:
+        assert wait_until(lambda: "Watching 1 notebooks" in capsys.readouterr().out)
+        n_discoveries = len(discoveries)
+        notebook.write_text(bad_contents, encoding="utf-8")
+        assert wait_until(lambda: notebook.read_text(encoding="utf-8") == fixed_contents)
+        (tmp_path / "b.ipynb").write_text(bad_contents, encoding="utf-8")
+        assert wait_until(lambda: (tmp_path / "b.ipynb").read_text(encoding="utf-8") == fixed_contents)
+        (tmp_path / "ignored" / "c.ipynb").write_text(bad_contents, encoding="utf-8")
+        time.sleep(0.5)
+        assert (tmp_path / "ignored" / "c.ipynb").read_text(encoding="utf-8") == bad_contents
+        assert len(discoveries) == n_discoveries
+        assert len(dumps) == 1
+    finally:
+        stop.set()
+        thread.join()
+    assert len(dumps) == 2
+    cache = Cache.read({}, cache_dir=cache_dir)
+    assert not cache.is_changed(notebook) and not cache.is_changed(tmp_path / "b.ipynb")
+
+
+def test_watch_goes_on_after_a_malformed_save(
+    tmp_path: Path, capsys: CaptureFixture, bad_contents: str, fixed_contents: str
+) -> None:
+    tmp_path = tmp_path / "notebooks"
+    tmp_path.mkdir()
+    notebook = tmp_path / "a.ipynb"
+    notebook.write_text(fixed_contents, encoding="utf-8")
+    stop = threading.Event()
+    thread = threading.Thread(target=watch_targets, args=(parse_args(str(tmp_path), "--watch"), stop.is_set))
+    thread.start()
+    try:
+        assert wait_until(lambda: "Watching 1 notebooks" in capsys.readouterr().out)
+        notebook.write_text('{"cells": [', encoding="utf-8")
+        assert wait_until(lambda: f"File {notebook} is malformed" in capsys.readouterr().err)
+        notebook.write_text(bad_contents, encoding="utf-8")
+        assert wait_until(lambda: notebook.read_text(encoding="utf-8") == fixed_contents)
+        assert thread.is_alive()
+    finally:
+        stop.set()
+        thread.join()